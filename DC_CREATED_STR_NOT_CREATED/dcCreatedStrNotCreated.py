@@ -1,28 +1,40 @@
 import sys
 import os
-import pymysql
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pdi import pdiToTenantMap
-from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
+from tenant_registry import pdiToTenantMap
+from local_mirror import fetch_all
+from lookup_cache import destination_cache
+from checkpoint import NO_CHECKPOINT
+from work_scheduler import scheduler, for_each_tenant
+from purchase_issue_snapshot import on_or_after, not_equal
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
+CHECK_NAME = "dc_created_str_not_created"
+
+def debitNotesFromSnapshot(snapshot, tenant):
+    """fetchDistinctDebitNoteNumbersWithPdi derived from the shared purchase issue snapshot"""
+    seen = set()
+    for row in snapshot.iter_rows(tenant):
+        if (row["item_id"] is None or row["debit_note_number"] is None
+                or not on_or_after(row["invoice_date"], '2025-08-26') or not not_equal(row["pr_type"], 'REGULAR_EASYSOL')):
+            continue
+        seen.add((row["debit_note_number"], row["partner_detail_id"]))
+    return [{"debit_note_number": dnn, "partner_detail_id": pdi} for dnn, pdi in seen]
 
-# Global lock for thread-safe CSV writes
-csv_lock = Lock()
-
-def fetchDistinctDebitNoteNumbersWithPdi(tenant, pdis):
+def fetchDistinctDebitNoteNumbersWithPdi(tenant, pdis, snapshot=None, debit_note_numbers=None):
+    """debit_note_numbers narrows the scan to those notes (event-driven rechecks)"""
+    if snapshot is not None and debit_note_numbers is None:
+        return debitNotesFromSnapshot(snapshot, tenant)
     try:
-        conn = create_db_connection(tenant)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-
         placeholders = ','.join(['%s'] * len(pdis))
+        params = list(pdis)
+        noteFilter = ""
+        if debit_note_numbers is not None:
+            noteFilter = f"AND pi.debit_note_number IN ({','.join(['%s'] * len(debit_note_numbers))})"
+            params += list(debit_note_numbers)
         query = f"""
             SELECT DISTINCT pi.debit_note_number, pi.partner_detail_id
             FROM purchase_issue pi
@@ -32,15 +44,15 @@ def fetchDistinctDebitNoteNumbersWithPdi(tenant, pdis):
               AND pi.pr_type <> 'REGULAR_EASYSOL'
               AND pi.partner_detail_id IN ({placeholders})
               AND pi.status NOT IN ('cancelled', 'DELETED')
+              {noteFilter}
         """
-        cursor.execute(query, pdis)
-        return cursor.fetchall()
+        return fetch_all(tenant, query, params)
         
     except Exception as e:
         print(f"Error fetching debit note numbers for tenant {tenant}: {e}")
-        return []
-    
-def fetchDCForTenant(tenant, listOfDcs, batch_size=500):
+        raise
+
+def fetchDCForTenant(tenant, listOfDcs, batch_size=500, raise_errors=False):
     """
     Fetch distinct invoice_no for a tenant in batches to avoid large IN clauses.
     """
@@ -48,9 +60,6 @@ def fetchDCForTenant(tenant, listOfDcs, batch_size=500):
         if not listOfDcs:
             return []
 
-        conn = create_db_connection(tenant)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-
         results = []
         # Process in chunks
         for i in range(0, len(listOfDcs), batch_size):
@@ -62,55 +71,91 @@ def fetchDCForTenant(tenant, listOfDcs, batch_size=500):
                 WHERE ii.invoice_no IN ({placeholders})
                   AND ii.status NOT IN ('CANCELLED', 'DELETED')
             """
-            cursor.execute(query, batch)
-            results.extend(cursor.fetchall())
+            results.extend(fetch_all(tenant, query, batch))
 
         return results
 
     except Exception as e:
         print(f"Error fetching DC for tenant {tenant}: {e}")
+        if raise_errors:
+            raise
         return []
 
 
-def processTenant(tenant):
-    print(f"Processing tenant: {tenant}")
+def getExistingDCNumbers(tenant, listOfDcs):
+    """
+    DC numbers that exist as inward invoices in the destination tenant.
+    Answers are shared across source tenants through the process-wide lookup cache.
+    """
+    found = destination_cache.get_many(
+        tenant, "dc_invoice_no", listOfDcs,
+        lambda missing: {row['invoice_no']: True for row in fetchDCForTenant(tenant, missing, raise_errors=True)},
+        default=False
+    )
+    return {dc for dc, exists in found.items() if exists}
 
-    pdis = list(pdiToTenantMap.keys())
-    purchaseIssueData = fetchDistinctDebitNoteNumbersWithPdi(tenant, pdis)
 
+def reportMissingDCs(unit, tenant, purchaseIssueData, refresh=False):
+    """
+    Look the tenant's DCs up in their destination tenants and report the missing ones.
+    refresh drops cached destination answers first, for DCs that may have just arrived.
+    """
     pdiToDcMap = defaultdict(list)
     for pi in purchaseIssueData:
         if pi["debit_note_number"].startswith('PE'):
             continue
         pdiToDcMap[pi['partner_detail_id']].append(pi['debit_note_number'])
 
+    # One lookup unit per destination, scheduled on the destination's host
+    futures = {}
     for pdi, dc_list in pdiToDcMap.items():
         dest_tenant = pdiToTenantMap.get(str(pdi))
-        destDCList = fetchDCForTenant(dest_tenant, dc_list)
-        destDCNumbers = {row['invoice_no'] for row in destDCList}
+        if refresh:
+            destination_cache.invalidate(dest_tenant, "dc_invoice_no", dc_list)
+        futures[scheduler.submit(getExistingDCNumbers, dest_tenant, dc_list, db=dest_tenant, tenant=tenant)] = (dest_tenant, dc_list)
+
+    for future in scheduler.wait(futures):
+        dest_tenant, dc_list = futures[future]
+        try:
+            destDCNumbers = future.result()
+        except Exception as e:
+            # Without an answer every DC would look missing, skip this destination instead
+            unit.mark_failed(e)
+            continue
 
         for dc in dc_list:
             if dc not in destDCNumbers:
-                with csv_lock:  # ✅ thread-safe CSV write
-                    append_to_csv(
-                        "dcCreatedStrNotCreated.csv",
-                        {"source_debit_note_number": dc, "dest_tenant": dest_tenant, "source_tenant": tenant}
-                    ,None, CURRENT_DIRECTORY, False)
+                unit.write("dcCreatedStrNotCreated.csv", {"source_debit_note_number": dc, "dest_tenant": dest_tenant, "source_tenant": tenant})
+
+
+def processTenant(tenant, checkpoint=NO_CHECKPOINT, snapshot=None):
+    print(f"Processing tenant: {tenant}")
+
+    with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+        pdis = list(pdiToTenantMap.keys())
+        reportMissingDCs(unit, tenant, fetchDistinctDebitNoteNumbersWithPdi(tenant, pdis, snapshot))
     return tenant
 
-def fetchDCForAllTenants(tenants, max_workers=10):
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(processTenant, tenant): tenant for tenant in tenants}
-        for future in as_completed(futures):
-            tenant = futures[future]
-            try:
-                future.result()
-                print(f"✅ Finished tenant: {tenant}")
-            except Exception as e:
-                print(f"❌ Error processing tenant {tenant}: {e}")
+
+def recheckDebitNotes(tenant, debit_note_numbers, checkpoint=NO_CHECKPOINT):
+    """Re-run the check for a few debit notes of one tenant, bypassing cached destination answers"""
+    with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+        pdis = list(pdiToTenantMap.keys())
+        purchaseIssueData = fetchDistinctDebitNoteNumbersWithPdi(tenant, pdis, debit_note_numbers=list(debit_note_numbers))
+        reportMissingDCs(unit, tenant, purchaseIssueData, refresh=True)
+    return tenant
+
+def fetchDCForAllTenants(tenants, checkpoint=NO_CHECKPOINT, snapshot=None):
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    for_each_tenant(tenants, processTenant, checkpoint, snapshot)
+
+
+@register_check(CHECK_NAME, "DC created in the source tenant but no STR inward invoice in the destination", uses_snapshot=True)
+def runCheck(context):
+    fetchDCForAllTenants(
+        context.tenants, checkpoint=context.checkpoint, snapshot=context.snapshot
+    )
+
 
 if __name__ == "__main__":
-    theas = getAllWarehouse()
-    arsenals = getAllArsenal()
-    all_tenants = theas + arsenals
-    fetchDCForAllTenants(all_tenants, max_workers=10)
+    check_main(CHECK_NAME)
@@ -1,68 +1,80 @@
 import sys
 import os
-import pymysql
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
+from query_batcher import iter_query_across_tenants, run_per_tenant, render_template
+from checkpoint import NO_CHECKPOINT
+from async_engine import run_async, fan_out, checkpoint_unit
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
+CHECK_NAME = "duplicate_str_inward_invoice"
 
-# Global lock for thread-safe CSV writes
-csv_lock = Lock()
+# {tenant} is replaced with the tenant schema, so tenants sharing a DB host
+# are answered with one UNION ALL round trip per group of schemas
+DUPLICATE_INVOICES_QUERY = """
+    SELECT 
+        ii.invoice_no,
+        GROUP_CONCAT(DISTINCT ii.status SEPARATOR ', ')       AS statuses,
+        GROUP_CONCAT(ii.created_on SEPARATOR ', ')            AS created_ons,
+        GROUP_CONCAT(DISTINCT ii.created_by SEPARATOR ', ')   AS created_by,
+        GROUP_CONCAT(ii.total SEPARATOR ', ')                 AS total_amount_invoice,
+        COUNT(*) AS total_count
+    FROM {tenant}.inward_invoice ii
+    WHERE ii.purchase_type IN ('StockTransferReturn', 'ICSReturn')
+    AND ii.status NOT IN ('CANCELLED', 'DELETED')
+    AND ii.created_on >= '2025-08-26'
+    GROUP BY ii.invoice_no
+    HAVING COUNT(*) > 1
+"""
 
 def fetchInwardInvoiceForTenant(tenant):
-    conn = create_db_connection(tenant)
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    return run_per_tenant(DUPLICATE_INVOICES_QUERY, tenant)
 
-    QUERY = """
-        SELECT 
-            ii.invoice_no,
-            GROUP_CONCAT(DISTINCT ii.status SEPARATOR ', ')       AS statuses,
-            GROUP_CONCAT(ii.created_on SEPARATOR ', ')            AS created_ons,
-            GROUP_CONCAT(DISTINCT ii.created_by SEPARATOR ', ')   AS created_by,
-            GROUP_CONCAT(ii.total SEPARATOR ', ')                 AS total_amount_invoice,
-            COUNT(*) AS total_count
-        FROM inward_invoice ii
-        WHERE ii.purchase_type IN ('StockTransferReturn', 'ICSReturn')
-        AND ii.status NOT IN ('CANCELLED', 'DELETED')
-        AND ii.created_on >= '2025-08-26'
-        GROUP BY ii.invoice_no
-        HAVING COUNT(*) > 1
-        ORDER BY total_count DESC
-    """
-    cursor.execute(QUERY)
-    return cursor.fetchall()
-
-def processTenant(tenant):
+def processTenant(tenant, checkpoint=NO_CHECKPOINT):
     print(f"Processing tenant: {tenant}")
 
-    inwardInvoices = fetchInwardInvoiceForTenant(tenant)
-    for inwardInvoice in inwardInvoices:
-        with csv_lock:  # ✅ thread-safe CSV write
-            append_to_csv(
-                "duplicateStrInwardInvoice.csv",
-                {"tenant": tenant, "invoice_no": inwardInvoice["invoice_no"], "statuses": inwardInvoice["statuses"], "created_ons": inwardInvoice["created_ons"], "created_by": inwardInvoice["created_by"], "total_amount_invoice": inwardInvoice["total_amount_invoice"], "total_count": inwardInvoice["total_count"]}
-            ,None, CURRENT_DIRECTORY, False)
+    with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+        writeDuplicates(fetchInwardInvoiceForTenant(tenant), tenant, unit)
+    return tenant
+
+def writeDuplicates(inwardInvoices, tenant, unit):
+    # ORDER BY is dropped inside a UNION ALL branch, so the most duplicated come first here
+    for inwardInvoice in sorted(inwardInvoices, key=lambda row: row["total_count"], reverse=True):
+        unit.write(
+            "duplicateStrInwardInvoice.csv",
+            {"tenant": tenant, "invoice_no": inwardInvoice["invoice_no"], "statuses": inwardInvoice["statuses"], "created_ons": inwardInvoice["created_ons"], "created_by": inwardInvoice["created_by"], "total_amount_invoice": inwardInvoice["total_amount_invoice"], "total_count": inwardInvoice["total_count"]}
+        )
+
+def fetchDuplicateStrInwardInvoiceForAllTenants(tenants, group_size=25, checkpoint=NO_CHECKPOINT):
+    """One UNION ALL statement per group of same-host tenants"""
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    for groupResults in iter_query_across_tenants(DUPLICATE_INVOICES_QUERY, tenants, group_size=group_size):
+        # Tenants whose query failed are missing here and stay pending for --resume
+        for tenant, inwardInvoices in groupResults.items():
+            with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+                writeDuplicates(inwardInvoices, tenant, unit)
+            print(f"✅ Finished tenant: {tenant}")
+
+
+async def processTenantAsync(tenant, engine, checkpoint=NO_CHECKPOINT):
+    print(f"Processing tenant: {tenant}")
+    async with checkpoint_unit(checkpoint, CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+        writeDuplicates(await engine.fetch_all(tenant, render_template(DUPLICATE_INVOICES_QUERY, tenant)), tenant, unit)
     return tenant
 
-def fetchDuplicateStrInwardInvoiceForAllTenants(tenants, max_workers=10):
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(processTenant, tenant): tenant for tenant in tenants}
-        for future in as_completed(futures):
-            tenant = futures[future]
-            try:
-                future.result()
-                print(f"✅ Finished tenant: {tenant}")
-            except Exception as e:
-                print(f"❌ Error processing tenant {tenant}: {e}")
+async def fetchDuplicateStrInwardInvoiceForAllTenantsAsync(engine, tenants, checkpoint=NO_CHECKPOINT):
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    return await fan_out(tenants, processTenantAsync, engine, checkpoint, label=CHECK_NAME)
+
+
+@register_check(CHECK_NAME, "STR inward invoices created more than once")
+def runCheck(context):
+    if context.use_async:
+        run_async(fetchDuplicateStrInwardInvoiceForAllTenantsAsync, context.tenants, context.checkpoint)
+    else:
+        fetchDuplicateStrInwardInvoiceForAllTenants(context.tenants, checkpoint=context.checkpoint)
+
 
 if __name__ == "__main__":
-    theas = getAllWarehouse()
-    arsenals = getAllArsenal()
-    all_tenants = theas + arsenals
-    fetchDuplicateStrInwardInvoiceForAllTenants(all_tenants, max_workers=10)
+    check_main(CHECK_NAME)
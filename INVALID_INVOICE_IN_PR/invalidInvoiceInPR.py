@@ -1,123 +1,143 @@
 import sys
 import os
-import csv
-import pymysql
-import threading
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pdi import pdiToTenantMap
+from tenant_registry import pdiToTenantMap
 from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
+from stream_utils import stream_query
+from checkpoint import NO_CHECKPOINT
+from work_scheduler import for_each_tenant
+from purchase_issue_snapshot import on_or_after, not_equal
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
+BATCH_SIZE = 1000  # Number of purchase issues validated per invoice index read
+CHECK_NAME = "invalid_invoice_in_pr"
 
+def streamPurchaseIssues(tenant, pdis, batch_size=BATCH_SIZE):
+    """Yield purchase issues in keyset pages"""
+    if not pdis:
+        return iter(())
+    placeholders = ','.join(['%s'] * len(pdis))
+    query = f"""
+        SELECT id, partner_detail_id, tray_id, invoice_id, invoice_no,
+               invoice_sequence_type, pr_type, invoice_date, invoice_tenant, status , debit_note_number
+        FROM purchase_issue
+        WHERE pr_type <> 'REGULAR_EASYSOL'
+          AND status not in ('cancelled', 'DELETED')
+          AND partner_detail_id IN ({placeholders})
+          AND created_on >= '2025-08-26'
+    """
+    return stream_query(tenant, query, tuple(pdis), batch_size=batch_size)
 
-# Thread lock for safe CSV writes
-csv_lock = threading.Lock()
 
-def fetchPurchaseIssues(tenant, pdis):
-    if not pdis:
-        return []
+def purchaseIssuesFromSnapshot(snapshot, tenant, batch_size=BATCH_SIZE):
+    """streamPurchaseIssues derived from the shared snapshot, one row per purchase issue"""
+    seen = set()
+    batch = []
+    for row in snapshot.iter_rows(tenant):
+        if row["purchase_issue_id"] in seen:
+            continue
+        if not not_equal(row["pr_type"], 'REGULAR_EASYSOL') or not on_or_after(row["created_on"], '2025-08-26'):
+            continue
+        seen.add(row["purchase_issue_id"])
+        batch.append({
+            "id": row["purchase_issue_id"], "partner_detail_id": row["partner_detail_id"], "tray_id": row["tray_id"],
+            "invoice_id": row["invoice_id"], "invoice_no": row["invoice_no"], "invoice_sequence_type": row["invoice_sequence_type"],
+            "pr_type": row["pr_type"], "invoice_date": row["invoice_date"], "invoice_tenant": row["invoice_tenant"],
+            "status": row["status"], "debit_note_number": row["debit_note_number"],
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def fetchInvoiceIndex(tenant, invoiceIds, batch_size=1000):
+    """
+    Build an in-memory {id: (purchase_type, partner_detail_id)} index of inward invoices,
+    reading them with id IN (...) chunks over a single connection.
+    """
+    invoiceIndex = {}
+    if not invoiceIds:
+        return invoiceIndex
+
+    conn = create_db_connection(tenant)
     try:
-        conn = create_db_connection(tenant)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-        placeholders = ','.join(['%s'] * len(pdis))
-        query = f"""
-            SELECT id, partner_detail_id, tray_id, invoice_id, invoice_no,
-                   invoice_sequence_type, pr_type, invoice_date, invoice_tenant, status , debit_note_number
-            FROM purchase_issue
-            WHERE pr_type <> 'REGULAR_EASYSOL'
-              AND status not in ('cancelled', 'DELETED')
-              AND partner_detail_id IN ({placeholders})
-              AND created_on >= '2025-08-26'
-        """
-        cursor.execute(query, tuple(pdis))
-        return cursor.fetchall()
-    except Exception as e:
-        print(f"Error fetching purchase issues for tenant {tenant}: {e}")
-        return []
-    finally:
+        cursor = conn.cursor()
+        for i in range(0, len(invoiceIds), batch_size):
+            batch = invoiceIds[i:i + batch_size]
+            placeholders = ','.join(['%s'] * len(batch))
+            cursor.execute(f"""
+                SELECT id, purchase_type, partner_detail_id
+                FROM inward_invoice
+                WHERE id IN ({placeholders})
+            """, tuple(batch))
+            for invoiceId, purchase_type, partner_detail_id in cursor.fetchall():
+                invoiceIndex[str(invoiceId)] = (purchase_type, partner_detail_id)
         cursor.close()
+        return invoiceIndex
+    finally:
         conn.close()
 
 
-def validateInvoiceWithConnection(cursor, invoiceId, pdi):
+def validateInvoiceFromIndex(invoiceIndex, invoiceId, pdi):
     if invoiceId is None:
         return True
-    cursor.execute("""
-        SELECT purchase_type, partner_detail_id
-        FROM inward_invoice
-        WHERE id = %s
-    """, (invoiceId,))
-    invoice = cursor.fetchone()
+    invoice = invoiceIndex.get(str(invoiceId))
     if not invoice:
         return False
-    if(invoice["purchase_type"] not in ("ICS", "StockTransfer")):
+    purchase_type, partner_detail_id = invoice
+    if(purchase_type not in ("ICS", "StockTransfer")):
         return True
     return (
-        invoice["purchase_type"] in ("ICS", "StockTransfer") and
-        str(invoice["partner_detail_id"]) == str(pdi)
+        purchase_type in ("ICS", "StockTransfer") and
+        str(partner_detail_id) == str(pdi)
     )
 
-def validate_invoice(pi, tenant):
-    pdi = str(pi['partner_detail_id'])
-    if pdi not in pdiToTenantMap:
-        return
-    dest_tenant = pdiToTenantMap[pdi]
-    try:
-        conn = create_db_connection(tenant)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-        if not validateInvoiceWithConnection(cursor, pi['invoice_id'], pdi):
-            isInvoiceTenantSame = pi['invoice_tenant'] == tenant
-            row = {
-                "dest_tenant": dest_tenant, "source_tenant": tenant, "purchase_issue_id": pi['id'], "invoice_id": pi['invoice_id'], "invoice_no": pi['invoice_no'],
-                "pr_type": pi['pr_type'], "invoice_tenant": pi['invoice_tenant'], "is_invoice_tenant_same": isInvoiceTenantSame, "status": pi['status'] , "debit_note_number": pi['debit_note_number']
-            }
-            with csv_lock:
-                append_to_csv(
-                    "invalidInvoiceInPR.csv",
-                    row, None, CURRENT_DIRECTORY, False
-                )
-    except Exception as e:
-        print(f"Error validating invoice for PI {pi['id']} in tenant {tenant}: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
-def fetchInvalidInvoiceInPR(tenant):
+def processPurchaseIssueBatch(purchaseIssues, tenant, unit):
+    purchaseIssues = [
+        pi for pi in purchaseIssues
+        if pi['invoice_id'] is not None and str(pi['partner_detail_id']) in pdiToTenantMap
+    ]
+    invoiceIds = list({pi['invoice_id'] for pi in purchaseIssues})
+    invoiceIndex = fetchInvoiceIndex(tenant, invoiceIds)
+
+    for pi in purchaseIssues:
+        pdi = str(pi['partner_detail_id'])
+        if validateInvoiceFromIndex(invoiceIndex, pi['invoice_id'], pdi):
+            continue
+        isInvoiceTenantSame = pi['invoice_tenant'] == tenant
+        unit.write("invalidInvoiceInPR.csv", {
+            "dest_tenant": pdiToTenantMap[pdi], "source_tenant": tenant, "purchase_issue_id": pi['id'], "invoice_id": pi['invoice_id'], "invoice_no": pi['invoice_no'],
+            "pr_type": pi['pr_type'], "invoice_tenant": pi['invoice_tenant'], "is_invoice_tenant_same": isInvoiceTenantSame, "status": pi['status'] , "debit_note_number": pi['debit_note_number']
+        })
+
+
+def fetchInvalidInvoiceInPR(tenant, checkpoint=NO_CHECKPOINT, snapshot=None):
     if tenant in ('th303' , 'th997' , 'th438'):
         return
     pdis = list(pdiToTenantMap.keys())
-    purchaseIssues = fetchPurchaseIssues(tenant, pdis)
-    if not purchaseIssues:
-        return
+    with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+        # Each streamed batch is validated with one invoice index read, memory stays bounded by BATCH_SIZE
+        batches = purchaseIssuesFromSnapshot(snapshot, tenant) if snapshot is not None else streamPurchaseIssues(tenant, pdis)
+        for purchaseIssues in batches:
+            processPurchaseIssueBatch(purchaseIssues, tenant, unit)
+
+
+def fetchInvalidInvoiceInPRForAllTenants(tenants, checkpoint=NO_CHECKPOINT, snapshot=None):
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    for_each_tenant(tenants, fetchInvalidInvoiceInPR, checkpoint, snapshot)
+
+
+@register_check(CHECK_NAME, "Purchase returns pointing at an invalid invoice", uses_snapshot=True)
+def runCheck(context):
+    fetchInvalidInvoiceInPRForAllTenants(
+        context.tenants, checkpoint=context.checkpoint, snapshot=context.snapshot
+    )
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-        for pi in purchaseIssues:
-            if pi['invoice_id'] is not None:
-                futures.append(executor.submit(validate_invoice, pi, tenant))
-        for f in as_completed(futures):
-            f.result()
-
-
-def fetchInvalidInvoiceInPRForAllTenants(tenants, max_workers=10):
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(fetchInvalidInvoiceInPR, tenant): tenant for tenant in tenants}
-        for future in as_completed(futures):
-            tenant = futures[future]
-            try:
-                future.result()
-                print(f"✅ Finished tenant: {tenant}")
-            except Exception as e:
-                print(f"❌ Error processing tenant {tenant}: {e}")
 
 if __name__ == "__main__":
-    theas = getAllWarehouse()
-    arsenals = getAllArsenal()
-    all_tenants = theas + arsenals
-    fetchInvalidInvoiceInPRForAllTenants(all_tenants, max_workers=10)
+    check_main(CHECK_NAME)
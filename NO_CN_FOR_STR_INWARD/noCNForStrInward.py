@@ -1,29 +1,23 @@
 import sys
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import pymysql
-from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
+from stream_utils import stream_query, process_stream
+from async_engine import run_async, fan_out, stream_pages, process_pages, checkpoint_unit, fetch_all_blocking
+from checkpoint import NO_CHECKPOINT
+from work_scheduler import for_each_tenant
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
-CSV_LOCK = Lock()  # Thread-safe CSV writes
 BATCH_SIZE = 500
+CHECK_NAME = "no_cn_for_str_inward"
+INWARD_INVOICES_QUERY = "SELECT id as invoice_id , invoice_no , created_on FROM inward_invoice WHERE purchase_type in ('StockTransferReturn' , 'ICSReturn') and status = 'live' and created_on >= '2025-05-28'"
 
-def safe_append_to_csv(filename, rows):
-    """Thread-safe CSV append"""
-    with CSV_LOCK:
-        append_to_csv(filename, rows, output_dir=CURRENT_DIRECTORY)
-
-def fetchCNsForInwardInvoices(invoiceIdList, tenant):
+def buildCNQuery(invoiceIdList, tenant):
     noteTypes = ['ICS_RETURN' , 'ST_RETURN']
-    connection = create_db_connection("vault")
-    cursor = connection.cursor(pymysql.cursors.DictCursor)
     placeholders_invoice = ','.join(['%s'] * len(invoiceIdList))
     placeholders_note = ','.join(['%s'] * len(noteTypes))
     sql = f"""
@@ -33,65 +27,101 @@ def fetchCNsForInwardInvoices(invoiceIdList, tenant):
     AND note_type IN ({placeholders_note}) 
     AND tenant = %s
     """
-    cursor.execute(sql, invoiceIdList + noteTypes + [tenant])
+    return sql, list(invoiceIdList) + noteTypes + [tenant]
+
+def fetchCNsForInwardInvoices(invoiceIdList, tenant):
+    connection = create_db_connection("vault")
+    cursor = connection.cursor(pymysql.cursors.DictCursor)
+    cursor.execute(*buildCNQuery(invoiceIdList, tenant))
     cnResult = cursor.fetchall()
     cursor.close()
     connection.close()
 
     return cnResult
 
-def fetchInwardInvoicesForTenant(tenant):
-    conn = create_db_connection(tenant)
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
-    cursor.execute("SELECT id as invoice_id , invoice_no , created_on FROM inward_invoice WHERE purchase_type in ('StockTransferReturn' , 'ICSReturn') and status = 'live' and created_on >= '2025-05-28'")
-    inwardInvoices = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return inwardInvoices
+def streamInwardInvoicesForTenant(tenant, batch_size=BATCH_SIZE):
+    """Yield inward invoices in keyset pages"""
+    return stream_query(tenant, INWARD_INVOICES_QUERY, batch_size=batch_size, key="id", key_field="invoice_id")
 
-def processInwardInvoiceBatch(inwardInvoiceBatch, tenant):
+def processInwardInvoiceBatch(inwardInvoiceBatch, tenant, unit):
     invoiceIdList = [inwardInvoice["invoice_id"] for inwardInvoice in inwardInvoiceBatch]
-    cnResult = fetchCNsForInwardInvoices(invoiceIdList, tenant)
-    cnPresent = [invoice["return_order_id"] for invoice in cnResult]
+    reportMissingCNs(inwardInvoiceBatch, fetchCNsForInwardInvoices(invoiceIdList, tenant), tenant, unit)
+
+def reportMissingCNs(inwardInvoiceBatch, cnResult, tenant, unit):
+    cnPresent = {invoice["return_order_id"] for invoice in cnResult}
 
     for invoice in inwardInvoiceBatch:
         if invoice["invoice_id"] not in cnPresent:
-            safe_append_to_csv("noCNForStrInward.csv", {"invoice_id": invoice["invoice_id"], "invoice_no": invoice["invoice_no"], "created_on": invoice["created_on"], "tenant": tenant})
-
-def process_tenant(tenant):
+            unit.write("noCNForStrInward.csv", {"invoice_id": invoice["invoice_id"], "invoice_no": invoice["invoice_no"], "created_on": invoice["created_on"], "tenant": tenant})
+
+def recheckInvoices(tenant, invoiceIds, checkpoint=NO_CHECKPOINT):
+    """Re-run the check for a few inward invoices (or CN return_order_ids) of one tenant"""
+    invoiceIds = list(invoiceIds)
+    with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+        for i in range(0, len(invoiceIds), BATCH_SIZE):
+            batch = invoiceIds[i:i + BATCH_SIZE]
+            query = INWARD_INVOICES_QUERY + f" AND id IN ({','.join(['%s'] * len(batch))})"
+            inwardInvoiceBatch = fetch_all_blocking(tenant, query, batch)
+            if inwardInvoiceBatch:
+                processInwardInvoiceBatch(inwardInvoiceBatch, tenant, unit)
+    return tenant
+
+def process_tenant(tenant, checkpoint=NO_CHECKPOINT):
     """Run SQL query for a tenant and save results"""
     try:
-        inwardInvoices = fetchInwardInvoicesForTenant(tenant)
-        print(f"Processing tenant: {tenant} with invoice records: {len(inwardInvoices)}")
+        print(f"Processing tenant: {tenant}")
+
+        with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+            # Batches are processed while the rest of the invoices are still streaming in
+            batches = streamInwardInvoicesForTenant(tenant)
+            totalBatches = process_stream(
+                batches, processInwardInvoiceBatch, tenant, unit, label=tenant, on_error=unit.mark_failed,
+                db="vault"
+            )
 
-        if len(inwardInvoices) == 0:
+        if totalBatches == 0:
             print(f"No inward invoices found for tenant {tenant}")
             return
 
-        batches = [inwardInvoices[i:i+BATCH_SIZE] for i in range(0, len(inwardInvoices), BATCH_SIZE)]
-        with ThreadPoolExecutor(max_workers=10) as batch_executor:
-            futures = [batch_executor.submit(processInwardInvoiceBatch, batch, tenant) for batch in batches]
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"❌ Error in batch for tenant {tenant}: {e}")
+        print(f"Processed tenant: {tenant} with invoice batches: {totalBatches}")
     except Exception as e:
         print(f"❌ Error running query for tenant {tenant}: {e}")
 
 
-def processAllTenants(tenants, max_workers=10):
-    """Run query for all tenants concurrently"""
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_tenant, tenant): tenant for tenant in tenants}
-        for future in as_completed(futures):
-            tenant = futures[future]
-            try:
-                future.result()
-            except Exception as e:
-                print(f"❌ Exception in tenant {tenant}: {e}")
+def processAllTenants(tenants, checkpoint=NO_CHECKPOINT):
+    """Run query for all tenants concurrently, one scheduler unit per tenant"""
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    for_each_tenant(tenants, process_tenant, checkpoint)
+
+
+async def processInwardInvoiceBatchAsync(inwardInvoiceBatch, engine, tenant, unit):
+    invoiceIdList = [inwardInvoice["invoice_id"] for inwardInvoice in inwardInvoiceBatch]
+    cnResult = await engine.fetch_all("vault", *buildCNQuery(invoiceIdList, tenant))
+    reportMissingCNs(inwardInvoiceBatch, cnResult, tenant, unit)
+
+async def processTenantAsync(tenant, engine, checkpoint=NO_CHECKPOINT):
+    """process_tenant on the async engine: invoice pages are looked up in vault while the next ones are fetched"""
+    print(f"Processing tenant: {tenant}")
+    async with checkpoint_unit(checkpoint, CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+        pages = stream_pages(engine, tenant, INWARD_INVOICES_QUERY, batch_size=BATCH_SIZE, key="id", key_field="invoice_id")
+        totalBatches = await process_pages(
+            pages, processInwardInvoiceBatchAsync, engine, tenant, unit, label=tenant, on_error=unit.mark_failed
+        )
+    print(f"Processed tenant: {tenant} with invoice batches: {totalBatches}")
+
+async def processAllTenantsAsync(engine, tenants, checkpoint=NO_CHECKPOINT):
+    """All tenants fanned out at once; the engine's per-host limits bound the load"""
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    return await fan_out(tenants, processTenantAsync, engine, checkpoint, label=CHECK_NAME)
+
+
+@register_check(CHECK_NAME, "STR inward invoices without a CN")
+def runCheck(context):
+    if context.use_async:
+        run_async(processAllTenantsAsync, context.tenants, context.checkpoint)
+    else:
+        processAllTenants(context.tenants, checkpoint=context.checkpoint)
 
 
 if __name__ == "__main__":
-    tenants = getAllWarehouse() + getAllArsenal()
-    processAllTenants(tenants, max_workers=10)
+    check_main(CHECK_NAME)
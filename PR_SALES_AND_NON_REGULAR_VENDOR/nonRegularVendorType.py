@@ -1,90 +1,67 @@
 import sys
 import os
-import pymysql
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
+from stream_utils import stream_query, process_stream
+from checkpoint import NO_CHECKPOINT
+from work_scheduler import for_each_tenant
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
-csv_lock = Lock()  # Thread-safe CSV writing
 BATCH_SIZE = 500  # Number of purchase issues per batch
+CHECK_NAME = "non_regular_vendor_type"
 
-def processPurchaseIssueBatch(batch_purchaseIssues, tenant):
+def processPurchaseIssueBatch(batch_purchaseIssues, tenant, unit):
     for purchaseIssue in batch_purchaseIssues:
-        with csv_lock:
-                append_to_csv(
-                    "nonRegularVendorType.csv",
-                    {
-                        "tenant": tenant,
-                        "pre_purchase_issue_order_id": purchaseIssue["id"],
-                        "vendor_type": purchaseIssue["vendor_type"],
-                        "partner_detail_id": purchaseIssue["partner_detail_id"],
-                        "created_on": purchaseIssue["created_on"],
-                        "status": purchaseIssue["status"],
-                    },
-                    output_dir=CURRENT_DIRECTORY
-                )
+        unit.write(
+            "nonRegularVendorType.csv",
+            {
+                "tenant": tenant,
+                "pre_purchase_issue_order_id": purchaseIssue["id"],
+                "vendor_type": purchaseIssue["vendor_type"],
+                "partner_detail_id": purchaseIssue["partner_detail_id"],
+                "created_on": purchaseIssue["created_on"],
+                "status": purchaseIssue["status"],
+            }
+        )
 
 
-def fetchPrePurchaseIssuesForTenant(tenant):
-
-    conn = create_db_connection(tenant)
-    try:
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-        query = f"""
-            SELECT pi.id, pi.vendor_type, pi.partner_detail_id, pi.created_on , pi.status
-            FROM pre_purchase_issue_order pi
-            WHERE pi.vendor_type IN ('PRIMARY', 'SECONDARY')
-              AND pi.status = 'CREATED'
-              AND pi.created_on >= '2025-07-01'
-        """
-        cursor.execute(query)
-        return cursor.fetchall()
-    finally:
-        conn.close()
+def streamPrePurchaseIssuesForTenant(tenant, batch_size=BATCH_SIZE):
+    """Yield pre purchase issue orders in keyset pages"""
+    query = f"""
+        SELECT pi.id, pi.vendor_type, pi.partner_detail_id, pi.created_on , pi.status
+        FROM pre_purchase_issue_order pi
+        WHERE pi.vendor_type IN ('PRIMARY', 'SECONDARY')
+          AND pi.status = 'CREATED'
+          AND pi.created_on >= '2025-07-01'
+    """
+    return stream_query(tenant, query, batch_size=batch_size, key="pi.id")
 
 
-def processTenant(tenant):
-    """Fetch all purchase issues for a tenant and process in batches"""
+def processTenant(tenant, checkpoint=NO_CHECKPOINT):
+    """Stream all purchase issues for a tenant and process them in batches"""
     try:
         print(f"Processing tenant: {tenant}")
-        allPurchaseIssues = fetchPrePurchaseIssuesForTenant(tenant)
-        if not allPurchaseIssues:
-            return
-
-        # Split into batches
-        batches = [allPurchaseIssues[i:i + BATCH_SIZE] for i in range(0, len(allPurchaseIssues), BATCH_SIZE)]
-
-        # Process batches concurrently
-        with ThreadPoolExecutor(max_workers=10) as batch_executor:
-            futures = [batch_executor.submit(processPurchaseIssueBatch, batch, tenant) for batch in batches]
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"❌ Error in batch for tenant {tenant}: {e}")
+        with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+            # Process batches concurrently while the rest of the rows are still streaming in
+            batches = streamPrePurchaseIssuesForTenant(tenant)
+            process_stream(
+                batches, processPurchaseIssueBatch, tenant, unit, label=tenant, on_error=unit.mark_failed
+            )
     except Exception as e:
         print(f"❌ Error in processTenant for tenant {tenant}: {e}")
 
 
-def processAllTenants(tenants, max_workers=10):
-    """Process all tenants concurrently"""
-    with ThreadPoolExecutor(max_workers=max_workers) as tenant_executor:
-        futures = {tenant_executor.submit(processTenant, tenant): tenant for tenant in tenants}
-        for future in as_completed(futures):
-            tenant = futures[future]
-            try:
-                future.result()
-                print(f"✅ Finished tenant: {tenant}")
-            except Exception as e:
-                print(f"❌ Error processing tenant {tenant}: {e}")
+def processAllTenants(tenants, checkpoint=NO_CHECKPOINT):
+    """Process all tenants concurrently, one scheduler unit per tenant"""
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    for_each_tenant(tenants, processTenant, checkpoint)
+
+
+@register_check(CHECK_NAME, "Pre purchase issue orders with a non regular vendor type")
+def runCheck(context):
+    processAllTenants(context.tenants, checkpoint=context.checkpoint)
 
 
 if __name__ == "__main__":
-    tenants = getAllWarehouse() + getAllArsenal()
-    processAllTenants(tenants, max_workers=10)
\ No newline at end of file
+    check_main(CHECK_NAME)
@@ -2,72 +2,47 @@ import sys
 import os
 import traceback
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from concurrent.futures import as_completed
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
-from pdi import pdiToTenantMap
-
-# Use the keys (partner_detail_ids), not the values (tenants)
-partner_detail_ids = list(pdiToTenantMap.keys())
-partner_detail_ids_sql = ",".join(f"'{pdi}'" for pdi in partner_detail_ids)
+from tenant_registry import pdiToTenantMap
+from query_batcher import iter_query_across_tenants
+from lookup_cache import destination_cache
+from checkpoint import NO_CHECKPOINT
+from work_scheduler import scheduler
+from purchase_issue_snapshot import on_or_after, has_text
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
+CHECK_NAME = "ucode_never_inward"
 
-# Global CSV lock for thread safety
-csv_lock = Lock()
 
+# Schema-qualified per-tenant template ({tenant} is filled by query_batcher).
+# One scan covers both reports; dc_generated tells them apart.
+REQUIRED_UCODES_QUERY = """
+    SELECT DISTINCT pi.partner_detail_id, LPAD(pii.ucode, 6, '0') as ucode,
+           CASE WHEN pi.debit_note_number IS NOT NULL AND pi.debit_note_number != '' THEN 1 ELSE 0 END as dc_generated
+    FROM {tenant}.purchase_issue pi
+    JOIN {tenant}.purchase_issue_item pii
+        ON pii.purchase_issue_id = pi.id
+    WHERE pi.status NOT IN ('cancelled', 'DELETED')
+    AND pi.partner_detail_id IN ({partner_detail_ids})
+    AND pi.created_on >= '2025-08-26'
+"""
 
-def safe_append_to_csv(filename, row):
-    """Thread-safe CSV writer"""
-    with csv_lock:
-        append_to_csv(filename, row, None, CURRENT_DIRECTORY, None)
 
+def requiredUcodesQuery():
+    """REQUIRED_UCODES_QUERY for the partner detail IDs in the tenant registry"""
+    # Use the keys (partner_detail_ids), not the values (tenants)
+    partner_detail_ids_sql = ",".join(f"'{pdi}'" for pdi in pdiToTenantMap.keys())
+    return REQUIRED_UCODES_QUERY.replace("{partner_detail_ids}", partner_detail_ids_sql)
 
-def getPurchaseIssuesWhereDCisNotGenerated(tenant):
-    SQL_QUERY = f"""
-        SELECT DISTINCT pi.partner_detail_id, LPAD(pii.ucode, 6, '0') as ucode
-        FROM {tenant}.purchase_issue pi
-        JOIN {tenant}.purchase_issue_item pii
-            ON pii.purchase_issue_id = pi.id
-        WHERE pi.status NOT IN ('cancelled', 'DELETED')
-        AND pi.partner_detail_id IN ({partner_detail_ids_sql})
-        AND (pi.debit_note_number IS NULL OR pi.debit_note_number = '')
-        AND pi.created_on >= '2025-08-26'
-    """
-    conn = create_db_connection("mercury")
-    cursor = conn.cursor()
-    cursor.execute(SQL_QUERY)
-    result = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return result
-
-
-def getPurchaseIssuesWhereDCisGenerated(tenant):
-    SQL_QUERY = f"""
-        SELECT DISTINCT pi.partner_detail_id, LPAD(pii.ucode, 6, '0') as ucode
-        FROM {tenant}.purchase_issue pi
-        JOIN {tenant}.purchase_issue_item pii
-            ON pii.purchase_issue_id = pi.id
-        WHERE pi.status NOT IN ('cancelled', 'DELETED')
-        AND pi.partner_detail_id IN ({partner_detail_ids_sql})
-        AND pi.debit_note_number IS NOT NULL
-        AND pi.debit_note_number != ''
-        AND pi.created_on >= '2025-08-26'
-    """
-    conn = create_db_connection("mercury")
-    cursor = conn.cursor()
-    cursor.execute(SQL_QUERY)
-    result = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return result
+REPORT_FILES = {
+    0: "ucodeNeverInwardForDCNotGenerated.csv",
+    1: "ucodeNeverInwardForDCGenerated.csv",
+}
 
 
 def getInwardInvoices(tenant, ucodes, batch_size=500):
@@ -96,70 +71,145 @@ def getInwardInvoices(tenant, ucodes, batch_size=500):
     return results
 
 
-def handleUcodeMissingWhenDCisNotGenerated(tenant):
-    purchaseIssues = getPurchaseIssuesWhereDCisNotGenerated(tenant)
-    pdiToUcodeMap = defaultdict(set)
-    for partner_detail_id, ucode in purchaseIssues:
-        pdiToUcodeMap[partner_detail_id].add(ucode)
-
-    for partner_detail_id, ucodes in pdiToUcodeMap.items():
-        dest_tenant = pdiToTenantMap[str(partner_detail_id)]
-        inwardInvoiceItems = set(getInwardInvoices(dest_tenant, list(ucodes)))
-        for ucode in ucodes:
-            if ucode not in inwardInvoiceItems:
-                print(f"processing tenant: {tenant} , partner_detail_id: {partner_detail_id} , ucode: {ucode} , dest_tenant: {dest_tenant}")
-                safe_append_to_csv(
-                    "ucodeNeverInwardForDCNotGenerated.csv",
-                    {"tenant": tenant,
-                     "partner_detail_id": partner_detail_id,
-                     "ucode": ucode,
-                     "dest_tenant": dest_tenant}
-                )
-
-
-def handleUcodeMissingWhenDCisGenerated(tenant):
-    purchaseIssues = getPurchaseIssuesWhereDCisGenerated(tenant)
-    pdiToUcodeMap = defaultdict(set)
-    for partner_detail_id, ucode in purchaseIssues:
-        pdiToUcodeMap[partner_detail_id].add(ucode)
-
-    for partner_detail_id, ucodes in pdiToUcodeMap.items():
-        dest_tenant = pdiToTenantMap[str(partner_detail_id)]
-        inwardInvoiceItems = set(getInwardInvoices(dest_tenant, list(ucodes)))
-        for ucode in ucodes:
-            if ucode not in inwardInvoiceItems:
-                print(f"processing tenant: {tenant} , partner_detail_id: {partner_detail_id} , ucode: {ucode} , dest_tenant: {dest_tenant}")
-                safe_append_to_csv(
-                    "ucodeNeverInwardForDCGenerated.csv",
-                    {"tenant": tenant,
-                     "partner_detail_id": partner_detail_id,
-                     "ucode": ucode,
-                     "dest_tenant": dest_tenant}
-                )
-
-
-def process_tenant(tenant):
-    print(f"Processing tenant: {tenant}")
-    handleUcodeMissingWhenDCisNotGenerated(tenant)
-    handleUcodeMissingWhenDCisGenerated(tenant)
-    return tenant
+def getInwardedUcodes(tenant, ucodes):
+    """Ucodes that were inwarded in the destination tenant, answered from the shared lookup cache"""
+    found = destination_cache.get_many(
+        tenant, "inwarded_ucode", ucodes,
+        lambda missing: {code: True for code in getInwardInvoices(tenant, missing)},
+        default=False
+    )
+    return {ucode for ucode, inwarded in found.items() if inwarded}
+
+
+def lpadUcode(ucode):
+    """LPAD(ucode, 6, '0'): pads short codes and, like MySQL, cuts longer ones to 6"""
+    return None if ucode is None else str(ucode).rjust(6, '0')[:6]
+
+
+def requiredUcodesFromSnapshot(snapshot, tenant):
+    """REQUIRED_UCODES_QUERY's rows for one tenant, derived from the shared purchase issue snapshot"""
+    rows = set()
+    for row in snapshot.iter_rows(tenant):
+        if row["item_id"] is None or not on_or_after(row["created_on"], '2025-08-26'):
+            continue
+        rows.add((row["partner_detail_id"], lpadUcode(row["ucode"]), 1 if has_text(row["debit_note_number"]) else 0))
+    return [{"partner_detail_id": pdi, "ucode": ucode, "dc_generated": dc_generated} for pdi, ucode, dc_generated in rows]
+
+
+def iterSnapshotResults(snapshot, tenants):
+    """Same {tenant: rows} groups as iter_query_across_tenants, one per tenant, read from the snapshot"""
+    futures = {scheduler.submit(requiredUcodesFromSnapshot, snapshot, tenant, db=tenant): tenant for tenant in tenants}
+    for future in as_completed(futures):
+        tenant = futures[future]
+        try:
+            yield {tenant: future.result()}
+        except Exception as e:
+            print(f"❌ Error reading snapshot for tenant {tenant}: {e}")
+
+
+def collectRequiredUcodes(tenants, snapshot=None):
+    """
+    Phase one: read the (partner_detail_id, ucode) pairs of every source tenant,
+    one UNION ALL round trip per group of same-host tenants (or from the shared snapshot).
+    Returns {(tenant, dc_generated, partner_detail_id): ucodes}, {dest_tenant: union of ucodes}
+    and the source tenants that were read successfully. Rows of a partner detail ID the
+    tenant registry does not map to a tenant are logged and skipped.
+    """
+    sourceUcodes = defaultdict(set)
+    destUcodes = defaultdict(set)
+    collected = []
+    if snapshot is not None:
+        results = iterSnapshotResults(snapshot, tenants)
+    else:
+        results = iter_query_across_tenants(requiredUcodesQuery(), tenants)
+    for groupResults in results:
+        for tenant, rows in groupResults.items():
+            print(f"Collected ucodes for tenant: {tenant} ({len(rows)} rows)")
+            collected.append(tenant)
+            unmapped = set()
+            for row in rows:
+                partner_detail_id = row["partner_detail_id"]
+                dest_tenant = pdiToTenantMap.get(str(partner_detail_id))
+                if dest_tenant is None:
+                    unmapped.add(partner_detail_id)
+                    continue
+                sourceUcodes[(tenant, int(row["dc_generated"]), partner_detail_id)].add(row["ucode"])
+                destUcodes[dest_tenant].add(row["ucode"])
+            if unmapped:
+                print(f"⚠️ Skipping partner detail IDs without a tenant for tenant {tenant}: {sorted(unmapped, key=str)}")
+    return sourceUcodes, destUcodes, collected
+
+
+def probeDestinations(destUcodes):
+    """
+    Phase two: exactly one batched inward_invoice_item.code probe per destination tenant,
+    each a scheduler unit on the mercury host it queries
+    """
+    inwardedUcodes = {}
+    future_to_dest = {
+        scheduler.submit(getInwardedUcodes, dest_tenant, sorted(ucodes), db="mercury", tenant=dest_tenant): dest_tenant
+        for dest_tenant, ucodes in destUcodes.items()
+    }
+    for future in as_completed(future_to_dest):
+        dest_tenant = future_to_dest[future]
+        try:
+            inwardedUcodes[dest_tenant] = future.result()
+            print(f"✅ Probed destination {dest_tenant} for {len(destUcodes[dest_tenant])} ucodes")
+        except Exception as e:
+            # Without an answer every ucode would look missing, so skip this destination instead
+            print(f"❌ Error probing destination {dest_tenant}: {e}")
+            traceback.print_exc()
+    return inwardedUcodes
+
+
+def reportMissingUcodes(sourceUcodes, inwardedUcodes, tenants, checkpoint=NO_CHECKPOINT):
+    """
+    Fan destination answers back out to each source tenant. A source tenant is one
+    checkpoint unit; it stays pending if any of its destinations could not be probed.
+    """
+    groupsByTenant = defaultdict(list)
+    for (tenant, dc_generated, partner_detail_id), ucodes in sourceUcodes.items():
+        groupsByTenant[tenant].append((dc_generated, partner_detail_id, ucodes))
+
+    for tenant in tenants:
+        with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+            for dc_generated, partner_detail_id, ucodes in groupsByTenant[tenant]:
+                dest_tenant = pdiToTenantMap[str(partner_detail_id)]
+                if dest_tenant not in inwardedUcodes:
+                    unit.mark_failed(f"destination {dest_tenant} was not probed")
+                    continue
+                inwardInvoiceItems = inwardedUcodes[dest_tenant]
+                for ucode in sorted(ucodes):
+                    if ucode not in inwardInvoiceItems:
+                        print(f"processing tenant: {tenant} , partner_detail_id: {partner_detail_id} , ucode: {ucode} , dest_tenant: {dest_tenant}")
+                        unit.write(
+                            REPORT_FILES[dc_generated],
+                            {"tenant": tenant,
+                             "partner_detail_id": partner_detail_id,
+                             "ucode": ucode,
+                             "dest_tenant": dest_tenant}
+                        )
+
+
+def processAllTenants(tenants, checkpoint=NO_CHECKPOINT, snapshot=None):
+    """
+    Two-phase plan: collect required ucodes from all sources, then probe each
+    destination once with the union of its ucodes, so destination queries scale
+    with the number of destinations rather than sources x destinations.
+    """
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    sourceUcodes, destUcodes, collected = collectRequiredUcodes(tenants, snapshot)
+    print(f"Probing {len(destUcodes)} destination tenants for {len(sourceUcodes)} source groups")
+    inwardedUcodes = probeDestinations(destUcodes)
+    reportMissingUcodes(sourceUcodes, inwardedUcodes, collected, checkpoint)
+
+
+@register_check(CHECK_NAME, "Returned ucodes never inwarded in the destination tenant", uses_snapshot=True)
+def runCheck(context):
+    processAllTenants(
+        context.tenants, checkpoint=context.checkpoint, snapshot=context.snapshot
+    )
 
 
 if __name__ == "__main__":
-    tenants = []
-    tenants.extend(getAllWarehouse())
-    tenants.extend(getAllArsenal())
-
-    max_workers = 10
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_tenant = {executor.submit(process_tenant, tenant): tenant for tenant in tenants}
-
-        for future in as_completed(future_to_tenant):
-            tenant = future_to_tenant[future]
-            try:
-                result = future.result()
-                print(f"✅ Finished processing {result}")
-            except Exception as e:
-                print(f"❌ Error processing {tenant}: {e}")
-                traceback.print_exc()
+    check_main(CHECK_NAME)
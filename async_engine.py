@@ -0,0 +1,297 @@
+import os
+import time
+import asyncio
+import contextlib
+import pymysql
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from getDBConnection import get_connection, get_host_key, POOL_MAX_SIZE, POOL_IDLE_TIMEOUT
+from metrics import metrics, query_name
+from query_plans import plans, plan_text
+from stream_utils import Keyset
+
+try:
+    import aiomysql
+except ImportError:  # optional: without it queries run on a small thread pool over the pymysql pools
+    aiomysql = None
+
+load_dotenv('config.env')
+
+ASYNC_MAX_IN_FLIGHT = int(os.getenv("ASYNC_MAX_IN_FLIGHT", "128"))        # queries in flight across all hosts
+ASYNC_PER_HOST = int(os.getenv("ASYNC_PER_HOST", str(POOL_MAX_SIZE)))      # queries in flight per DB host
+ASYNC_QUERY_TIMEOUT = float(os.getenv("ASYNC_QUERY_TIMEOUT", "900"))       # seconds before a query is cancelled
+ASYNC_FALLBACK_THREADS = int(os.getenv("ASYNC_FALLBACK_THREADS", "32"))    # worker threads when aiomysql is missing
+ASYNC_BATCHES_IN_FLIGHT = int(os.getenv("ASYNC_BATCHES_IN_FLIGHT", "4"))   # batches of one tenant processed at once
+USE_ASYNC = os.getenv("RECON_ASYNC", "0") == "1"
+
+
+class AsyncEngine:
+    """
+    Runs tenant queries from one event loop. Every query holds a slot of the global
+    in-flight limit and of its DB host's semaphore, so hundreds of tenants can be
+    fanned out without more than ASYNC_PER_HOST queries hitting any one server.
+    Uses aiomysql connection pools (one per host) when installed; otherwise each
+    query is handed to a small thread pool borrowing from the pymysql pools.
+    """
+
+    def __init__(self, max_in_flight=ASYNC_MAX_IN_FLIGHT, per_host=ASYNC_PER_HOST, timeout=ASYNC_QUERY_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        self.timeout = timeout
+        self._in_flight = None
+        self._host_limits = {}
+        self._pools = {}
+        self._executor = None
+        self.stats = {"queries": 0, "failures": 0, "timeouts": 0, "in_flight": 0, "peak_in_flight": 0}
+        self.host_busy = defaultdict(int)
+        self.host_peaks = defaultdict(int)
+
+    @property
+    def driver(self):
+        return "aiomysql" if aiomysql is not None else "threads"
+
+    def _limits(self, host_key):
+        """(global, per-host) semaphores; created lazily so they bind to the running loop"""
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        limit = self._host_limits.get(host_key)
+        if limit is None:
+            limit = self._host_limits[host_key] = asyncio.Semaphore(self.per_host)
+        return self._in_flight, limit
+
+    def _run_blocking(self, function, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=ASYNC_FALLBACK_THREADS, thread_name_prefix="recon-async")
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _pool(self, host_key):
+        pool = self._pools.get(host_key)
+        if pool is None:
+            host, port, user, password = host_key
+            pool = self._pools[host_key] = await aiomysql.create_pool(
+                host=host, port=port, user=user, password=password,
+                minsize=0, maxsize=self.per_host, autocommit=True, pool_recycle=POOL_IDLE_TIMEOUT
+            )
+        return pool
+
+    class _Slot:
+        """
+        Global + per-host slot held for the duration of one query. Slots are never held
+        across an await on another query, so nested fan-outs cannot starve each other.
+        """
+
+        def __init__(self, engine, db_name):
+            self.engine = engine
+            self.host_key = get_host_key(db_name)
+            self.label = f"{self.host_key[2]}@{self.host_key[0]}:{self.host_key[1]}"
+            self.limits = engine._limits(self.host_key)
+
+        async def __aenter__(self):
+            global_limit, host_limit = self.limits
+            await global_limit.acquire()
+            try:
+                await host_limit.acquire()
+            except BaseException:
+                global_limit.release()
+                raise
+            stats = self.engine.stats
+            stats["queries"] += 1
+            stats["in_flight"] += 1
+            stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+            self.engine.host_busy[self.label] += 1
+            self.engine.host_peaks[self.label] = max(self.engine.host_peaks[self.label], self.engine.host_busy[self.label])
+            return self
+
+        async def __aexit__(self, exc_type, exc, tb):
+            stats = self.engine.stats
+            stats["in_flight"] -= 1
+            self.engine.host_busy[self.label] -= 1
+            if exc_type is not None and issubclass(exc_type, Exception):
+                stats["failures"] += 1
+                if issubclass(exc_type, asyncio.TimeoutError):
+                    stats["timeouts"] += 1
+            global_limit, host_limit = self.limits
+            host_limit.release()
+            global_limit.release()
+
+    async def fetch_all(self, db_name, query, params=None):
+        """Run a read query on a database / tenant schema and return its rows as dicts"""
+        async with self._Slot(self, db_name):
+            return await asyncio.wait_for(self._fetch_all(db_name, query, params), self.timeout)
+
+    async def _fetch_all(self, db_name, query, params):
+        if aiomysql is None:
+            return await self._run_blocking(fetch_all_blocking, db_name, query, params)
+        host_key = get_host_key(db_name)
+        host = f"{host_key[2]}@{host_key[0]}:{host_key[1]}"
+        pool = await self._pool(host_key)
+        started = time.monotonic()
+        conn = await pool.acquire()
+        metrics.record_pool_wait(host, time.monotonic() - started)
+        try:
+            await conn.select_db(db_name)
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                if plans.claim(host, db_name, query):
+                    await self._explain(cursor, host, db_name, query, params)
+                started = time.monotonic()
+                try:
+                    await cursor.execute(query, tuple(params) if params else None)
+                    rows = list(await cursor.fetchall())
+                except Exception:
+                    metrics.record_query(host, db_name, query_name(query), "execute", time.monotonic() - started, error=True)
+                    raise
+                metrics.record_query(host, db_name, query_name(query), "execute", time.monotonic() - started, len(rows))
+        except (Exception, asyncio.CancelledError):
+            # A query cut off by an error or cancellation may be mid-result; never reuse that socket
+            conn.close()
+            raise
+        finally:
+            pool.release(conn)
+        return rows
+
+    async def _explain(self, cursor, host, db_name, query, params):
+        try:
+            await cursor.execute(plans.explain_sql(query), tuple(params) if params else None)
+            plans.record(host, db_name, query, plan_text(await cursor.fetchone()))
+        except Exception as e:
+            plans.record(host, db_name, query, error=e)
+
+    async def close(self):
+        for pool in self._pools.values():
+            pool.close()
+            await pool.wait_closed()
+        self._pools = {}
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def print_stats(self):
+        stats = self.stats
+        print(
+            f"📊 Async engine ({self.driver}): queries={stats['queries']} failures={stats['failures']} "
+            f"timeouts={stats['timeouts']} peak_in_flight={stats['peak_in_flight']}/{self.max_in_flight}"
+        )
+        for host, peak in sorted(self.host_peaks.items()):
+            print(f"📊   {host}: peak {peak}/{self.per_host} queries in flight")
+
+
+def fetch_all_blocking(db_name, query, params=None):
+    with get_connection(db_name) as conn:
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        try:
+            cursor.execute(query, tuple(params) if params else None)
+            return list(cursor.fetchall())
+        finally:
+            cursor.close()
+
+
+async def stream_pages(engine, db_name, query, params=None, batch_size=500, key="id", key_field=None):
+    """stream_query on the engine: yield the result in keyset pages of at most batch_size rows"""
+    keyset = Keyset(query, params, batch_size, key, key_field)
+    while True:
+        page = keyset.next_page()
+        if page is None:
+            return
+        rows = await engine.fetch_all(db_name, *page)
+        keyset.advance(rows)
+        if rows:
+            yield rows
+
+
+async def process_pages(pages, process_batch, *args, max_in_flight=ASYNC_BATCHES_IN_FLIGHT, label="", on_error=None):
+    """
+    process_stream on the event loop: run process_batch(batch, *args) for every page of an
+    async iterator, with at most max_in_flight batches running, so the next page is only
+    fetched once a slot frees up. A failed batch is logged and passed to on_error(e) if given.
+    Returns the number of batches processed.
+    """
+    def collect(done):
+        for task in done:
+            error = task.exception()
+            if error is not None:
+                print(f"❌ Error in batch for tenant {label}: {error}")
+                if on_error:
+                    on_error(error)
+
+    total = 0
+    in_flight = set()
+    try:
+        async for batch in pages:
+            total += 1
+            in_flight.add(asyncio.ensure_future(process_batch(batch, *args)))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+        if in_flight:
+            done, in_flight = await asyncio.wait(in_flight)
+            collect(done)
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+    return total
+
+
+@contextlib.asynccontextmanager
+async def checkpoint_unit(checkpoint, check, tenant, batch="", output_dir=None):
+    """
+    checkpoint.unit() for coroutines: a finished unit is committed on a worker thread,
+    since handing its rows to the writers can block and would stall every other tenant
+    """
+    unit = checkpoint.unit(check, tenant, batch, output_dir)
+    try:
+        yield unit
+    except BaseException as e:
+        unit.__exit__(type(e), e, e.__traceback__)  # only discards the rows
+        raise
+    await asyncio.get_running_loop().run_in_executor(None, unit.__exit__, None, None, None)
+
+
+async def gather_all(coroutines):
+    """
+    Structured concurrency for a group of tasks: wait for all of them and, if the
+    caller is cancelled (Ctrl-C, timeout) or a task raises a non-Exception error,
+    cancel every sibling and wait for it to unwind before propagating.
+    Ordinary exceptions are returned in place of results, never raised.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def fan_out(tenants, process_tenant, *args, label=""):
+    """
+    Run process_tenant(tenant, *args) for every tenant at once; the engine's global
+    and per-host limits decide how many actually query. Returns the failed tenants.
+    """
+    results = await gather_all(process_tenant(tenant, *args) for tenant in tenants)
+    failed = []
+    for tenant, result in zip(tenants, results):
+        if isinstance(result, BaseException):
+            print(f"❌ Error processing tenant {tenant}{' for ' + label if label else ''}: {result}")
+            failed.append(tenant)
+        else:
+            print(f"✅ Finished tenant: {tenant}")
+    return failed
+
+
+def run_async(main, *args, engine=None):
+    """Run main(engine, *args) on a fresh event loop, closing the engine afterwards"""
+    async def runner():
+        own_engine = engine or AsyncEngine()
+        try:
+            return await main(own_engine, *args)
+        finally:
+            own_engine.print_stats()
+            await own_engine.close()
+
+    return asyncio.run(runner())
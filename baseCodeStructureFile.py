@@ -1,46 +1,38 @@
 import sys
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import pymysql
-from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
+from checkpoint import NO_CHECKPOINT
+from work_scheduler import for_each_tenant
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
-CSV_LOCK = Lock()  # Thread-safe CSV writes
 BATCH_SIZE = 500
+CHECK_NAME = "base_check"
 
-def safe_append_to_csv(filename, rows):
-    """Thread-safe CSV append"""
-    with CSV_LOCK:
-        append_to_csv(filename, rows, output_dir=CURRENT_DIRECTORY)
-
-
-def process_tenant(tenant):
+def process_tenant(tenant, checkpoint=NO_CHECKPOINT):
     """Run SQL query for a tenant and save results"""
     try:
-        pass
+        # Rows written through the unit only land in the CSV once the whole tenant succeeds
+        with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+            pass
     except Exception as e:
         print(f"❌ Error running query for tenant {tenant}: {e}")
 
 
-def processAllTenants(tenants, max_workers=10):
-    """Run query for all tenants concurrently"""
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_tenant, tenant): tenant for tenant in tenants}
-        for future in as_completed(futures):
-            tenant = futures[future]
-            try:
-                future.result()
-            except Exception as e:
-                print(f"❌ Exception in tenant {tenant}: {e}")
+def processAllTenants(tenants, checkpoint=NO_CHECKPOINT):
+    """Run query for all tenants concurrently, one scheduler unit per tenant"""
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    for_each_tenant(tenants, process_tenant, checkpoint)
+
+
+@register_check(CHECK_NAME, "Template check")
+def runCheck(context):
+    processAllTenants(context.tenants, checkpoint=context.checkpoint)
 
 
 if __name__ == "__main__":
-    tenants = getAllWarehouse() + getAllArsenal()
-    processAllTenants(tenants, max_workers=10)
+    check_main(CHECK_NAME)
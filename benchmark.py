@@ -0,0 +1,213 @@
+import os
+import sys
+import csv
+import json
+import time
+import shlex
+import argparse
+import subprocess
+from threading import Timer
+from datetime import datetime
+from dotenv import load_dotenv
+
+from synthetic_data import BENCH_DIRECTORY, BENCH_DB_CONFIG, BENCH_SEED, dataset_name, read_manifest, write_dataset
+from findings_diff import REPORT_KEYS
+from results_store import report_of_table, quote, run_query
+
+load_dotenv('config.env')
+
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+RECON_SCRIPT = os.path.join(BASE_DIRECTORY, "recon.py")
+
+BENCH_TENANTS = [int(n) for n in os.getenv("BENCH_TENANTS", "10,100,400").split(",")]
+BENCH_ROWS = [int(n) for n in os.getenv("BENCH_ROWS", "10000,1000000").split(",")]
+BENCH_TIMEOUT = float(os.getenv("BENCH_TIMEOUT", "0")) or None  # seconds per check run, 0 = no limit
+BENCH_RUN_ID = "bench"
+
+# Reports each check writes, scored against the dataset's expected findings
+CHECK_REPORTS = {
+    "dc_created_str_not_created": ["dcCreatedStrNotCreated"],
+    "str_recon": ["strCreatedQunatitySameAmountMismatch", "strCreatedReturnQunatityDifferent"],
+    "ucode_never_inward": ["ucodeNeverInwardForDCGenerated", "ucodeNeverInwardForDCNotGenerated"],
+    "no_cn_for_str_inward": ["noCNForStrInward"],
+    "multi_cn_for_str_inward": ["multiCNForStrInward"],
+    "duplicate_str_inward_invoice": ["duplicateStrInwardInvoice"],
+    "invalid_invoice_in_pr": ["invalidInvoiceInPR"],
+    "pr_sales": ["prSales"],
+    "non_regular_vendor_type": ["nonRegularVendorType"],
+}
+# Checks that read only local_mirror tables, the ones a mirror dataset can run
+MIRROR_CHECKS = ["dc_created_str_not_created", "str_recon"]
+
+REPORT_COLUMNS = [
+    "target", "tenants", "rows", "check", "exit_code", "wall_seconds", "queries", "query_seconds",
+    "peak_rss_mb", "findings", "expected", "missed", "extra", "correct",
+]
+
+
+def check_environment(manifest, run_directory):
+    """
+    Environment of a check run: every database points at the benchmark MySQL, the tenant
+    registry is the dataset's, and results, checkpoints and metrics stay in the run directory.
+    Runs start in the run directory, so the repo's config.env is not loaded by the checks.
+    """
+    env = {key: value for key, value in os.environ.items() if not key.endswith("_DB_CONFIG")}
+    db_config = json.dumps(manifest.get("db_config") or BENCH_DB_CONFIG)
+    env.update({
+        "MERCURY_DB_CONFIG": db_config,
+        "VAULT_DB_CONFIG": db_config,
+        "PARTNER_DB_CONFIG": db_config,
+        "TENANT_REGISTRY_CACHE": manifest["registry_cache"],
+        "TENANT_REGISTRY_TTL": str(10 ** 9),
+        "RECON_USE_MIRROR": "1" if manifest["target"] == "mirror" else "0",
+        "MIRROR_DIRECTORY": manifest["mirror_directory"] or os.path.join(run_directory, "mirror"),
+        "RESULTS_BACKEND": "sqlite",
+        "RESULTS_DB": os.path.join(run_directory, "results.sqlite"),
+        "CHECKPOINT_DIRECTORY": run_directory,
+        "SNAPSHOT_DIRECTORY": run_directory,
+        "METRICS_DIRECTORY": os.path.join(run_directory, "metrics"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+
+def run_check(check, manifest, run_directory, extra_args=(), timeout=BENCH_TIMEOUT):
+    """
+    Run one check as `recon.py run <check>` in a child process.
+    Returns (exit_code, wall_seconds, peak_rss_mb); the child's output goes to run.log.
+    """
+    os.makedirs(run_directory, exist_ok=True)
+    command = [sys.executable, RECON_SCRIPT, "run", check, "--run-id", BENCH_RUN_ID, "--metrics", *extra_args]
+    with open(os.path.join(run_directory, "run.log"), "w", encoding="utf-8") as log:
+        started = time.monotonic()
+        process = subprocess.Popen(command, cwd=run_directory, env=check_environment(manifest, run_directory),
+                                   stdout=log, stderr=subprocess.STDOUT)
+        timer = Timer(timeout, process.kill) if timeout else None
+        if timer:
+            timer.start()
+        try:
+            # wait4 rather than wait: its rusage is this child's own peak RSS
+            _, status, usage = os.wait4(process.pid, 0)
+        finally:
+            if timer:
+                timer.cancel()
+        wall = time.monotonic() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)  # bytes on macOS, KiB on Linux
+    return process.returncode, wall, peak_rss
+
+
+def read_run_metrics(run_directory):
+    try:
+        with open(os.path.join(run_directory, "metrics", f"{BENCH_RUN_ID}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def found_findings(report, db_path):
+    """REPORT_KEYS of every finding a run stored for a report"""
+    if not os.path.isfile(db_path):
+        return set()
+    # Tables are named after the report's output directory too; a check writes each report to one
+    tables = [row["name"] for row in run_query("SELECT name FROM sqlite_master WHERE type = 'table'", db_path=db_path)
+              if report_of_table(row["name"]) == report]
+    keys = REPORT_KEYS[report]
+    found = set()
+    for table in tables:
+        rows = run_query(f"SELECT {', '.join(quote(key) for key in keys)} FROM {quote(table)}", db_path=db_path)
+        found |= {tuple("" if row[key] is None else str(row[key]).strip() for key in keys) for row in rows}
+    return found
+
+
+def score(check, expected, db_path):
+    """(findings, expected, missed, extra) of a check over all of its reports"""
+    totals = [0, 0, 0, 0]
+    for report in CHECK_REPORTS[check]:
+        found = found_findings(report, db_path)
+        wanted = {tuple(key) for key in expected.get(report, [])}
+        for i, count in enumerate((len(found), len(wanted), len(wanted - found), len(found - wanted))):
+            totals[i] += count
+    return tuple(totals)
+
+
+def benchmark_dataset(manifest, checks, run_root, extra_args=(), timeout=BENCH_TIMEOUT):
+    with open(manifest["expected"], encoding="utf-8") as f:
+        expected = json.load(f)
+    results = []
+    for check in checks:
+        run_directory = os.path.join(run_root, dataset_name(manifest["target"], manifest["tenants"], manifest["rows"], manifest["seed"]), check)
+        print(f"⏱️ {check} on {manifest['tenants']} tenants / {manifest['rows']} rows")
+        exit_code, wall, peak_rss = run_check(check, manifest, run_directory, extra_args, timeout)
+        run_metrics = read_run_metrics(run_directory)
+        findings, wanted, missed, extra = score(check, expected, os.path.join(run_directory, "results.sqlite"))
+        result = {
+            "target": manifest["target"], "tenants": manifest["tenants"], "rows": manifest["rows"], "check": check,
+            "exit_code": exit_code, "wall_seconds": round(wall, 2), "queries": run_metrics.get("queries", ""),
+            "query_seconds": run_metrics.get("query_seconds", ""), "peak_rss_mb": round(peak_rss, 1),
+            "findings": findings, "expected": wanted, "missed": missed, "extra": extra,
+            "correct": exit_code == 0 and missed == 0 and extra == 0,
+        }
+        results.append(result)
+        status = "✅" if result["correct"] else "❌"
+        print(f"{status} {check}: {result['wall_seconds']}s, {result['queries']} queries, {result['peak_rss_mb']} MB peak RSS, "
+              f"{findings}/{wanted} findings, {missed} missed, {extra} extra (log: {os.path.join(run_directory, 'run.log')})")
+    return results
+
+
+def print_results(results):
+    print(f"\n{'tenants':>7} {'rows':>9}  {'check':30} {'wall s':>8} {'queries':>8} {'RSS MB':>8} {'found':>7} {'expected':>8}  correct")
+    for r in results:
+        print(f"{r['tenants']:>7} {r['rows']:>9}  {r['check']:30} {r['wall_seconds']:>8} {r['queries']!s:>8} "
+              f"{r['peak_rss_mb']:>8} {r['findings']:>7} {r['expected']:>8}  {'yes' if r['correct'] else 'NO'}")
+
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"📊 Benchmark results written to: {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recon checks on synthetic datasets: wall time, queries, peak RSS and correctness")
+    parser.add_argument("--target", choices=["mysql", "mirror"], default="mysql",
+                        help="Local MySQL from BENCH_DB_CONFIG (default), or local mirror files (mirror checks only)")
+    parser.add_argument("--tenants", type=int, nargs="+", default=BENCH_TENANTS, help="Tenant counts (default: BENCH_TENANTS)")
+    parser.add_argument("--rows", type=int, nargs="+", default=BENCH_ROWS, help="Purchase issue item counts (default: BENCH_ROWS)")
+    parser.add_argument("--checks", nargs="+", choices=list(CHECK_REPORTS), help="Checks to run (default: all the target supports)")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED)
+    parser.add_argument("--reuse", action="store_true", help="Reuse a dataset that is already generated (and loaded)")
+    parser.add_argument("--timeout", type=float, default=BENCH_TIMEOUT, help="Seconds before a check run is killed")
+    parser.add_argument("--recon-args", default="", help="Extra `recon.py run` options, e.g. --recon-args=\"--workers 20 --async\"")
+    parser.add_argument("--output", help="Results CSV (default: BENCH_DIRECTORY/results-<timestamp>.csv)")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow a non-local BENCH_DB_CONFIG host")
+    args = parser.parse_args()
+
+    checks = args.checks or (MIRROR_CHECKS if args.target == "mirror" else list(CHECK_REPORTS))
+    unsupported = [check for check in checks if args.target == "mirror" and check not in MIRROR_CHECKS]
+    if unsupported:
+        print(f"❌ {', '.join(unsupported)} read vault / mercury directly and need --target mysql")
+        sys.exit(2)
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    run_root = os.path.join(BENCH_DIRECTORY, "runs", stamp)
+    results = []
+    for tenants in args.tenants:
+        for rows in args.rows:
+            directory = os.path.join(BENCH_DIRECTORY, "data", dataset_name(args.target, tenants, rows, args.seed))
+            manifest = read_manifest(directory) if args.reuse else None
+            if manifest is None:
+                try:
+                    manifest = write_dataset(args.target, tenants, rows, args.seed, directory, allow_remote=args.allow_remote)
+                except ValueError as e:
+                    print(f"❌ {e}")
+                    sys.exit(2)
+            results.extend(benchmark_dataset(manifest, checks, run_root, shlex.split(args.recon_args), args.timeout))
+
+    print_results(results)
+    write_results(results, args.output or os.path.join(BENCH_DIRECTORY, f"results-{stamp}.csv"))
+    if not all(result["correct"] for result in results):
+        sys.exit(1)
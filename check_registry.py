@@ -0,0 +1,144 @@
+import time
+import argparse
+from threading import Lock
+
+from checkpoint import NO_CHECKPOINT, add_checkpoint_args, checkpoint_from_args
+from csv_utils import close_all_writers
+from lookup_cache import print_cache_stats
+from getDBConnection import print_pool_stats
+from async_engine import USE_ASYNC
+from work_scheduler import scheduler, print_scheduler_stats
+from metrics import metrics
+from query_plans import plans
+
+# check name -> (run function, description, part of `recon.py run all`, reads context.snapshot)
+CHECKS = {}
+
+
+def register_check(name, description="", include_in_all=True, uses_snapshot=False):
+    """
+    Decorator registering a check's entry point, run(context), under a name.
+    Re-registering a name replaces it (a script run as __main__ registers twice).
+    """
+    def decorator(run):
+        CHECKS[name] = (run, description, include_in_all, uses_snapshot)
+        return run
+    return decorator
+
+
+class ReconContext:
+    """
+    What every check in one invocation shares: the tenant list (discovered once),
+    the tenant concurrency, the checkpoint store and, when enabled, the purchase issue
+    snapshot. Connection pools, CSV writers and the destination lookup cache are
+    process-wide, so they stay warm across checks.
+    """
+
+    def __init__(self, checkpoint=NO_CHECKPOINT, tenants=None, max_workers=None, use_snapshot=None,
+                 use_async=False):
+        self.checkpoint = checkpoint
+        if max_workers is not None:
+            # Tenants are root units of the shared scheduler, so this caps how many are in progress
+            scheduler.set_max_roots(max_workers)
+        self.max_workers = scheduler.max_roots
+        self.use_async = use_async  # checks with an async path run it on async_engine instead of thread pools
+        self.use_snapshot = use_snapshot  # None: only when two or more selected checks read it
+        self.snapshot = None
+        self._tenants = list(tenants) if tenants else None
+        self._lock = Lock()
+
+    @property
+    def tenants(self):
+        with self._lock:
+            if self._tenants is None:
+                from getAllWarehouse import getAllWarehouse
+                from getAllArsenal import getAllArsenal
+                self._tenants = getAllWarehouse() + getAllArsenal()
+                print(f"Discovered {len(self._tenants)} tenants")
+            return self._tenants
+
+    def prepare_snapshot(self, names):
+        """Share one purchase_issue scan per tenant between the selected checks that read it"""
+        from local_mirror import USE_MIRROR
+        consumers = [name for name in names if CHECKS[name][3]]
+        # The snapshot is read from production; checks already reading the local mirror skip it by default
+        enabled = (len(consumers) >= 2 and not USE_MIRROR) if self.use_snapshot is None else self.use_snapshot
+        if enabled and consumers and self.snapshot is None:
+            from purchase_issue_snapshot import PurchaseIssueSnapshot
+            self.snapshot = PurchaseIssueSnapshot(self.checkpoint.run_id)
+            print(f"📸 Sharing a purchase issue snapshot between: {', '.join(consumers)}")
+
+    def close(self):
+        close_all_writers()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.checkpoint.close()
+        print_cache_stats()
+        print_pool_stats()
+        print_scheduler_stats()
+        if metrics.enabled:
+            metrics.write_reports(self.checkpoint.run_id)
+        if plans.enabled:
+            plans.write_reports(self.checkpoint.run_id)
+
+
+def run_checks(names, context):
+    """Run checks one after another in this process; returns the names of checks that failed"""
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        raise ValueError(f"Unknown checks: {', '.join(unknown)}. Known: {', '.join(sorted(CHECKS))}")
+
+    context.prepare_snapshot(names)
+    failed = []
+    for name in names:
+        run = CHECKS[name][0]
+        print(f"▶️ Running check {name}")
+        metrics.check = name
+        started = time.monotonic()
+        try:
+            run(context)
+            print(f"✅ Finished check {name} in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            print(f"❌ Check {name} failed after {time.monotonic() - started:.1f}s: {e}")
+            failed.append(name)
+    return failed
+
+
+def add_context_args(parser):
+    add_checkpoint_args(parser)
+    parser.add_argument("--tenants", nargs="*", help="Tenants to check (default: all warehouses and arsenals)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Tenants processed concurrently (default: SCHEDULER_MAX_ROOTS)")
+    parser.add_argument("--snapshot", dest="use_snapshot", action="store_true", default=None,
+                        help="Read purchase issues from one shared snapshot (default: when two or more checks need them)")
+    parser.add_argument("--no-snapshot", dest="use_snapshot", action="store_false",
+                        help="Let every check query purchase issues itself")
+    parser.add_argument("--async", dest="use_async", action="store_true", default=USE_ASYNC,
+                        help="Run checks that support it on the asyncio engine (default: RECON_ASYNC=1)")
+    parser.add_argument("--metrics", action="store_true", default=metrics.enabled,
+                        help="Record query / pool / output metrics and write a JSON summary and Prometheus textfile (default: RECON_METRICS=1)")
+    parser.add_argument("--explain", action="store_true", default=plans.enabled,
+                        help="EXPLAIN every query shape once per tenant and write a slow-plan report (default: RECON_EXPLAIN=1)")
+    return parser
+
+
+def context_from_args(args):
+    if args.metrics:
+        metrics.enable()
+    if args.explain:
+        plans.enable()
+    return ReconContext(
+        checkpoint_from_args(args), tenants=args.tenants, max_workers=args.workers, use_snapshot=args.use_snapshot,
+        use_async=args.use_async
+    )
+
+
+def check_main(name):
+    """__main__ of a single check script: same options as `recon.py run`, for one check"""
+    description = CHECKS[name][1]
+    args = add_context_args(argparse.ArgumentParser(description=description)).parse_args()
+    context = context_from_args(args)
+    try:
+        run_checks([name], context)
+    finally:
+        context.close()
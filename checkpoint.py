@@ -0,0 +1,397 @@
+import os
+import pickle
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+from collections import defaultdict, deque
+from threading import Lock
+from dotenv import load_dotenv
+
+from csv_utils import get_csv_writer, truncate_output
+from findings_diff import stamp_finding
+
+load_dotenv('config.env')
+
+CHECKPOINT_DIRECTORY = os.getenv("CHECKPOINT_DIRECTORY", os.path.join(os.getcwd(), ".recon_runs"))
+CHECKPOINT_SPILL_ROWS = int(os.getenv("CHECKPOINT_SPILL_ROWS", "5000"))  # rows a unit keeps in memory per output
+
+
+class SpilledRows:
+    """
+    Rows of one unit for one output. Up to spill_rows are kept in memory; beyond that
+    they are pickled in batches to a temporary file, so a unit's memory stays bounded
+    however many findings it produces. Writer threads read the batches back themselves.
+    """
+
+    def __init__(self, spill_rows=CHECKPOINT_SPILL_ROWS, directory=None):
+        self.spill_rows = spill_rows
+        self.directory = directory
+        self.rows = []
+        self.count = 0
+        self.path = None
+        self._readers = 1  # the unit itself, until release()
+        self._lock = Lock()
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+        self.count += len(rows)
+        if len(self.rows) >= self.spill_rows:
+            self._spill()
+
+    def _spill(self):
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(suffix=".rows", dir=self.directory)
+            os.close(fd)
+        with open(self.path, "ab") as f:
+            pickle.dump(self.rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.rows = []
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    def batches(self):
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                while True:
+                    try:
+                        yield pickle.load(f)
+                    except EOFError:
+                        break
+        if self.rows:
+            yield self.rows
+
+    def first_row(self):
+        if self.path is None:
+            return self.rows[0]
+        with open(self.path, "rb") as f:
+            return pickle.load(f)[0]
+
+    def acquire(self):
+        with self._lock:
+            self._readers += 1
+
+    def release(self):
+        """Drop one reader; the spill file is removed after the last one"""
+        with self._lock:
+            self._readers -= 1
+            last = self._readers == 0
+        if last and self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class UnitOutput:
+    """
+    Output of one unit of work (check, tenant[, batch]).
+    Rows are buffered (spilling to disk past CHECKPOINT_SPILL_ROWS) and only handed
+    to the writers when the unit completes, so the output files only ever contain
+    whole units. Every row is stamped with the run ID and a finding hash for
+    run-over-run diffs (findings_diff.py).
+    """
+
+    def __init__(self, checkpoint, check, tenant, batch="", output_dir=None):
+        self.checkpoint = checkpoint
+        self.check = check
+        self.tenant = tenant
+        self.batch = batch
+        self.output_dir = output_dir
+        self.rows = {}  # (filename, output_dir) -> SpilledRows
+        self.error = None
+        self._lock = Lock()  # batches of one unit can be processed by several threads
+
+    def _buffer(self, filename, output_dir):
+        key = (filename, output_dir or self.output_dir)
+        if key not in self.rows:
+            self.rows[key] = SpilledRows(directory=getattr(self.checkpoint, "spill_directory", None))
+        return self.rows[key]
+
+    def write(self, filename, row, output_dir=None):
+        row = stamp_finding(filename, row, self.checkpoint.run_id)
+        with self._lock:
+            self._buffer(filename, output_dir).extend([row])
+
+    def write_many(self, filename, rows, output_dir=None):
+        rows = [stamp_finding(filename, row, self.checkpoint.run_id) for row in rows]
+        if not rows:
+            return
+        with self._lock:
+            self._buffer(filename, output_dir).extend(rows)
+
+    def discard(self):
+        for buffer in self.rows.values():
+            buffer.release()
+        self.rows = {}
+
+    def mark_failed(self, error):
+        """Keep the unit unfinished (and its rows unwritten) even if the body swallows the error"""
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.mark_failed(exc)
+        if self.error is None:
+            self.checkpoint.commit_unit(self)
+        else:
+            self.discard()
+            print(f"⚠️ {unit_label(self)} not checkpointed: {self.error}")
+        return False
+
+
+def unit_label(unit):
+    return " / ".join(str(part) for part in (unit.check, unit.tenant, unit.batch) if part != "")
+
+
+class DirectOutput(UnitOutput):
+    """Unit output used without checkpointing: rows go straight to the writers"""
+
+    def write(self, filename, row, output_dir=None):
+        row = stamp_finding(filename, row, self.checkpoint.run_id)
+        get_csv_writer(filename, output_dir or self.output_dir, needLogs=False).write(row)
+
+    def write_many(self, filename, rows, output_dir=None):
+        rows = [stamp_finding(filename, row, self.checkpoint.run_id) for row in rows]
+        get_csv_writer(filename, output_dir or self.output_dir, needLogs=False).write_many(rows)
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullCheckpoint:
+    """Checkpoint store that records nothing, used when a function is called outside a sweep"""
+
+    run_id = None
+
+    def is_done(self, check, tenant, batch=""):
+        return False
+
+    def pending(self, check, tenants):
+        return list(tenants)
+
+    def unit(self, check, tenant, batch="", output_dir=None):
+        return DirectOutput(self, check, tenant, batch, output_dir)
+
+    def close(self):
+        pass
+
+
+NO_CHECKPOINT = NullCheckpoint()
+
+
+class PendingUnit:
+    """A unit whose rows are queued in its writers, waiting for every writer to reach its marker"""
+
+    def __init__(self, unit, output_keys):
+        self.unit = unit
+        self.rows_written = sum(buffer.count for buffer in unit.rows.values())
+        self.positions = dict.fromkeys(output_keys)  # output key -> position after the unit's rows
+        self.remaining = len(self.positions)
+        self.error = None
+
+
+class RunCheckpoint:
+    """
+    Durable checkpoint store for one run, kept in a local SQLite file per run ID.
+    Records completed (check, tenant, batch) units together with the position of every
+    output at that point (file size, or last row id in the results store), so a resumed
+    run can skip finished units and cut partial output back to the last completed unit.
+
+    Committing a unit only queues its rows and a marker in each writer; the unit is
+    recorded by the writer threads once the markers are reached, so check threads never
+    wait on output I/O. A unit is recorded only after every unit queued before it in any
+    of its outputs, which keeps every recorded position on a whole-unit boundary.
+    """
+
+    def __init__(self, run_id=None, resume=False, directory=CHECKPOINT_DIRECTORY):
+        self.run_id = run_id or datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"{self.run_id}.sqlite")
+        self.spill_directory = directory
+        if resume and not os.path.isfile(self.path):
+            raise ValueError(f"No checkpoint found for run {self.run_id} at {self.path}")
+        if not resume and os.path.isfile(self.path):
+            raise ValueError(f"Run {self.run_id} already exists, use --resume {self.run_id}")
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()  # checkpoint state and the SQLite file; never held while waiting on a writer
+        self._output_locks = defaultdict(Lock)  # output key -> order in which units are queued in it
+        self._queued = defaultdict(deque)  # output key -> PendingUnits in writer queue order
+        self._writers = {}
+        self._failed = 0
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS units (
+                check_name TEXT NOT NULL,
+                tenant TEXT NOT NULL,
+                batch TEXT NOT NULL DEFAULT '',
+                rows_written INTEGER NOT NULL,
+                completed_on TEXT NOT NULL,
+                PRIMARY KEY (check_name, tenant, batch)
+            );
+            CREATE TABLE IF NOT EXISTS outputs (
+                path TEXT PRIMARY KEY,
+                committed_offset INTEGER NOT NULL
+            );
+        """)
+        self._done = {tuple(row) for row in self._db.execute("SELECT check_name, tenant, batch FROM units")}
+        self._offsets = dict(self._db.execute("SELECT path, committed_offset FROM outputs"))
+
+        if resume:
+            self.restore_outputs()
+            print(f"🔁 Resuming run {self.run_id}: {len(self._done)} units already done")
+        else:
+            print(f"🔖 Run ID: {self.run_id} (resume with --resume {self.run_id})")
+
+    def restore_outputs(self):
+        """Cut every output back to its position after the last completed unit"""
+        for path, offset in self._offsets.items():
+            if truncate_output(path, offset):
+                print(f"✂️ Truncated partial output: {path} -> {offset}")
+
+    def is_done(self, check, tenant, batch=""):
+        return (check, tenant, str(batch)) in self._done
+
+    def pending(self, check, tenants):
+        """Tenants whose unit for this check has not completed yet"""
+        remaining = [tenant for tenant in tenants if not self.is_done(check, tenant)]
+        skipped = len(tenants) - len(remaining)
+        if skipped:
+            print(f"⏭️ {check}: skipping {skipped} tenants finished in run {self.run_id}")
+        return remaining
+
+    def unit(self, check, tenant, batch="", output_dir=None):
+        return UnitOutput(self, check, tenant, str(batch), output_dir)
+
+    def commit_unit(self, unit):
+        """
+        Queue a unit's rows and a marker in every output it wrote to; the unit and the new
+        output positions are recorded by _marker_reached once all of its rows are written
+        """
+        outputs = {}
+        for (filename, output_dir), buffer in unit.rows.items():
+            writer = get_csv_writer(filename, output_dir, needLogs=False)
+            outputs[writer.output_key] = (writer, buffer)
+        pending = PendingUnit(unit, outputs)
+        if not outputs:
+            with self._lock:
+                self._record([pending])
+            return
+
+        # All of the unit's outputs are locked together (in a fixed order) so that units
+        # sharing outputs are queued in the same order in each of them
+        with self._lock:
+            locks = [self._output_locks[key] for key in sorted(outputs)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for key in sorted(outputs):
+                writer, buffer = outputs[key]
+                if key not in self._offsets:
+                    # First write to this output in the run: anything before this position is not ours.
+                    # Persisted before writing so a crash mid-commit can still be cut back.
+                    writer.prepare(buffer.first_row())
+                    writer.flush()
+                    with self._lock:
+                        self._offsets[key] = writer.position()
+                        with self._db:
+                            self._db.execute(
+                                "INSERT OR REPLACE INTO outputs (path, committed_offset) VALUES (?, ?)",
+                                (key, self._offsets[key])
+                            )
+                with self._lock:
+                    self._writers[key] = writer
+                    self._queued[key].append(pending)
+                if buffer.spilled:
+                    writer.write_batches(buffer)
+                else:
+                    writer.write_many(buffer.rows)
+                writer.mark(lambda position, error, key=key: self._marker_reached(pending, key, position, error))
+        finally:
+            for lock in locks:
+                lock.release()
+            unit.discard()
+
+    def _marker_reached(self, pending, key, position, error):
+        """Writer thread: the unit's rows in this output are written; record every unit that is now whole"""
+        with self._lock:
+            pending.positions[key] = position
+            pending.remaining -= 1
+            if error is not None and pending.error is None:
+                pending.error = error
+                self._failed += 1
+                print(f"⚠️ {unit_label(pending.unit)} not checkpointed: {error}")
+            if pending.remaining == 0:
+                self._record(self._ready_units())
+
+    def _ready_units(self):
+        """Pop units whose rows are written and that head the queue of every output they wrote to"""
+        ready = []
+        progressed = True
+        while progressed:
+            progressed = False
+            for queued in list(self._queued.values()):
+                head = queued[0] if queued else None
+                if head is None or head.remaining or head.error is not None:
+                    continue
+                if all(self._queued[key] and self._queued[key][0] is head for key in head.positions):
+                    for key in head.positions:
+                        self._queued[key].popleft()
+                    ready.append(head)
+                    progressed = True
+        return ready
+
+    def _record(self, units):
+        if not units:
+            return
+        with self._db:
+            for pending in units:
+                for path, position in pending.positions.items():
+                    self._offsets[path] = position
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO outputs (path, committed_offset) VALUES (?, ?)", (path, position)
+                    )
+                unit = pending.unit
+                self._db.execute(
+                    "INSERT OR REPLACE INTO units (check_name, tenant, batch, rows_written, completed_on) VALUES (?, ?, ?, ?, ?)",
+                    (unit.check, unit.tenant, unit.batch, pending.rows_written, datetime.now().isoformat())
+                )
+        self._done.update((p.unit.check, p.unit.tenant, p.unit.batch) for p in units)
+
+    def wait(self):
+        """Block until every committed unit has reached its writers' markers"""
+        with self._lock:
+            writers = [self._writers[key] for key, queued in self._queued.items() if queued]
+        for writer in writers:
+            if not writer._closed:
+                writer.flush()
+
+    def close(self):
+        self.wait()
+        with self._lock:
+            unrecorded = {id(p): p for queued in self._queued.values() for p in queued}
+            if unrecorded:
+                print(f"⚠️ {len(unrecorded)} units of run {self.run_id} were not checkpointed and run again on --resume")
+            self._db.close()
+
+
+def add_checkpoint_args(parser):
+    parser.add_argument("--run-id", help="Name of a new run (default: current timestamp)")
+    parser.add_argument("--resume", metavar="RUN_ID", help="Resume a run, skipping finished tenants")
+    return parser
+
+
+def checkpoint_from_args(args):
+    if args.resume:
+        return RunCheckpoint(args.resume, resume=True)
+    return RunCheckpoint(args.run_id)
+
+
+def parse_checkpoint_args(description=None):
+    """Parse --run-id / --resume for a script and open its checkpoint store"""
+    parser = add_checkpoint_args(argparse.ArgumentParser(description=description))
+    return checkpoint_from_args(parser.parse_args())
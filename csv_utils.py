@@ -1,14 +1,29 @@
 import csv
 import os
+import time
+import queue
+import atexit
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
 
+from metrics import metrics
+
 # Load environment variables
 load_dotenv('config.env')
 
 # Get output directory from environment variable, default = current directory
 OUTPUT_DIRECTORY = os.path.join(os.getcwd(), "CSV_FILES")
 
+# Background writer tuning
+CSV_WRITER_BATCH_SIZE = int(os.getenv("CSV_WRITER_BATCH_SIZE", "500"))          # rows per write/flush
+CSV_WRITER_FLUSH_INTERVAL = float(os.getenv("CSV_WRITER_FLUSH_INTERVAL", "2"))  # seconds before a partial batch is flushed
+
+# Where get_csv_writer sends findings: "csv" files, the "sqlite" results store (results_store.py)
+# and/or the "kafka" findings topic (kafka_sink.py); comma-separate to write to several, e.g. "csv,kafka"
+RESULTS_BACKEND = os.getenv("RESULTS_BACKEND", "csv").lower()
+RESULTS_BACKENDS = [backend.strip() for backend in RESULTS_BACKEND.split(",") if backend.strip()] or ["csv"]
+
 
 def save_to_csv(filename, data, headers=None, output_dir=None):
     """
@@ -123,6 +138,396 @@ def append_to_csv(filename, data, headers=None, output_dir=None, needLogs=True):
         raise
 
 
+_CLOSE = object()
+
+
+class _Batches:
+    """Queue item: row batches read by the writer thread itself (e.g. from a spill file)"""
+
+    def __init__(self, source):
+        self.source = source
+
+
+class _Marker:
+    """Queue item: callback(position, error) run by the writer thread once the rows queued before it are written"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+
+class CsvWriter:
+    """
+    Buffered CSV writer for a single output file.
+    Rows are queued by producer threads and written by one background thread that
+    keeps the file open and flushes in batches, so producers never wait on disk I/O.
+    """
+
+    backend = "csv"  # label of the output in metrics
+
+    def __init__(self, filename, headers=None, output_dir=None, batch_size=CSV_WRITER_BATCH_SIZE,
+                 flush_interval=CSV_WRITER_FLUSH_INTERVAL, needLogs=True):
+        if output_dir is None:
+            output_dir = OUTPUT_DIRECTORY
+        self.full_path = os.path.join(output_dir, filename)
+        self.output_name = os.path.splitext(filename)[0]
+        self.output_key = self.full_path  # identifies the output for checkpoint truncation
+        self.headers = list(headers) if headers else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.needLogs = needLogs
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.error = None
+        self._queue = queue.Queue()
+        self._closed = False
+        self._file = None
+        self._writer = None
+        self._thread = threading.Thread(target=self._run, name=f"csv-writer-{filename}", daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        """Queue one row (dict or list/tuple)"""
+        if self._closed:
+            raise ValueError(f"CSV writer for {self.full_path} is closed")
+        self._queue.put(row)
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def write_batches(self, source):
+        """
+        Queue rows the writer thread reads itself, batch by batch: source.batches() is
+        iterated on the writer thread and source.release() called after it
+        """
+        if self._closed:
+            raise ValueError(f"CSV writer for {self.full_path} is closed")
+        source.acquire()
+        self._queue.put(_Batches(source))
+
+    def mark(self, callback):
+        """
+        Call callback(position, error) from the writer thread once every row queued so far
+        is written and flushed; position is what position() returns at that point
+        """
+        if self._closed:
+            raise ValueError(f"CSV writer for {self.full_path} is closed")
+        self._queue.put(_Marker(callback))
+
+    def flush(self, timeout=None):
+        """Block until every row queued so far is written and flushed to disk"""
+        if self._closed:
+            raise ValueError(f"CSV writer for {self.full_path} is closed")
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+        self._raise_error()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        if self.needLogs and self.rows_written:
+            print(f"✅ {self.rows_written} rows written to: {self.full_path}")
+        self._raise_error()
+
+    def prepare(self, first_row):
+        """
+        Called before the first position() of a run, with the first row that will be written:
+        moves aside an existing file whose header lacks the row's columns (see _rotate_stale_file)
+        """
+        if self._file is None:
+            self._rotate_stale_file(first_row)
+
+    def position(self):
+        """Current end of the output (file size); only meaningful right after flush()"""
+        return os.path.getsize(self.full_path) if os.path.isfile(self.full_path) else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _rotate_stale_file(self, first_row):
+        """
+        Appending keeps the header of the existing file, and columns it does not have would be
+        dropped (e.g. run_id / finding_hash in a report written before they were added). Such a
+        file is renamed to <name>.<modified time>.csv so the report starts over with the full header.
+        """
+        if not isinstance(first_row, dict) or not os.path.isfile(self.full_path) or os.path.getsize(self.full_path) == 0:
+            return
+        with open(self.full_path, newline='', encoding='utf-8') as existing:
+            header = next(csv.reader(existing), None) or []
+        missing = [k for k in first_row.keys() if k.strip() != '' and k not in header]
+        if not missing:
+            return
+        stem, extension = os.path.splitext(self.full_path)
+        stamp = datetime.fromtimestamp(os.path.getmtime(self.full_path)).strftime("%Y%m%d-%H%M%S")
+        rotated = f"{stem}.{stamp}{extension}"
+        os.replace(self.full_path, rotated)
+        print(f"⚠️ {self.full_path} has no {', '.join(missing)} column(s): moved to {rotated}, starting a new file")
+
+    def _open(self, first_row):
+        os.makedirs(os.path.dirname(self.full_path), exist_ok=True)
+        self._rotate_stale_file(first_row)
+        has_content = os.path.isfile(self.full_path) and os.path.getsize(self.full_path) > 0
+        if has_content and self.headers is None and isinstance(first_row, dict):
+            # Keep the header schema of the file we are appending to
+            with open(self.full_path, newline='', encoding='utf-8') as existing:
+                self.headers = next(csv.reader(existing), None)
+        self._file = open(self.full_path, 'a', newline='', encoding='utf-8')
+
+        if isinstance(first_row, dict):
+            if self.headers is None:
+                self.headers = [k for k in first_row.keys() if k.strip() != '']
+            self._writer = csv.DictWriter(self._file, fieldnames=self.headers, restval='', extrasaction='ignore')
+            if not has_content:
+                self._writer.writeheader()
+        else:
+            if self.headers is None:
+                self.headers = [f"col{i+1}" for i in range(len(first_row))]
+            self._writer = csv.writer(self._file)
+            if not has_content:
+                self._writer.writerow(self.headers)
+
+    def _write_batch(self, rows):
+        if not rows:
+            return
+        try:
+            if self._file is None:
+                start = os.path.getsize(self.full_path) if os.path.isfile(self.full_path) else 0
+                self._open(rows[0])  # may write the header
+            else:
+                start = self._file.tell()
+            self._writer.writerows(rows)
+            self._file.flush()
+            self.rows_written += len(rows)
+            self.bytes_written += self._file.tell() - start
+        except Exception as e:
+            if self.error is None:
+                print(f"❌ Error writing CSV file {self.full_path}: {e}")
+                self.error = e
+
+    def _write_recorded(self, rows):
+        """_write_batch, timed and counted in metrics"""
+        if not rows:
+            return
+        started = time.monotonic()
+        bytes_before = self.bytes_written
+        self._write_batch(rows)
+        metrics.record_write(self.backend, self.output_name, len(rows), self.bytes_written - bytes_before,
+                             time.monotonic() - started)
+
+    def _run(self):
+        pending = []
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self._queue.get(timeout=timeout if pending else None)
+            except queue.Empty:
+                item = None
+
+            if item is _CLOSE or isinstance(item, (threading.Event, _Batches, _Marker)):
+                self._write_recorded(pending)
+                pending = []
+                last_flush = time.monotonic()
+                if item is _CLOSE:
+                    break
+                if isinstance(item, _Batches):
+                    self._write_source(item.source)
+                elif isinstance(item, _Marker):
+                    self._fire(item)
+                else:
+                    item.set()
+                continue
+
+            if item is not None:
+                pending.append(item)
+            if len(pending) >= self.batch_size or (pending and time.monotonic() - last_flush >= self.flush_interval):
+                self._write_recorded(pending)
+                pending = []
+                last_flush = time.monotonic()
+
+        self._close_output()
+        # A flush that raced with close() was queued behind _CLOSE: everything is written now
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _write_source(self, source):
+        try:
+            for rows in source.batches():
+                self._write_recorded(rows)
+        except Exception as e:
+            if self.error is None:
+                print(f"❌ Error reading queued rows for {self.full_path}: {e}")
+                self.error = e
+        finally:
+            source.release()
+
+    def _fire(self, marker):
+        try:
+            position = self.position() if self.error is None else None
+            marker.callback(position, self.error)
+        except Exception as e:
+            print(f"❌ Error recording a checkpoint for {self.full_path}: {e}")
+
+    def _close_output(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class TeeWriter:
+    """
+    Sends every row to several writers (e.g. CSV and Kafka). The first writer is the
+    primary: checkpoints track and truncate its output only.
+    """
+
+    def __init__(self, writers):
+        self.writers = writers
+        self.primary = writers[0]
+        self.full_path = self.primary.full_path
+        self.output_key = self.primary.output_key
+
+    @property
+    def _closed(self):
+        return any(writer._closed for writer in self.writers)
+
+    def write(self, row):
+        for writer in self.writers:
+            writer.write(row)
+
+    def write_many(self, rows):
+        rows = list(rows)
+        for writer in self.writers:
+            writer.write_many(rows)
+
+    def flush(self, timeout=None):
+        for writer in self.writers:
+            writer.flush(timeout)
+
+    def prepare(self, first_row):
+        for writer in self.writers:
+            writer.prepare(first_row)
+
+    def write_batches(self, source):
+        for writer in self.writers:
+            writer.write_batches(source)
+
+    def mark(self, callback):
+        """Callback of the primary's marker, after every writer has written the rows queued so far"""
+        remaining = [len(self.writers)]
+        errors = []
+        lock = threading.Lock()
+        primary_position = []
+
+        def reached(writer, position, error):
+            with lock:
+                if error is not None:
+                    errors.append(error)
+                if writer is self.primary:
+                    primary_position.append(position)
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            callback(primary_position[0], errors[0] if errors else None)
+
+        for writer in self.writers:
+            writer.mark(lambda position, error, writer=writer: reached(writer, position, error))
+
+    def close(self):
+        errors = []
+        for writer in self.writers:
+            try:
+                writer.close()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def position(self):
+        return self.primary.position()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def truncate_output(output_key, position):
+    """Cut an output back to a position returned by its writer's position(); True if anything was removed"""
+    if output_key.startswith("kafka:"):
+        return False  # published findings cannot be taken back; consumers dedupe on finding_hash
+    if output_key.startswith("sqlite:"):
+        from results_store import truncate_table_output
+        return truncate_table_output(output_key, position)
+    if os.path.isfile(output_key) and os.path.getsize(output_key) > position:
+        with open(output_key, 'r+b') as f:
+            f.truncate(position)
+        return True
+    return False
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_csv_writer(filename, output_dir=None, headers=None, needLogs=True):
+    """
+    Shared background writer for an output file, created on first use.
+    With RESULTS_BACKEND=sqlite the rows go to a table of the results store instead,
+    with RESULTS_BACKEND=kafka to the findings topic; "csv,kafka" writes to both.
+    """
+    if output_dir is None:
+        output_dir = OUTPUT_DIRECTORY
+    full_path = os.path.join(output_dir, filename)
+    with _writers_lock:
+        writer = _writers.get(full_path)
+        if writer is None or writer._closed:
+            writers = [new_writer(backend, filename, headers, output_dir, needLogs) for backend in RESULTS_BACKENDS]
+            writer = writers[0] if len(writers) == 1 else TeeWriter(writers)
+            _writers[full_path] = writer
+        return writer
+
+
+def new_writer(backend, filename, headers=None, output_dir=None, needLogs=True):
+    if backend == "sqlite":
+        from results_store import StoreWriter
+        return StoreWriter(filename, headers=headers, output_dir=output_dir, needLogs=needLogs)
+    if backend == "kafka":
+        from kafka_sink import KafkaWriter
+        return KafkaWriter(filename, headers=headers, output_dir=output_dir, needLogs=needLogs)
+    return CsvWriter(filename, headers=headers, output_dir=output_dir, needLogs=needLogs)
+
+
+def close_all_writers():
+    """Flush and close every writer opened through get_csv_writer"""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            print(f"❌ Error closing CSV file {writer.full_path}: {e}")
+
+
+atexit.register(close_all_writers)
+
+
 # Example usage
 if __name__ == "__main__":
     # Case 1: list of dicts (headers auto from keys)
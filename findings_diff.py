@@ -0,0 +1,236 @@
+import os
+import csv
+import sys
+import json
+import heapq
+import hashlib
+import sqlite3
+import argparse
+import tempfile
+from collections import defaultdict
+from dotenv import load_dotenv
+
+from csv_utils import CsvWriter
+
+load_dotenv('config.env')
+
+# Rows per in-memory sort chunk; bounds the diff's memory regardless of report size
+DIFF_CHUNK_SIZE = int(os.getenv("DIFF_CHUNK_SIZE", "500000"))
+
+RUN_COLUMN = "run_id"
+HASH_COLUMN = "finding_hash"
+TENANT_COLUMNS = ("tenant", "source_tenant")
+
+# Columns that identify a finding; amounts and diffs are left out so a changed
+# amount on the same ucode/batch/debit note is the same, persisting finding.
+# Reports not listed here hash every column.
+REPORT_KEYS = {
+    "dcCreatedStrNotCreated": ("source_tenant", "dest_tenant", "source_debit_note_number"),
+    "duplicateStrInwardInvoice": ("tenant", "invoice_no"),
+    "invalidInvoiceInPR": ("source_tenant", "purchase_issue_id", "invoice_id"),
+    "multiCNForStrInward": ("tenant", "return_order_id", "note_type"),
+    "noCNForStrInward": ("tenant", "invoice_id"),
+    "prSales": ("tenant", "purchase_issue_id"),
+    "nonRegularVendorType": ("tenant", "pre_purchase_issue_order_id"),
+    "strCreatedQunatitySameAmountMismatch": ("tenant", "dest_tenant", "ucode", "batch", "debit_note_number"),
+    "strCreatedReturnQunatityDifferent": ("tenant", "dest_tenant", "ucode", "batch", "debit_note_number"),
+    "ucodeNeverInwardForDCGenerated": ("tenant", "partner_detail_id", "ucode", "dest_tenant"),
+    "ucodeNeverInwardForDCNotGenerated": ("tenant", "partner_detail_id", "ucode", "dest_tenant"),
+}
+
+
+def report_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def finding_hash(report, row):
+    """Stable hash of a finding's key columns; the same for a Python row and its CSV round trip"""
+    keys = REPORT_KEYS.get(report) or sorted(k for k in row if k not in (RUN_COLUMN, HASH_COLUMN))
+    values = ["" if row.get(key) is None else str(row.get(key)).strip() for key in keys]
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()[:20]
+
+
+def stamp_finding(filename, row, run_id):
+    """Copy of a finding row with its run ID and content hash appended"""
+    if not isinstance(row, dict):
+        return row
+    stamped = dict(row)
+    stamped[RUN_COLUMN] = run_id or ""
+    stamped[HASH_COLUMN] = finding_hash(report_name(filename), row)
+    return stamped
+
+
+def tenant_of(row):
+    for column in TENANT_COLUMNS:
+        if row.get(column):
+            return str(row[column])
+    return ""
+
+
+def parse_source(spec):
+    """'path/to/report.csv@RUN_ID' or 'sqlite:table@RUN_ID' (run optional) -> (location, run_id)"""
+    location, _, run_id = spec.rpartition("@") if "@" in spec else (spec, "", "")
+    return location, run_id or None
+
+
+def iter_source_rows(location, run_id=None, db_path=None):
+    """Stream the rows of one run from a CSV report or a results store table"""
+    if location.startswith("sqlite:"):
+        from results_store import RESULTS_DB, quote
+        db = sqlite3.connect(db_path or RESULTS_DB)
+        db.row_factory = sqlite3.Row
+        try:
+            table = location[len("sqlite:"):]
+            query = f"SELECT * FROM {quote(table)}"
+            cursor = db.execute(query + f" WHERE {RUN_COLUMN} = ?", (run_id,)) if run_id else db.execute(query)
+            for row in cursor:
+                row = dict(row)
+                row.pop("row_id", None)
+                yield row
+        finally:
+            db.close()
+        return
+
+    with open(location, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            if run_id is None or row.get(RUN_COLUMN) == run_id:
+                yield row
+
+
+def write_sorted_chunk(lines, workdir):
+    lines.sort()
+    fd, path = tempfile.mkstemp(dir=workdir, suffix=".chunk")
+    with os.fdopen(fd, "w", encoding="utf-8") as chunk:
+        chunk.writelines(lines)
+    return path
+
+
+def iter_sorted_findings(rows, report, workdir, chunk_size=DIFF_CHUNK_SIZE):
+    """
+    External sort of a run's findings by (tenant, hash): sorted chunks of at most
+    chunk_size rows are spilled to disk and merged lazily. Yields unique
+    (tenant, hash, row_json); repeated findings within a run count once.
+    """
+    chunks = []
+    lines = []
+    for row in rows:
+        digest = row.get(HASH_COLUMN) or finding_hash(report, row)
+        lines.append(f"{tenant_of(row)}\t{digest}\t{json.dumps(row, default=str)}\n")
+        if len(lines) >= chunk_size:
+            chunks.append(write_sorted_chunk(lines, workdir))
+            lines = []
+    if lines:
+        chunks.append(write_sorted_chunk(lines, workdir))
+
+    files = [open(path, encoding="utf-8") for path in chunks]
+    try:
+        previous = None
+        for line in heapq.merge(*files):
+            tenant, digest, row_json = line.rstrip("\n").split("\t", 2)
+            if (tenant, digest) == previous:
+                continue
+            previous = (tenant, digest)
+            yield tenant, digest, row_json
+    finally:
+        for f in files:
+            f.close()
+
+
+def merge_diff(old_findings, new_findings):
+    """Walk two (tenant, hash)-sorted streams, yielding ('new'|'resolved'|'persisting', tenant, row_json)"""
+    old = next(old_findings, None)
+    new = next(new_findings, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[:2] < new[:2]):
+            yield "resolved", old[0], old[2]
+            old = next(old_findings, None)
+        elif old is None or new[:2] < old[:2]:
+            yield "new", new[0], new[2]
+            new = next(new_findings, None)
+        else:
+            yield "persisting", new[0], new[2]
+            old = next(old_findings, None)
+            new = next(new_findings, None)
+
+
+def diff_runs(old_spec, new_spec, output_dir=None, report=None, chunk_size=DIFF_CHUNK_SIZE,
+              write_persisting=False, db_path=None):
+    """
+    Compare two runs of one report and write new.csv, resolved.csv (and persisting.csv)
+    plus a per-tenant summary.csv to output_dir. Returns {tenant: {status: count}}.
+    """
+    old_location, old_run = parse_source(old_spec)
+    new_location, new_run = parse_source(new_spec)
+    if report is None:
+        if new_location.startswith("sqlite:"):
+            from results_store import report_of_table
+            report = report_of_table(new_location[len("sqlite:"):])
+        else:
+            report = report_name(new_location)
+    if output_dir is None:
+        base = os.path.dirname(os.path.abspath(new_location)) if not new_location.startswith("sqlite:") else os.getcwd()
+        output_dir = os.path.join(base, f"DIFF_{report}_{old_run or 'old'}_{new_run or 'new'}")
+
+    statuses = ("new", "resolved") + (("persisting",) if write_persisting else ())
+    writers = {status: CsvWriter(f"{status}.csv", output_dir=output_dir, needLogs=False) for status in statuses}
+    summary = defaultdict(lambda: {"new": 0, "resolved": 0, "persisting": 0})
+    try:
+        with tempfile.TemporaryDirectory(prefix="recon-diff-") as workdir:
+            old_findings = iter_sorted_findings(
+                iter_source_rows(old_location, old_run, db_path), report, workdir, chunk_size
+            )
+            new_findings = iter_sorted_findings(
+                iter_source_rows(new_location, new_run, db_path), report, workdir, chunk_size
+            )
+            for status, tenant, row_json in merge_diff(old_findings, new_findings):
+                summary[tenant][status] += 1
+                if status in writers:
+                    writers[status].write(json.loads(row_json))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    summary_writer = CsvWriter(
+        "summary.csv", headers=["check", "tenant", "new", "resolved", "persisting"], output_dir=output_dir, needLogs=False
+    )
+    with summary_writer:
+        for tenant in sorted(summary):
+            summary_writer.write(dict(summary[tenant], check=report, tenant=tenant))
+
+    totals = {status: sum(counts[status] for counts in summary.values()) for status in ("new", "resolved", "persisting")}
+    print(f"📊 {report}: new={totals['new']} resolved={totals['resolved']} persisting={totals['persisting']} -> {output_dir}")
+    return dict(summary)
+
+
+def count_runs(location, db_path=None):
+    """Rows per run ID in a report, in one streaming pass"""
+    counts = defaultdict(int)
+    for row in iter_source_rows(location, db_path=db_path):
+        counts[row.get(RUN_COLUMN) or ""] += 1
+    return dict(counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run-over-run diff of recon findings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runs_parser = commands.add_parser("runs", help="List run IDs present in a report")
+    runs_parser.add_argument("source", help="report CSV path or sqlite:<table>")
+    diff_parser = commands.add_parser("diff", help="Compare two runs of a report")
+    diff_parser.add_argument("old", help="older run: <report.csv or sqlite:table>[@RUN_ID]")
+    diff_parser.add_argument("new", help="newer run: <report.csv or sqlite:table>[@RUN_ID]")
+    diff_parser.add_argument("--output-dir")
+    diff_parser.add_argument("--report", help="Report name for key columns (default: from the file or table name)")
+    diff_parser.add_argument("--persisting", action="store_true", help="Also write persisting.csv")
+    diff_parser.add_argument("--chunk-size", type=int, default=DIFF_CHUNK_SIZE)
+    for command_parser in (runs_parser, diff_parser):
+        command_parser.add_argument("--db", help="Results store for sqlite: sources (default: RESULTS_DB)")
+    args = parser.parse_args()
+
+    if args.command == "runs":
+        for run_id, count in sorted(count_runs(args.source, args.db).items()):
+            print(f"{run_id or '(no run id)'}: {count} rows")
+    else:
+        if "@" not in args.old and "@" not in args.new and args.old == args.new:
+            print("❌ Give two different files, or the same report with @RUN_ID on each side")
+            sys.exit(1)
+        diff_runs(args.old, args.new, args.output_dir, args.report, args.chunk_size, args.persisting, args.db)
@@ -1,21 +1,13 @@
-from getDBConnection import create_db_connection
+from tenant_registry import get_registry
 from dotenv import load_dotenv
 import os
 
 load_dotenv('config.env')
 
 def getAllWarehouse():
-    """Get all warehouse tenants that are set up"""
+    """Get all warehouse tenants that are set up, from the cached tenant registry"""
     try:
-        connection = create_db_connection("mercury")
-        cursor = connection.cursor()
-        cursor.execute("SELECT tenant FROM warehouse WHERE is_setup = 1 ORDER BY tenant;")
-        result = cursor.fetchall()
-        cursor.close()
-        connection.close()
-           
-        return [row[0] for row in result]
-        
+        return get_registry().warehouses
     except Exception as e:
         print(f"Error fetching warehouse data: {e}")
         return []
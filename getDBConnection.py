@@ -1,33 +1,299 @@
 import os
+import time
+import json
+import atexit
 import pymysql
+from contextlib import contextmanager
+from threading import Condition, Lock
 from dotenv import load_dotenv
-import json
+
+from metrics import metrics, InstrumentedCursor
+from query_plans import plans, ExplainingCursor
 
 load_dotenv('config.env')
 
-def create_db_connection(db_name):
-    try:
-        
-        DB_NAME = str(db_name).upper()
-        config_dict = {}
+# Pool tuning, overridable from config.env
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))                  # connections per DB host
+POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))       # seconds before an idle connection is closed
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "120"))  # seconds to wait for a free connection
+POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "1"))             # ping connections idle for longer than this
+
+_config_cache = {}
+_pools = {}
+_pools_lock = Lock()
+
+
+def get_db_config(db_name):
+    """Return the parsed *_DB_CONFIG for a database, falling back to MERCURY_DB_CONFIG"""
+    DB_NAME = str(db_name).upper()
+    config_dict = _config_cache.get(DB_NAME)
+    if config_dict is None:
         config_dict = json.loads(os.getenv(f"{DB_NAME}_DB_CONFIG", "{}"))
         if config_dict == {}:
             config_dict = json.loads(os.getenv(f"MERCURY_DB_CONFIG", "{}"))
-            
-        host = config_dict['host']
-        user = config_dict['user']
-        password = config_dict['password']
-        port = config_dict['port'] if 'port' in config_dict else 3306
-  
-        connection = pymysql.connect(
+        _config_cache[DB_NAME] = config_dict
+    return config_dict
+
+
+def get_host_key(db_name):
+    """Key identifying the server (and credentials) a database lives on"""
+    config_dict = get_db_config(db_name)
+    return (
+        config_dict['host'],
+        int(config_dict.get('port', 3306)),
+        config_dict['user'],
+        config_dict['password']
+    )
+
+
+class ConnectionPool:
+    """Thread-safe pool of pymysql connections to a single DB host"""
+
+    def __init__(self, host_key, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, ping_after=POOL_PING_AFTER):
+        self.host_key = host_key
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self._idle = []   # LIFO stack of (connection, current_db, last_used)
+        self._size = 0    # idle + checked out connections
+        self._cond = Condition()
+        self.stats = {
+            "checkouts": 0,
+            "hits": 0,
+            "waits": 0,
+            "creations": 0,
+            "evictions": 0,
+            "health_check_failures": 0,
+        }
+
+    @property
+    def label(self):
+        host, port, user, _ = self.host_key
+        return f"{user}@{host}:{port}"
+
+    def _connect(self, db_name):
+        host, port, user, password = self.host_key
+        return pymysql.connect(
             host=host,
             user=user,
             password=password,
             port=port,
             database=db_name
         )
-        return connection
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _evict_idle_locked(self, now):
+        """Drop connections idle for longer than idle_timeout, returns them for closing"""
+        expired = [entry for entry in self._idle if now - entry[2] > self.idle_timeout]
+        if expired:
+            self._idle = [entry for entry in self._idle if now - entry[2] <= self.idle_timeout]
+            self._size -= len(expired)
+            self.stats["evictions"] += len(expired)
+            self._cond.notify(len(expired))
+        return [entry[0] for entry in expired]
+
+    def acquire(self, db_name, timeout=POOL_CHECKOUT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            entry = None
+            waited = False
+            with self._cond:
+                expired = self._evict_idle_locked(time.time())
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    if not waited:
+                        self.stats["waits"] += 1
+                        waited = True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise pymysql.err.OperationalError(
+                            f"Timed out waiting for a connection to {self.label} (pool size {self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                self.stats["checkouts"] += 1
+                if entry:
+                    self.stats["hits"] += 1
+            for raw in expired:
+                self._discard(raw)
+
+            if entry is None:
+                try:
+                    raw = self._connect(db_name)
+                except Exception:
+                    self._forget()
+                    raise
+                with self._cond:
+                    self.stats["creations"] += 1
+                return raw, db_name
+
+            raw, current_db, last_used = entry
+            if time.time() - last_used >= self.ping_after:
+                try:
+                    raw.ping(reconnect=False)
+                except Exception:
+                    with self._cond:
+                        self.stats["health_check_failures"] += 1
+                    self._discard(raw)
+                    self._forget()
+                    continue
+            if current_db != db_name:
+                try:
+                    raw.select_db(db_name)
+                except Exception:
+                    self.release(raw, current_db)
+                    raise
+            return raw, db_name
+
+    def _forget(self):
+        """Give back a slot whose connection was never created or has been discarded"""
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def release(self, raw, current_db):
+        healthy = raw.open
+        result = getattr(raw, "_result", None)
+        if healthy and result is not None and getattr(result, "unbuffered_active", False):
+            # An unbuffered result set was never drained, the protocol state is unusable
+            healthy = False
+        if healthy:
+            try:
+                # End any implicit transaction so the next borrower does not see a stale snapshot
+                raw.rollback()
+            except Exception:
+                healthy = False
+        if not healthy:
+            self._discard(raw)
+            self._forget()
+            return
+        with self._cond:
+            self._idle.append((raw, current_db, time.time()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+    def get_stats(self):
+        with self._cond:
+            return dict(self.stats, size=self._size, idle=len(self._idle), max_size=self.max_size)
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled pymysql connection. Behaves like the underlying
+    connection; close() returns it to the pool instead of closing the socket.
+    """
+
+    def __init__(self, pool, raw, db_name):
+        self._pool = pool
+        self._raw = raw
+        self._db_name = db_name
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise pymysql.err.InterfaceError(f"Connection to {self.__dict__.get('_db_name')} was already returned to the pool")
+        return getattr(raw, name)
+
+    def cursor(self, cursor=None):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise pymysql.err.InterfaceError(f"Connection to {self._db_name} was already returned to the pool")
+        wrapped = raw.cursor(cursor)
+        if metrics.enabled:
+            wrapped = InstrumentedCursor(wrapped, self._pool.label, self._db_name)
+        if plans.enabled:
+            # Outermost, so the EXPLAIN round trip is not counted in the query's own metrics
+            wrapped = ExplainingCursor(wrapped, self._pool.label, self._db_name)
+        return wrapped
+
+    def close(self):
+        raw = self.__dict__.get("_raw")
+        if raw is not None:
+            self._raw = None
+            self._pool.release(raw, self._db_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # Scripts that forget to close still hand the connection back
+        self.close()
+
+
+def get_pool(db_name):
+    host_key = get_host_key(db_name)
+    pool = _pools.get(host_key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(host_key)
+            if pool is None:
+                pool = ConnectionPool(host_key)
+                _pools[host_key] = pool
+    return pool
+
+
+def create_db_connection(db_name):
+    try:
+        pool = get_pool(db_name)
+        started = time.monotonic()
+        raw, current_db = pool.acquire(db_name)
+        metrics.record_pool_wait(pool.label, time.monotonic() - started)
+        return PooledConnection(pool, raw, current_db)
 
     except Exception as e:
         print(f"Error connecting to database: {e}")
         raise
+
+
+@contextmanager
+def get_connection(db_name):
+    """Borrow a pooled connection: `with get_connection(tenant) as conn: ...`"""
+    conn = create_db_connection(db_name)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_pool_stats():
+    """Pool statistics keyed by `user@host:port`"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.label: pool.get_stats() for pool in pools}
+
+
+def print_pool_stats():
+    for label, stats in get_pool_stats().items():
+        print(
+            f"📊 Pool {label}: checkouts={stats['checkouts']} hits={stats['hits']} waits={stats['waits']} "
+            f"creations={stats['creations']} evictions={stats['evictions']} "
+            f"health_check_failures={stats['health_check_failures']} open={stats['size']}/{stats['max_size']}"
+        )
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_all_pools)
@@ -0,0 +1,254 @@
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+from threading import Lock
+from dotenv import load_dotenv
+
+from csv_utils import CsvWriter
+from findings_diff import report_name, TENANT_COLUMNS
+
+try:
+    from confluent_kafka import Producer
+except ImportError:  # only needed when RESULTS_BACKEND includes kafka
+    Producer = None
+
+load_dotenv('config.env')
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")  # "mock" keeps messages in memory
+KAFKA_FINDINGS_TOPIC = os.getenv("KAFKA_FINDINGS_TOPIC", "recon-findings")
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION", "lz4")
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "50"))                  # wait this long to fill a batch
+KAFKA_BATCH_BYTES = int(os.getenv("KAFKA_BATCH_BYTES", "1000000"))
+KAFKA_MAX_BUFFERED = int(os.getenv("KAFKA_MAX_BUFFERED", "100000"))        # undelivered messages held by the producer
+KAFKA_FLUSH_TIMEOUT = float(os.getenv("KAFKA_FLUSH_TIMEOUT", "60"))
+KAFKA_PRODUCE_TIMEOUT = float(os.getenv("KAFKA_PRODUCE_TIMEOUT", "60"))   # give up when the buffer stays full this long
+KAFKA_CONFIG = json.loads(os.getenv("KAFKA_CONFIG", "{}"))                 # extra librdkafka settings (security etc.)
+
+
+class MockProducer:
+    """
+    In-memory stand-in for confluent_kafka.Producer (same produce / poll / flush calls),
+    used with KAFKA_BOOTSTRAP_SERVERS=mock. Delivered messages are kept in `messages`.
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(config or {})
+        self.max_buffered = int(self.config.get("queue.buffering.max.messages", KAFKA_MAX_BUFFERED))
+        self.messages = []
+        self._pending = []
+        self._lock = Lock()
+
+    def produce(self, topic, value=None, key=None, headers=None, on_delivery=None):
+        with self._lock:
+            if len(self._pending) >= self.max_buffered:
+                raise BufferError("Local: Queue full")
+            self._pending.append((topic, key, value, headers, on_delivery))
+
+    def poll(self, timeout=0):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self.messages.extend(message[:4] for message in pending)
+        for topic, key, value, headers, on_delivery in pending:
+            if on_delivery is not None:
+                on_delivery(None, MockMessage(topic, key, value))
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class MockMessage:
+    def __init__(self, topic, key, value):
+        self._topic, self._key, self._value = topic, key, value
+
+    def topic(self):
+        return self._topic
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+
+_producer = None
+_producer_lock = Lock()
+
+
+def producer_config():
+    config = {
+        "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+        "compression.type": KAFKA_COMPRESSION,
+        "linger.ms": KAFKA_LINGER_MS,
+        "batch.size": KAFKA_BATCH_BYTES,
+        "queue.buffering.max.messages": KAFKA_MAX_BUFFERED,
+        "enable.idempotence": True,
+    }
+    config.update(KAFKA_CONFIG)
+    return config
+
+
+def get_producer():
+    """One producer per process, shared by every report's writer (producers are thread-safe)"""
+    global _producer
+    with _producer_lock:
+        if _producer is None:
+            if KAFKA_BOOTSTRAP_SERVERS == "mock":
+                _producer = MockProducer(producer_config())
+            elif Producer is None:
+                raise ImportError("confluent-kafka is not installed: pip install confluent-kafka (or RESULTS_BACKEND=csv)")
+            else:
+                _producer = Producer(producer_config())
+        return _producer
+
+
+def json_default(value):
+    return str(value)  # Decimal, date and datetime columns
+
+
+class KafkaWriter(CsvWriter):
+    """
+    CsvWriter counterpart that publishes a report's rows to the findings topic, keyed by
+    tenant so each tenant's findings stay ordered within one partition. Check threads only
+    queue rows; the writer thread produces them asynchronously, and when the producer's
+    buffer is full it is the writer thread that waits for deliveries, never a DB reader.
+    A checkpoint marker only fires once the broker has acknowledged every message before
+    it, so units are recorded as done only after their findings are delivered.
+    """
+
+    backend = "kafka"
+
+    def __init__(self, filename, headers=None, output_dir=None, topic=KAFKA_FINDINGS_TOPIC, producer=None, **kwargs):
+        self.report = report_name(filename)
+        self.topic = topic
+        self.producer = producer if producer is not None else get_producer()  # producers define __len__
+        self.produced = 0
+        self.delivered = 0
+        self.failed = 0
+        self._delivery_lock = Lock()
+        super().__init__(filename, headers=headers, output_dir=output_dir, **kwargs)
+        self.output_key = f"kafka:{topic}#{self.report}"
+        self.full_path = f"kafka topic {topic} [{self.report}]"  # for log messages
+
+    def position(self):
+        """Messages delivered so far; produced messages cannot be taken back on resume"""
+        return self.delivered
+
+    def flush(self, timeout=None):
+        """
+        Wait until queued rows are handed to the producer. Broker acknowledgements are awaited
+        by checkpoint markers (on the writer thread) and on close.
+        """
+        super().flush(timeout)
+
+    def prepare(self, first_row):
+        pass  # every message carries its own columns
+
+    def _on_delivery(self, err, msg):
+        with self._delivery_lock:
+            if err is None:
+                self.delivered += 1
+                return
+            self.failed += 1
+            first = self.failed == 1
+        if first:
+            print(f"❌ Kafka delivery failed for {self.report} on {self.topic}: {err}")
+
+    def _open(self, first_row):
+        if not isinstance(first_row, dict) and self.headers is None:
+            self.headers = [f"col{i+1}" for i in range(len(first_row))]
+        self._file = self.producer
+
+    def _await_deliveries(self, timeout=KAFKA_FLUSH_TIMEOUT):
+        """Poll until every message this writer produced is acknowledged or failed; False on timeout"""
+        deadline = time.monotonic() + timeout
+        while self.delivered + self.failed < self.produced:
+            if time.monotonic() >= deadline:
+                return False
+            self.producer.poll(0.1)
+        return True
+
+    def _fire(self, marker):
+        if self.error is None:
+            if not self._await_deliveries():
+                self.error = TimeoutError(f"{self.produced - self.delivered - self.failed} {self.report} findings "
+                                          f"not acknowledged by {self.topic} after {KAFKA_FLUSH_TIMEOUT:.0f}s")
+            elif self.failed:
+                self.error = RuntimeError(f"{self.failed} {self.report} findings were not delivered to {self.topic}")
+        super()._fire(marker)
+
+    def _message(self, row):
+        if not isinstance(row, dict):
+            row = dict(zip(self.headers, row))
+        tenant = next((row[column] for column in TENANT_COLUMNS if row.get(column)), "")
+        value = json.dumps({"report": self.report, **row}, default=json_default)
+        return str(tenant).encode("utf-8"), value.encode("utf-8")
+
+    def _write_batch(self, rows):
+        if not rows or self.error is not None:
+            return  # after a failure the units stay unrecorded and are produced again on resume
+        try:
+            if self._file is None:
+                self._open(rows[0])
+            for row in rows:
+                key, value = self._message(row)
+                deadline = time.monotonic() + KAFKA_PRODUCE_TIMEOUT
+                while True:
+                    try:
+                        self.producer.produce(self.topic, value=value, key=key,
+                                              headers={"report": self.report}, on_delivery=self._on_delivery)
+                        break
+                    except BufferError:
+                        if time.monotonic() >= deadline:
+                            raise TimeoutError(f"producer buffer still full after {KAFKA_PRODUCE_TIMEOUT:.0f}s")
+                        self.producer.poll(0.5)  # in-flight buffer full: wait for deliveries
+                self.produced += 1
+                self.bytes_written += len(value)
+            self.producer.poll(0)
+            self.rows_written += len(rows)
+        except Exception as e:
+            if self.error is None:
+                print(f"❌ Error producing {self.report} to Kafka topic {self.topic}: {e}")
+                self.error = e
+
+    def _close_output(self):
+        if self._file is not None:
+            remaining = self.producer.flush(KAFKA_FLUSH_TIMEOUT)
+            if remaining:
+                print(f"⚠️ {remaining} messages still undelivered to {self.topic} after {KAFKA_FLUSH_TIMEOUT:.0f}s")
+            if self.failed:
+                print(f"❌ {self.failed} {self.report} findings were not delivered to {self.topic}")
+            if (remaining or self.failed) and self.error is None:
+                # close() raises it: the run must not end as if every finding was published
+                self.error = RuntimeError(f"{self.failed} {self.report} findings not delivered to {self.topic}, "
+                                          f"{remaining} still undelivered")
+
+
+def publishCsv(path, topic=KAFKA_FINDINGS_TOPIC):
+    """Publish an existing findings CSV, e.g. from a run made with RESULTS_BACKEND=csv"""
+    writer = KafkaWriter(os.path.basename(path), topic=topic)
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            writer.write(row)
+    writer.close()
+    return writer.delivered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish findings CSVs to the Kafka findings topic")
+    parser.add_argument("files", nargs="+", help="Findings CSV files")
+    parser.add_argument("--topic", default=KAFKA_FINDINGS_TOPIC)
+    args = parser.parse_args()
+
+    for path in args.files:
+        if not os.path.isfile(path):
+            print(f"❌ No such file: {path}")
+            sys.exit(1)
+        print(f"📤 {path}: {publishCsv(path, args.topic)} findings delivered to {args.topic}")
@@ -0,0 +1,368 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+import pymysql
+from datetime import datetime, timedelta
+from decimal import Decimal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from getDBConnection import get_connection
+from metrics import metrics, query_name
+
+load_dotenv('config.env')
+
+MIRROR_DIRECTORY = os.getenv("MIRROR_DIRECTORY", os.path.join(os.getcwd(), ".recon_mirror"))
+MIRROR_SINCE = os.getenv("MIRROR_SINCE", "2025-05-28")              # oldest created_on any check looks at
+MIRROR_PAGE_SIZE = int(os.getenv("MIRROR_PAGE_SIZE", "5000"))        # rows per keyset page
+MIRROR_OVERLAP_SECONDS = int(os.getenv("MIRROR_OVERLAP_SECONDS", "300"))  # re-read window for late commits
+MIRROR_RECONCILE_HOURS = float(os.getenv("MIRROR_RECONCILE_HOURS", "24"))  # how often ids are compared to drop hard deletes
+USE_MIRROR = os.getenv("RECON_USE_MIRROR", "0") == "1"
+
+# Only the columns the recon checks read. Every table is synced by its
+# (updated_on, id) high-water mark, plus (created_on, id) for rows never updated;
+# rows older than MIRROR_SINCE are never copied.
+MIRROR_TABLES = {
+    "purchase_issue": [
+        "id", "partner_detail_id", "tray_id", "invoice_id", "invoice_no", "invoice_sequence_type",
+        "pr_type", "invoice_date", "invoice_tenant", "status", "debit_note_number", "created_on", "updated_on",
+    ],
+    "purchase_issue_item": [
+        "id", "purchase_issue_id", "ucode", "batch", "return_quantity", "amount", "created_on", "updated_on",
+    ],
+    "inward_invoice": [
+        "id", "invoice_no", "purchase_type", "status", "total", "created_by", "created_on", "updated_on",
+    ],
+    "inward_invoice_item": [
+        "id", "invoice_id", "code", "batch", "quantity", "net_amount", "created_on", "updated_on",
+    ],
+}
+
+# SQLite column types; everything else is TEXT compared case-insensitively like MySQL
+NUMERIC_COLUMNS = {"id", "purchase_issue_id", "invoice_id", "tray_id", "partner_detail_id"}
+REAL_COLUMNS = {"return_quantity", "amount", "total", "quantity", "net_amount"}
+
+# Keyset passes per table: (sync_state key suffix, watermark column, extra filter).
+# Rows never updated have a NULL updated_on and are followed by created_on instead;
+# each pass orders by one indexed column (plus the primary key), so no page filesorts.
+SYNC_PASSES = (
+    ("", "updated_on", ""),
+    (":created", "created_on", "AND updated_on IS NULL"),
+)
+
+# Read connections to tenant mirrors kept open per thread by fetch_all()
+MIRROR_READERS_PER_THREAD = 8
+
+MIRROR_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_pi_pdi ON purchase_issue (partner_detail_id, created_on)",
+    "CREATE INDEX IF NOT EXISTS idx_pii_pi ON purchase_issue_item (purchase_issue_id)",
+    "CREATE INDEX IF NOT EXISTS idx_ii_invoice_no ON inward_invoice (invoice_no)",
+    "CREATE INDEX IF NOT EXISTS idx_iii_invoice ON inward_invoice_item (invoice_id)",
+    "CREATE INDEX IF NOT EXISTS idx_iii_code ON inward_invoice_item (code)",
+]
+
+
+def mirror_path(tenant, directory=None):
+    return os.path.join(directory or MIRROR_DIRECTORY, f"{tenant}.sqlite")
+
+
+def column_type(column):
+    if column in NUMERIC_COLUMNS:
+        return "INTEGER"
+    if column in REAL_COLUMNS:
+        return "REAL"
+    return "TEXT COLLATE NOCASE"
+
+
+def to_sqlite(value):
+    """MySQL values as stored in the mirror; datetimes keep MySQL's 'YYYY-MM-DD HH:MM:SS' text form"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if value is not None and not isinstance(value, (int, float, str, bytes)):
+        return str(value)
+    return value
+
+
+def from_sqlite(value):
+    """Aggregates come back as floats; hand them to the checks as Decimal like pymysql does"""
+    if isinstance(value, float):
+        return Decimal(str(round(value, 6)))
+    return value
+
+
+def open_mirror(tenant, create=False, directory=None):
+    """Open a tenant's mirror database (created on first sync)"""
+    path = mirror_path(tenant, directory)
+    if not create and not os.path.isfile(path):
+        raise ValueError(f"No local mirror for tenant {tenant}, run `python3 local_mirror.py sync` first")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    if create:
+        for table, columns in MIRROR_TABLES.items():
+            definitions = ", ".join(
+                f"{column} {column_type(column)}" + (" PRIMARY KEY" if column == "id" else "") for column in columns
+            )
+            db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definitions})")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                table_name TEXT PRIMARY KEY,
+                watermark TEXT NOT NULL,
+                last_id INTEGER NOT NULL,
+                rows_synced INTEGER NOT NULL,
+                synced_on TEXT NOT NULL
+            )
+        """)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS reconcile_state (
+                table_name TEXT PRIMARY KEY,
+                rows_removed INTEGER NOT NULL,
+                reconciled_on TEXT NOT NULL
+            )
+        """)
+        for statement in MIRROR_INDEXES:
+            db.execute(statement)
+        db.commit()
+    return db
+
+
+def get_sync_state(db, table):
+    row = db.execute("SELECT watermark, last_id FROM sync_state WHERE table_name = ?", (table,)).fetchone()
+    return (row["watermark"], row["last_id"]) if row else (None, 0)
+
+
+def sync_table(tenant, db, table, page_size=MIRROR_PAGE_SIZE, overlap_seconds=MIRROR_OVERLAP_SECONDS):
+    """
+    Pull rows of one table changed since its high-water marks: one keyset pass on
+    (updated_on, id) and one on (created_on, id) for rows whose updated_on is NULL.
+    Each page is upserted together with its pass's new watermark, so an interrupted
+    sync resumes where it stopped. A pass without a watermark yet (a new mirror, or
+    the created_on pass of a mirror built before it existed) copies the whole window.
+    """
+    return sum(
+        sync_pass(tenant, db, table, table + suffix, column, condition, page_size, overlap_seconds)
+        for suffix, column, condition in SYNC_PASSES
+    )
+
+
+def sync_pass(tenant, db, table, state_key, column, condition, page_size, overlap_seconds):
+    columns = MIRROR_TABLES[table]
+    watermark, last_id = get_sync_state(db, state_key)
+    if watermark is None:
+        # First sync of this pass: full copy of the window the checks look at
+        watermark, last_id = "1970-01-01 00:00:00", 0
+    elif overlap_seconds:
+        # Rows committed late can carry a timestamp just below the mark; upserts make re-reads harmless
+        watermark = (datetime.strptime(watermark, "%Y-%m-%d %H:%M:%S") - timedelta(seconds=overlap_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        last_id = 0
+
+    query = f"""
+        SELECT {", ".join(columns)}
+        FROM {table}
+        WHERE {column} >= %s
+          AND ({column} > %s OR id > %s)
+          AND created_on >= %s
+          {condition}
+        ORDER BY {column}, id
+        LIMIT %s
+    """
+    placeholders = ",".join(["?"] * len(columns))
+    upsert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    total = 0
+    with get_connection(tenant) as conn:
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        try:
+            while True:
+                cursor.execute(query, (watermark, watermark, last_id, MIRROR_SINCE, page_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                watermark, last_id = to_sqlite(rows[-1][column]), rows[-1]["id"]
+                with db:
+                    db.executemany(upsert, [tuple(to_sqlite(row[c]) for c in columns) for row in rows])
+                    db.execute(
+                        "INSERT OR REPLACE INTO sync_state (table_name, watermark, last_id, rows_synced, synced_on) "
+                        "VALUES (?, ?, ?, COALESCE((SELECT rows_synced FROM sync_state WHERE table_name = ?), 0) + ?, ?)",
+                        (state_key, watermark, last_id, state_key, len(rows), datetime.now().isoformat())
+                    )
+                total += len(rows)
+                if len(rows) < page_size:
+                    break
+        finally:
+            cursor.close()
+    return total
+
+
+def reconcile_due(db, table, every_hours=MIRROR_RECONCILE_HOURS):
+    row = db.execute("SELECT reconciled_on FROM reconcile_state WHERE table_name = ?", (table,)).fetchone()
+    if row is None:
+        return True
+    return datetime.now() - datetime.fromisoformat(row["reconciled_on"]) >= timedelta(hours=every_hours)
+
+
+def reconcile_table(tenant, db, table, page_size=MIRROR_PAGE_SIZE):
+    """
+    Drop mirror rows that were hard-deleted in production: the watermark never sees
+    a deleted row, so the ids of both sides are compared one keyset page at a time.
+    Returns the number of rows removed.
+    """
+    query = f"SELECT id FROM {table} WHERE id > %s AND created_on >= %s ORDER BY id LIMIT %s"
+    removed = 0
+    last_id = 0
+    with get_connection(tenant) as conn:
+        cursor = conn.cursor()
+        try:
+            while True:
+                cursor.execute(query, (last_id, MIRROR_SINCE, page_size))
+                ids = {row[0] for row in cursor.fetchall()}
+                if len(ids) < page_size:
+                    # Last page: everything after the previous page's end is compared
+                    mirrored = db.execute(f"SELECT id FROM {table} WHERE id > ?", (last_id,)).fetchall()
+                else:
+                    mirrored = db.execute(
+                        f"SELECT id FROM {table} WHERE id > ? AND id <= ?", (last_id, max(ids))
+                    ).fetchall()
+                gone = [(row["id"],) for row in mirrored if row["id"] not in ids]
+                if gone:
+                    with db:
+                        db.executemany(f"DELETE FROM {table} WHERE id = ?", gone)
+                    removed += len(gone)
+                if len(ids) < page_size:
+                    break
+                last_id = max(ids)
+        finally:
+            cursor.close()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO reconcile_state (table_name, rows_removed, reconciled_on) VALUES (?, ?, ?)",
+            (table, removed, datetime.now().isoformat())
+        )
+    return removed
+
+
+def sync_tenant(tenant, tables=None, reconcile=False):
+    """
+    Bring a tenant's mirror up to date, returns {table: rows pulled}.
+    Tables not reconciled for MIRROR_RECONCILE_HOURS (or all, with reconcile=True)
+    also drop the rows deleted in production.
+    """
+    db = open_mirror(tenant, create=True)
+    try:
+        pulled, removed = {}, {}
+        for table in (tables or MIRROR_TABLES):
+            pulled[table] = sync_table(tenant, db, table)
+            if reconcile or reconcile_due(db, table):
+                removed[table] = reconcile_table(tenant, db, table)
+        print(f"✅ Synced mirror for tenant {tenant}: " + ", ".join(f"{table}={count}" for table, count in pulled.items()))
+        if any(removed.values()):
+            print(f"🧹 Removed rows deleted in production for tenant {tenant}: "
+                  + ", ".join(f"{table}={count}" for table, count in removed.items() if count))
+        return pulled
+    finally:
+        db.close()
+
+
+def sync_all(tenants, max_workers=4, tables=None, reconcile=False):
+    """Sync many tenants concurrently; a failed tenant keeps its previous mirror and watermark"""
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(sync_tenant, tenant, tables, reconcile): tenant for tenant in tenants}
+        for future in as_completed(futures):
+            tenant = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Error syncing mirror for tenant {tenant}: {e}")
+                failed.append(tenant)
+    return failed
+
+
+_readers = threading.local()
+
+
+def mirror_reader(tenant):
+    """
+    This thread's read connection to a tenant's mirror, opened once and reused by
+    later queries; the least recently used is closed past MIRROR_READERS_PER_THREAD
+    """
+    readers = getattr(_readers, "connections", None)
+    if readers is None:
+        readers = _readers.connections = OrderedDict()
+    db = readers.get(tenant)
+    if db is not None:
+        readers.move_to_end(tenant)
+        return db
+    db = readers[tenant] = open_mirror(tenant)
+    while len(readers) > MIRROR_READERS_PER_THREAD:
+        readers.popitem(last=False)[1].close()
+    return db
+
+
+def fetch_all(tenant, query, params=None):
+    """
+    Run a read query for a tenant and return dict rows, from the local mirror when
+    RECON_USE_MIRROR=1, otherwise from production. Queries must stick to SQL both
+    engines understand (plain SELECT/JOIN/GROUP BY/SUM with %s placeholders).
+    """
+    if not USE_MIRROR:
+        with get_connection(tenant) as conn:
+            cursor = conn.cursor(pymysql.cursors.DictCursor)
+            try:
+                cursor.execute(query, tuple(params) if params else None)
+                return list(cursor.fetchall())
+            finally:
+                cursor.close()
+
+    db = mirror_reader(tenant)
+    started = time.monotonic()
+    cursor = db.execute(query.replace("%s", "?"), tuple(params) if params else ())
+    try:
+        rows = [{key: from_sqlite(row[key]) for key in row.keys()} for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    metrics.record_query("mirror", tenant, query_name(query), "execute", time.monotonic() - started, len(rows))
+    return rows
+
+
+def print_mirror_status(tenants):
+    for tenant in tenants:
+        if not os.path.isfile(mirror_path(tenant)):
+            print(f"{tenant}: not synced")
+            continue
+        db = open_mirror(tenant)
+        try:
+            states = db.execute("SELECT table_name, watermark, rows_synced FROM sync_state ORDER BY table_name").fetchall()
+            print(f"{tenant}: " + ", ".join(f"{s['table_name']} @ {s['watermark']} ({s['rows_synced']} rows)" for s in states))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    from getAllWarehouse import getAllWarehouse
+    from getAllArsenal import getAllArsenal
+
+    parser = argparse.ArgumentParser(description="Local mirror of recon tables, synced incrementally")
+    parser.add_argument("command", choices=["sync", "status"])
+    parser.add_argument("--tenants", nargs="*", help="Tenants to sync (default: all warehouses and arsenals)")
+    parser.add_argument("--tables", nargs="*", choices=list(MIRROR_TABLES), help="Tables to sync (default: all)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Compare ids with production now to drop deleted rows (default: every MIRROR_RECONCILE_HOURS)")
+    args = parser.parse_args()
+
+    tenants = args.tenants or (getAllWarehouse() + getAllArsenal())
+    if args.command == "status":
+        print_mirror_status(tenants)
+    else:
+        failed = sync_all(tenants, max_workers=args.workers, tables=args.tables, reconcile=args.reconcile)
+        if failed:
+            print(f"❌ {len(failed)} tenants failed to sync: {failed}")
+            sys.exit(1)
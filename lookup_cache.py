@@ -0,0 +1,138 @@
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from dotenv import load_dotenv
+
+load_dotenv('config.env')
+
+LOOKUP_CACHE_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "200000"))
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "0"))  # seconds, 0 = never expire
+
+
+class LookupCache:
+    """
+    Process-wide, size-bounded LRU cache for destination lookups, keyed by
+    (dest_tenant, kind, key). Concurrent threads asking for the same key while
+    it is being loaded wait for that single in-flight query (single-flight).
+    """
+
+    def __init__(self, max_entries=LOOKUP_CACHE_MAX_ENTRIES, ttl=LOOKUP_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # cache key -> (value, expires_at)
+        self._in_flight = {}           # cache key -> Future
+        self._lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def _lookup_locked(self, cache_key, now):
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return False, None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            del self._entries[cache_key]
+            self.stats["expired"] += 1
+            return False, None
+        self._entries.move_to_end(cache_key)
+        return True, value
+
+    def _store_locked(self, cache_key, value, now, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl else None
+        self._entries[cache_key] = (value, expires_at)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get_many(self, dest_tenant, kind, keys, loader, default=None, default_ttl=None):
+        """
+        Return {key: value} for keys. Keys that are neither cached nor in flight are
+        loaded with one loader(missing_keys) call, which returns {key: value};
+        keys it leaves out are cached as `default` (e.g. "not found"), for default_ttl
+        seconds when given (0 = not cached), for answers that can still change.
+        Loader errors are propagated and never cached.
+        """
+        result = {}
+        to_load = []
+        waiting = {}
+        now = time.time()
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                cache_key = (dest_tenant, kind, key)
+                found, value = self._lookup_locked(cache_key, now)
+                if found:
+                    self.stats["hits"] += 1
+                    result[key] = value
+                elif cache_key in self._in_flight:
+                    self.stats["coalesced"] += 1
+                    waiting[key] = self._in_flight[cache_key]
+                else:
+                    self.stats["misses"] += 1
+                    self._in_flight[cache_key] = Future()
+                    to_load.append(key)
+
+        if to_load:
+            loaded = None
+            error = None
+            try:
+                loaded = loader(to_load)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                # Always settle and drop the in-flight futures, even on KeyboardInterrupt / SystemExit,
+                # so threads waiting on these keys never block forever
+                now = time.time()
+                with self._lock:
+                    for key in to_load:
+                        cache_key = (dest_tenant, kind, key)
+                        future = self._in_flight.pop(cache_key)
+                        if loaded is None:
+                            future.set_exception(error if isinstance(error, Exception) else
+                                                 RuntimeError(f"Lookup of {kind} for {dest_tenant} was interrupted"))
+                            continue
+                        value = loaded.get(key, default)
+                        if key in loaded or default_ttl is None:
+                            self._store_locked(cache_key, value, now)
+                        elif default_ttl > 0:
+                            self._store_locked(cache_key, value, now, default_ttl)
+                        future.set_result(value)
+                        result[key] = value
+
+        # Keys another thread is loading; its loader error is re-raised here
+        for key, future in waiting.items():
+            result[key] = future.result()
+        return result
+
+    def get(self, dest_tenant, kind, key, loader, default=None):
+        """Single-key form of get_many; loader(key) returns the value"""
+        return self.get_many(dest_tenant, kind, [key], lambda missing: {key: loader(key)}, default)[key]
+
+    def invalidate(self, dest_tenant, kind, keys):
+        """Forget cached answers for keys, e.g. after a change event for them"""
+        with self._lock:
+            for key in keys:
+                self._entries.pop((dest_tenant, kind, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, size=len(self._entries), max_entries=self.max_entries)
+
+
+# Shared by every check running in this process
+destination_cache = LookupCache()
+
+
+def print_cache_stats(cache=destination_cache):
+    stats = cache.get_stats()
+    print(
+        f"📊 Lookup cache: hits={stats['hits']} misses={stats['misses']} coalesced={stats['coalesced']} "
+        f"evictions={stats['evictions']} expired={stats['expired']} size={stats['size']}/{stats['max_entries']}"
+    )
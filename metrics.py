@@ -0,0 +1,340 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+from functools import lru_cache
+from threading import Lock
+from dotenv import load_dotenv
+
+load_dotenv('config.env')
+
+METRICS_ENABLED = os.getenv("RECON_METRICS", "0") == "1"
+METRICS_DIRECTORY = os.getenv("METRICS_DIRECTORY", os.path.join(os.getcwd(), ".recon_metrics"))
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", os.path.join(METRICS_DIRECTORY, "recon.prom"))  # for node_exporter's textfile collector
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Prometheus HELP text; histograms are labelled by check, host and query, per-tenant totals by check and tenant
+METRIC_HELP = {
+    "recon_query_duration_seconds": "Time spent in cursor.execute (phase=execute) and fetch calls (phase=fetch)",
+    "recon_query_rows_total": "Rows fetched",
+    "recon_query_errors_total": "Queries that raised",
+    "recon_tenant_query_seconds_total": "Query time (execute + fetch) per tenant database",
+    "recon_tenant_rows_total": "Rows fetched per tenant database",
+    "recon_pool_wait_seconds": "Time spent waiting to check a connection out of the pool",
+    "recon_unit_seconds_total": "Wall time of scheduler work units per tenant",
+    "recon_output_write_seconds": "Time spent writing a batch of findings",
+    "recon_output_rows_total": "Findings written",
+    "recon_output_bytes_total": "Bytes written (CSV and Kafka outputs)",
+    "recon_run_duration_seconds": "Wall time of the run so far",
+}
+
+
+# Patterns over query_shape() text, shared with query_plans.py
+# Literal lists as well as %s lists, so batches with inlined values (getInwardInvoices) are one shape
+LITERAL_LIST = re.compile(r"\bin \(\s*(?:'[^']*'|-?\d+(?:\.\d+)?|%s)(?:\s*,\s*(?:'[^']*'|-?\d+(?:\.\d+)?|%s))*\s*\)")
+UNION_TENANT = re.compile(r"select '(\w+)' as __recon_tenant")
+SCHEMA_TABLE = re.compile(r"\b(?:from|join)\s+`?(\w+)`?\.`?\w+")
+
+
+@lru_cache(maxsize=4096)
+def query_shape(sql):
+    """Normalised query text: whitespace collapsed, lower case, IN lists of any length as IN (...)"""
+    shape = re.sub(r"\s+", " ", sql.strip()).lower()
+    return re.sub(r"\bin \(\s*%s(?:\s*,\s*%s)*\s*\)", "in (...)", shape)
+
+
+def without_schema(match):
+    """SCHEMA_TABLE match with its schema replaced by {tenant}"""
+    start = match.start()
+    return match.group(0)[:match.start(1) - start] + "{tenant}" + match.group(0)[match.end(1) - start:]
+
+
+@lru_cache(maxsize=4096)
+def label_shape(sql):
+    """
+    query_shape without anything tenant-specific: schema qualifiers, UNION ALL tenant tags
+    and the number of branches, and literal IN lists. Tenants stay on the per-tenant counters.
+    """
+    shape = LITERAL_LIST.sub("in (...)", query_shape(sql))
+    shape = UNION_TENANT.sub("select '{tenant}' as __recon_tenant", SCHEMA_TABLE.sub(without_schema, shape))
+    return " union all ".join(dict.fromkeys(shape.split(" union all ")))
+
+
+@lru_cache(maxsize=4096)
+def query_name(sql):
+    """Short stable label of a query shape: verb, first table and a hash of the shape"""
+    shape = label_shape(sql)
+    verb = shape.lstrip("(").split(" ", 1)[0] if shape else "?"
+    table = re.search(r"\b(?:from|into|update)\s+(?:`?[\w{}]+`?\.)?`?(\w+)", shape)
+    digest = hashlib.sha1(shape.encode("utf-8")).hexdigest()[:8]
+    return f"{verb}:{table.group(1) if table else '-'}:{digest}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Process-wide counters and latency histograms. Recording is a dict update under one
+    lock; when disabled every record_* call returns immediately.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.check = ""  # label of the check currently running (checks run one after another)
+        self.started = time.time()
+        self._lock = Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}    # (name, labels) -> value
+
+    def enable(self):
+        self.enabled = True
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def _inc(self, name, labels, amount=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def record_query(self, host, tenant, query, phase, seconds, rows=0, error=False):
+        if not self.enabled:
+            return
+        check = self.check
+        with self._lock:
+            self._observe("recon_query_duration_seconds", (("check", check), ("host", host), ("query", query), ("phase", phase)), seconds)
+            self._inc("recon_tenant_query_seconds_total", (("check", check), ("tenant", tenant)), seconds)
+            if rows:
+                self._inc("recon_query_rows_total", (("check", check), ("host", host), ("query", query)), rows)
+                self._inc("recon_tenant_rows_total", (("check", check), ("tenant", tenant)), rows)
+            if error:
+                self._inc("recon_query_errors_total", (("check", check), ("host", host), ("query", query)))
+
+    def record_pool_wait(self, host, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._observe("recon_pool_wait_seconds", (("host", host),), seconds)
+
+    def record_unit(self, tenant, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._inc("recon_unit_seconds_total", (("check", self.check), ("tenant", tenant)), seconds)
+
+    def record_write(self, backend, output, rows, written_bytes, seconds):
+        if not self.enabled:
+            return
+        labels = (("backend", backend), ("output", output))
+        with self._lock:
+            self._observe("recon_output_write_seconds", labels, seconds)
+            self._inc("recon_output_rows_total", labels, rows)
+            if written_bytes:
+                self._inc("recon_output_bytes_total", labels, written_bytes)
+
+    def _top(self, name, group_by, limit):
+        totals = {}
+        for (metric, labels), value in self._counters.items():
+            if metric == name:
+                key = tuple(label_value for label, label_value in labels if label in group_by)
+                totals[key] = totals.get(key, 0) + value
+        return sorted(totals.items(), key=lambda item: -item[1])[:limit]
+
+    def summary(self, limit=20):
+        """Run summary: totals, slowest tenants and queries, pool waits and outputs"""
+        with self._lock:
+            queries = {}
+            for (name, labels), histogram in self._histograms.items():
+                if name != "recon_query_duration_seconds":
+                    continue
+                label = dict(labels)
+                entry = queries.setdefault(label["query"], {"query": label["query"], "seconds": 0.0, "calls": 0, "p95_execute": 0.0, "max": 0.0})
+                entry["seconds"] += histogram.sum
+                entry["max"] = max(entry["max"], histogram.max)
+                if label["phase"] == "execute":
+                    entry["calls"] += histogram.count
+                    entry["p95_execute"] = max(entry["p95_execute"], histogram.quantile(0.95))
+            pool_waits = {
+                dict(labels)["host"]: {"checkouts": histogram.count, "seconds": round(histogram.sum, 3), "max": round(histogram.max, 3)}
+                for (name, labels), histogram in self._histograms.items() if name == "recon_pool_wait_seconds"
+            }
+            outputs = {}
+            for (name, labels), value in self._counters.items():
+                if name in ("recon_output_rows_total", "recon_output_bytes_total"):
+                    label = dict(labels)
+                    entry = outputs.setdefault(f"{label['backend']}:{label['output']}", {"rows": 0, "bytes": 0})
+                    entry["rows" if name == "recon_output_rows_total" else "bytes"] += value
+            return {
+                "started": self.started,
+                "duration_seconds": round(time.time() - self.started, 3),
+                "query_seconds": round(sum(q["seconds"] for q in queries.values()), 3),
+                "queries": sum(q["calls"] for q in queries.values()),
+                "errors": sum(v for (n, _), v in self._counters.items() if n == "recon_query_errors_total"),
+                "top_tenants_by_query_seconds": [
+                    {"check": check, "tenant": tenant, "seconds": round(seconds, 3)}
+                    for (check, tenant), seconds in self._top("recon_tenant_query_seconds_total", ("check", "tenant"), limit)
+                ],
+                "top_tenants_by_unit_seconds": [
+                    {"check": check, "tenant": tenant, "seconds": round(seconds, 3)}
+                    for (check, tenant), seconds in self._top("recon_unit_seconds_total", ("check", "tenant"), limit)
+                ],
+                "top_queries": [
+                    dict(entry, seconds=round(entry["seconds"], 3), max=round(entry["max"], 3), p95_execute=round(entry["p95_execute"], 3))
+                    for entry in sorted(queries.values(), key=lambda q: -q["seconds"])[:limit]
+                ],
+                "pool_waits": pool_waits,
+                "outputs": outputs,
+            }
+
+    def prometheus_text(self):
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        def render(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                describe(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{render(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{render(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{render(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{render(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                describe(name, "counter")
+                lines.append(f"{name}{render(labels)} {value:.6f}" if isinstance(value, float) else f"{name}{render(labels)} {value}")
+        describe("recon_run_duration_seconds", "gauge")
+        lines.append(f"recon_run_duration_seconds {time.time() - self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, run_id=None, directory=METRICS_DIRECTORY, textfile=METRICS_TEXTFILE):
+        """JSON summary for the run and the Prometheus textfile, both replaced atomically"""
+        run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        summary = dict(self.summary(), run_id=run_id)
+        summary_path = os.path.join(directory, f"{run_id}.json")
+        write_atomic(summary_path, json.dumps(summary, indent=2, default=str))
+        write_atomic(textfile, self.prometheus_text())
+        print(f"📈 Metrics: summary {summary_path}, Prometheus textfile {textfile}")
+        for entry in summary["top_tenants_by_query_seconds"][:5]:
+            print(f"📈   {entry['tenant']} ({entry['check'] or '-'}): {entry['seconds']:.1f}s in queries")
+        return summary_path
+
+
+def write_atomic(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=directory, suffix=".partial")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+
+class InstrumentedCursor:
+    """Cursor proxy timing execute and fetch calls and counting the rows they return"""
+
+    def __init__(self, cursor, host, tenant):
+        self._cursor = cursor
+        self._host = host
+        self._tenant = tenant
+        self._query = "-"
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _call(self, phase, method, *args):
+        started = time.monotonic()
+        try:
+            result = method(*args)
+        except Exception:
+            metrics.record_query(self._host, self._tenant, self._query, phase, time.monotonic() - started, error=True)
+            raise
+        if phase == "execute":
+            rows = 0
+        elif phase == "fetchone":
+            phase, rows = "fetch", int(result is not None)
+        else:
+            rows = len(result) if result else 0
+        metrics.record_query(self._host, self._tenant, self._query, phase, time.monotonic() - started, rows)
+        return result
+
+    def execute(self, query, args=None):
+        self._query = query_name(query)
+        return self._call("execute", self._cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        self._query = query_name(query)
+        return self._call("execute", self._cursor.executemany, query, args)
+
+    def fetchone(self):
+        return self._call("fetchone", self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._call("fetch", self._cursor.fetchmany, *(() if size is None else (size,)))
+
+    def fetchall(self):
+        return self._call("fetch", self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+
+# Shared by every module in the process
+metrics = Metrics()
@@ -6,7 +6,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from csv_utils import append_to_csv
 
 
-# Static PDI to tenant mapping based on pdi_tenant_map.csv
+# Static PDI to tenant mapping based on pdi_tenant_map.csv.
+# Checks read tenant_registry.pdiToTenantMap (loaded from mercury); this map is only
+# its fallback when mercury has no partner detail mapping, see `tenant_registry.py compare`
 pdiToTenantMap = {
 "1893":"ar001",
 "1887":"ar008", 
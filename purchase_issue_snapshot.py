@@ -0,0 +1,168 @@
+import os
+import pickle
+import pymysql
+import shutil
+import tempfile
+from threading import Lock
+from collections import defaultdict
+from dotenv import load_dotenv
+
+from tenant_registry import pdiToTenantMap
+from getDBConnection import get_connection
+from stream_utils import stream_query
+
+load_dotenv('config.env')
+
+SNAPSHOT_DIRECTORY = os.getenv("SNAPSHOT_DIRECTORY", os.path.join(os.getcwd(), ".recon_runs"))
+SNAPSHOT_SINCE = os.getenv("SNAPSHOT_SINCE", "2025-08-26")  # oldest created_on / invoice_date any consumer reads
+SNAPSHOT_BATCH_SIZE = 1000  # purchase issues per page; their items are read with one IN query
+
+# Union of the purchase_issue / purchase_issue_item columns the consuming checks read.
+# Purchase issues without items are kept with item_id None, like a LEFT JOIN.
+SNAPSHOT_COLUMNS = (
+    "purchase_issue_id", "partner_detail_id", "tray_id", "invoice_id", "invoice_no", "invoice_sequence_type",
+    "pr_type", "invoice_date", "invoice_tenant", "status", "debit_note_number", "created_on",
+    "item_id", "ucode", "batch", "return_quantity", "amount",
+)
+
+
+def snapshotQuery(pdis):
+    """
+    purchase_issue alone, so the keyset on pi.id walks the primary key instead of
+    sorting a join result on every page; items are fetched per page (itemsQuery)
+    """
+    placeholders = ",".join(["%s"] * len(pdis))
+    return f"""
+        SELECT pi.id AS purchase_issue_id, pi.partner_detail_id, pi.tray_id, pi.invoice_id, pi.invoice_no,
+               pi.invoice_sequence_type, pi.pr_type, pi.invoice_date, pi.invoice_tenant, pi.status,
+               pi.debit_note_number, pi.created_on
+        FROM purchase_issue pi
+        WHERE pi.status NOT IN ('cancelled', 'DELETED')
+          AND pi.partner_detail_id IN ({placeholders})
+          AND (pi.created_on >= %s OR pi.invoice_date >= %s)
+    """
+
+
+def itemsQuery(count):
+    return f"""
+        SELECT pii.purchase_issue_id, pii.id AS item_id, pii.ucode, pii.batch, pii.return_quantity, pii.amount
+        FROM purchase_issue_item pii
+        WHERE pii.purchase_issue_id IN ({",".join(["%s"] * count)})
+        ORDER BY pii.purchase_issue_id, pii.id
+    """
+
+
+def fetchItems(tenant, purchaseIssueIds):
+    """{purchase_issue_id: item rows} for one page of purchase issues"""
+    items = defaultdict(list)
+    with get_connection(tenant) as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute(itemsQuery(len(purchaseIssueIds)), purchaseIssueIds)
+            for row in cursor.fetchall():
+                items[row["purchase_issue_id"]].append(row)
+    return items
+
+
+def joinItems(purchaseIssues, items):
+    """The LEFT JOIN of a page of purchase issues with their items, ordered by (pi.id, pii.id)"""
+    rows = []
+    for purchaseIssue in purchaseIssues:
+        for item in items.get(purchaseIssue["purchase_issue_id"]) or [{}]:
+            row = dict(purchaseIssue)
+            row.update(item)
+            row.setdefault("item_id", None)
+            rows.append(row)
+    return rows
+
+
+# MySQL comparison semantics for views derived in Python
+
+def on_or_after(value, day):
+    """`column >= 'YYYY-MM-DD'` for DATE/DATETIME values; NULL never matches"""
+    return value is not None and str(value) >= day
+
+
+def not_equal(value, literal):
+    """`column <> 'literal'` under a case-insensitive collation; NULL never matches"""
+    return value is not None and str(value).rstrip().upper() != literal.upper()
+
+
+def has_text(value):
+    """`column IS NOT NULL AND column != ''`"""
+    return value is not None and str(value).rstrip() != ""
+
+
+def group_key(*values):
+    """GROUP BY key for a case-insensitive, trailing-space-insensitive collation"""
+    return tuple(None if value is None else str(value).rstrip().upper() for value in values)
+
+
+class PurchaseIssueSnapshot:
+    """
+    One scan of purchase_issue (+ items) per tenant per run, shared by every check
+    that needs it. Rows are streamed from MySQL into a compact on-disk frame
+    (pickled tuple batches) and each check derives its own view by iterating it,
+    so memory is bounded by one batch per tenant being read.
+    """
+
+    def __init__(self, run_id=None, directory=SNAPSHOT_DIRECTORY, since=SNAPSHOT_SINCE):
+        self.since = since
+        self.pdis = list(pdiToTenantMap.keys())
+        if run_id:
+            # Kept next to the run's checkpoint so a resumed run sees the same data
+            self.directory = os.path.join(directory, f"{run_id}.snapshot")
+            self._temporary = False
+        else:
+            self.directory = tempfile.mkdtemp(prefix="recon-snapshot-")
+            self._temporary = True
+        os.makedirs(self.directory, exist_ok=True)
+        self._locks = defaultdict(Lock)
+        self._locks_lock = Lock()
+        self.stats = {"scans": 0, "reads": 0}
+
+    def path(self, tenant):
+        return os.path.join(self.directory, f"{tenant}.pkl")
+
+    def _tenant_lock(self, tenant):
+        with self._locks_lock:
+            return self._locks[tenant]
+
+    def load(self, tenant):
+        """Scan a tenant once; later calls (from any check or thread) reuse the frame"""
+        with self._tenant_lock(tenant):
+            path = self.path(tenant)
+            if os.path.isfile(path):
+                return path
+            partial = path + ".partial"
+            rows = 0
+            with open(partial, "wb") as frame:
+                params = tuple(self.pdis) + (self.since, self.since)
+                for purchaseIssues in stream_query(tenant, snapshotQuery(self.pdis), params, batch_size=SNAPSHOT_BATCH_SIZE,
+                                                   key="pi.id", key_field="purchase_issue_id"):
+                    items = fetchItems(tenant, [row["purchase_issue_id"] for row in purchaseIssues])
+                    batch = joinItems(purchaseIssues, items)
+                    pickle.dump([tuple(row.get(column) for column in SNAPSHOT_COLUMNS) for row in batch], frame,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                    rows += len(batch)
+            os.replace(partial, path)  # only complete frames are ever reused
+            self.stats["scans"] += 1
+            print(f"📸 Snapshot of purchase issues for tenant {tenant}: {rows} rows")
+            return path
+
+    def iter_rows(self, tenant):
+        """Yield the tenant's snapshot rows as dicts keyed by SNAPSHOT_COLUMNS"""
+        path = self.load(tenant)
+        self.stats["reads"] += 1
+        with open(path, "rb") as frame:
+            while True:
+                try:
+                    batch = pickle.load(frame)
+                except EOFError:
+                    return
+                for values in batch:
+                    yield dict(zip(SNAPSHOT_COLUMNS, values))
+
+    def close(self):
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        print(f"📊 Purchase issue snapshot: scans={self.stats['scans']} reads={self.stats['reads']}")
@@ -0,0 +1,133 @@
+import os
+import re
+import pymysql
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED
+from dotenv import load_dotenv
+
+from getDBConnection import get_connection, get_host_key
+from work_scheduler import scheduler
+
+load_dotenv('config.env')
+
+# Number of tenant schemas folded into one UNION ALL statement
+DEFAULT_GROUP_SIZE = int(os.getenv("UNION_BATCH_SIZE", "25"))
+TENANT_COLUMN = "__recon_tenant"
+TENANT_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+# `*` or `alias.*` in a select list: branch columns would follow each schema's own column order
+SELECT_STAR = re.compile(r"(?:^|[\s,])(?:`?\w+`?\.)?\*\s*(?:,|FROM\b)", re.IGNORECASE)
+
+
+def render_template(query_template, tenant):
+    """Fill the {tenant} schema placeholder of a per-tenant query"""
+    if not TENANT_PATTERN.match(tenant):
+        raise ValueError(f"Invalid tenant schema name: {tenant!r}")
+    return query_template.replace("{tenant}", tenant).strip().rstrip(";")
+
+
+def selects_star(query_template):
+    """True if the template selects `*`, which cannot be safely combined with UNION ALL"""
+    return SELECT_STAR.search(query_template) is not None
+
+
+def group_tenants_by_host(tenants):
+    """Group tenants that live on the same DB server, preserving order"""
+    groups = defaultdict(list)
+    for tenant in tenants:
+        groups[get_host_key(tenant)].append(tenant)
+    return groups
+
+
+def build_union_query(query_template, tenants, params=None):
+    """
+    Build one UNION ALL statement over several tenant schemas.
+    Each branch is tagged with a literal tenant column used to demultiplex rows.
+    UNION ALL matches columns by position, so the template must list its columns:
+    with `*`, a schema whose table has its columns in another order would mislabel rows.
+    """
+    if selects_star(query_template):
+        raise ValueError("UNION ALL templates need an explicit column list, not SELECT *")
+    parts = []
+    for tenant in tenants:
+        subquery = render_template(query_template, tenant)
+        parts.append(f"(SELECT '{tenant}' AS {TENANT_COLUMN}, q.* FROM ({subquery}) q)")
+    query = "\nUNION ALL\n".join(parts)
+    query_params = tuple(params) * len(tenants) if params else None
+    return query, query_params
+
+
+def run_per_tenant(query_template, tenant, params=None, cursor_class=pymysql.cursors.DictCursor):
+    """Run the template against a single tenant"""
+    with get_connection(tenant) as conn:
+        cursor = conn.cursor(cursor_class)
+        try:
+            cursor.execute(render_template(query_template, tenant), tuple(params) if params else None)
+            return list(cursor.fetchall())
+        finally:
+            cursor.close()
+
+
+def run_tenant_group(query_template, tenants, params=None):
+    """
+    Run one UNION ALL round trip for a group of same-host tenants, returns {tenant: rows}.
+    Tenants whose query failed even on its own are left out of the result.
+    """
+    results = {tenant: [] for tenant in tenants}
+    if len(tenants) > 1 and not selects_star(query_template):
+        query, query_params = build_union_query(query_template, tenants, params)
+        try:
+            with get_connection(tenants[0]) as conn:
+                cursor = conn.cursor(pymysql.cursors.DictCursor)
+                try:
+                    cursor.execute(query, query_params)
+                    for row in cursor.fetchall():
+                        results[row.pop(TENANT_COLUMN)].append(row)
+                finally:
+                    cursor.close()
+            return results
+        except pymysql.MySQLError as e:
+            # Schemas can drift (missing table, different column set); fall back to one query per tenant
+            print(f"⚠️ UNION ALL failed for {len(tenants)} tenants starting at {tenants[0]}, falling back per tenant: {e}")
+
+    for tenant in tenants:
+        try:
+            results[tenant] = run_per_tenant(query_template, tenant, params)
+        except Exception as e:
+            print(f"❌ Error running query for tenant {tenant}: {e}")
+            del results[tenant]
+    return results
+
+
+def iter_tenant_groups(tenants, group_size=DEFAULT_GROUP_SIZE):
+    """Yield lists of at most group_size tenants that share a DB host"""
+    for host_tenants in group_tenants_by_host(tenants).values():
+        for i in range(0, len(host_tenants), group_size):
+            yield host_tenants[i:i + group_size]
+
+
+def iter_query_across_tenants(query_template, tenants, params=None, group_size=DEFAULT_GROUP_SIZE):
+    """
+    Run a per-tenant query template (schema-qualified with {tenant}) across
+    many tenants, yielding a {tenant: rows} dict per UNION ALL group as it completes.
+    Each group is a scheduler unit on its host. A SELECT * template runs once per tenant.
+    """
+    if selects_star(query_template):
+        print("⚠️ Query selects *, running it per tenant instead of UNION ALL; list its columns to batch it")
+        group_size = 1
+    pending = {
+        scheduler.submit(run_tenant_group, query_template, group, params, db=group[0], tenant=group[0])
+        for group in iter_tenant_groups(tenants, group_size)
+    }
+    while pending:
+        done = scheduler.wait(pending, return_when=FIRST_COMPLETED)
+        pending -= done
+        for future in done:
+            yield future.result()
+
+
+def run_query_across_tenants(query_template, tenants, params=None, group_size=DEFAULT_GROUP_SIZE):
+    """Same as iter_query_across_tenants but returns a single {tenant: rows} dict"""
+    results = {}
+    for group_results in iter_query_across_tenants(query_template, tenants, params, group_size):
+        results.update(group_results)
+    return results
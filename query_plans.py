@@ -0,0 +1,302 @@
+import os
+import io
+import csv
+import sys
+import json
+import time
+import argparse
+import pymysql
+from threading import Lock
+from dotenv import load_dotenv
+
+from metrics import metrics, query_shape, query_name, write_atomic, LITERAL_LIST, UNION_TENANT, SCHEMA_TABLE
+
+load_dotenv('config.env')
+
+EXPLAIN_ENABLED = os.getenv("RECON_EXPLAIN", "0") == "1"
+EXPLAIN_DIRECTORY = os.getenv("EXPLAIN_DIRECTORY", os.path.join(os.getcwd(), ".recon_plans"))
+EXPLAIN_ROWS_THRESHOLD = float(os.getenv("EXPLAIN_ROWS_THRESHOLD", "100000"))  # estimated rows examined per query
+
+EXPLAINABLE = ("select", "(select", "with")
+
+REPORT_COLUMNS = ["check", "tenant", "host", "query", "flags", "rows_examined", "query_cost", "shape"]
+
+
+def plan_shape(sql):
+    """query_shape with inlined literal IN lists collapsed too"""
+    return LITERAL_LIST.sub("in (...)", query_shape(sql))
+
+
+def query_tenants(sql, db_name):
+    """
+    Tenants a query reads: the branches of a query_batcher UNION ALL, else the schemas
+    it names explicitly (e.g. `{tenant}.inward_invoice` over the mercury connection),
+    else the database it runs on.
+    """
+    shape = query_shape(sql)
+    tenants = UNION_TENANT.findall(shape)
+    if tenants:
+        return tenants
+    schemas = list(dict.fromkeys(SCHEMA_TABLE.findall(shape)))
+    return schemas or [str(db_name)]
+
+
+def walk(node, visit):
+    if isinstance(node, dict):
+        visit(node)
+        for value in node.values():
+            walk(value, visit)
+    elif isinstance(node, list):
+        for item in node:
+            walk(item, visit)
+
+
+def table_rows(table):
+    """Rows read per scan of a table: rows_examined_per_scan (MySQL) or rows (MariaDB)"""
+    try:
+        return float(table.get("rows_examined_per_scan", table.get("rows", 0)) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def rows_examined(node):
+    """
+    Estimated rows a plan reads. Within a nested loop every table is scanned once per row
+    joined before it, so its rows per scan are multiplied by that prefix; materialized
+    subqueries and union branches are added on top.
+    """
+    if isinstance(node, list):
+        return sum(rows_examined(item) for item in node)
+    if not isinstance(node, dict):
+        return 0.0
+    total = 0.0
+    for key, value in node.items():
+        if key == "nested_loop" and isinstance(value, list):
+            prefix = 1.0
+            for entry in value:
+                table = entry.get("table", {}) if isinstance(entry, dict) else {}
+                total += prefix * table_rows(table) + rows_examined(table)
+                if "rows_produced_per_join" in table:
+                    prefix = float(table["rows_produced_per_join"])
+                else:
+                    prefix *= table_rows(table) * float(table.get("filtered", 100)) / 100
+        elif key == "table" and isinstance(value, dict):
+            total += table_rows(value) + rows_examined(value)
+        elif isinstance(value, (dict, list)):
+            total += rows_examined(value)
+    return total
+
+
+def analyze_plan(plan, rows_threshold=EXPLAIN_ROWS_THRESHOLD):
+    """
+    Problems in one EXPLAIN FORMAT=JSON plan (MySQL 5.7+ and MariaDB layouts): full table
+    and full index scans, filesort, temporary tables and an estimate of rows examined
+    above rows_threshold. Returns {"flags", "rows_examined", "query_cost", "tables"}.
+    """
+    flags, tables = [], []
+
+    def flag(name):
+        if name not in flags:
+            flags.append(name)
+
+    def visit(node):
+        if node.get("using_filesort") is True or isinstance(node.get("filesort"), dict):
+            flag("filesort")
+        if node.get("using_temporary_table") is True or isinstance(node.get("temporary_table"), dict):
+            flag("temporary")
+        table = node.get("table")
+        if isinstance(table, dict) and "table_name" in table:
+            name = table["table_name"]
+            access = table.get("access_type")
+            tables.append({"table": name, "access_type": access, "key": table.get("key"), "rows": table_rows(table)})
+            if name.startswith("<") or "materialized_from_subquery" in table:
+                return  # derived / union result tables are always read whole
+            if access == "ALL":
+                flag(f"full_scan({name})")
+            elif access == "index":
+                flag(f"full_index_scan({name})")
+
+    walk(plan, visit)
+    examined = rows_examined(plan)
+    if examined > rows_threshold:
+        flag(f"rows>{rows_threshold:g}")
+    block = plan.get("query_block", {}) if isinstance(plan, dict) else {}
+    cost = block.get("cost_info", {}).get("query_cost") if isinstance(block.get("cost_info"), dict) else None
+    return {"flags": flags, "rows_examined": round(examined), "query_cost": float(cost) if cost is not None else None,
+            "tables": tables}
+
+
+def union_branches(plan):
+    """Per-branch plans of a UNION ALL, in statement order (None for other plans)"""
+    block = plan.get("query_block", {}) if isinstance(plan, dict) else {}
+    union = block.get("union_result")
+    if isinstance(union, dict) and isinstance(union.get("query_specifications"), list):
+        return union["query_specifications"]
+    return None
+
+
+def plan_text(row):
+    """The JSON document of an EXPLAIN FORMAT=JSON row (tuple or dict cursor)"""
+    if isinstance(row, dict):
+        return next(iter(row.values()))
+    return row[0]
+
+
+class PlanCollector:
+    """
+    Opt-in EXPLAIN capture. The first time a query shape runs against a tenant, the same
+    statement (with its real parameters) is EXPLAINed and analyzed; later runs of that
+    shape on that tenant are not explained again. Reports are written at the end of a run.
+    """
+
+    def __init__(self, enabled=EXPLAIN_ENABLED, rows_threshold=EXPLAIN_ROWS_THRESHOLD):
+        self.enabled = enabled
+        self.rows_threshold = rows_threshold
+        self.plans = []
+        self.errors = 0
+        self._seen = set()
+        self._lock = Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def claim(self, host, db_name, query):
+        """True for the first caller to see this (host, database, shape); that caller explains it"""
+        if not self.enabled:
+            return False
+        shape = plan_shape(query)
+        if not shape.startswith(EXPLAINABLE):
+            return False
+        key = (host, str(db_name), shape)
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+        return True
+
+    def explain_sql(self, query):
+        return "EXPLAIN FORMAT=JSON " + query
+
+    def record(self, host, db_name, query, document=None, error=None):
+        """Analyze an EXPLAIN document; union plans are split into one entry per tenant branch"""
+        tenants = query_tenants(query, db_name)
+        base = {"check": metrics.check, "host": host, "query": query_name(query), "shape": plan_shape(query)}
+        entries = []
+        if error is not None:
+            entries.append(dict(base, tenant=",".join(tenants), error=str(error), flags=[], rows_examined=None, query_cost=None, plan=None))
+        else:
+            plan = json.loads(document) if isinstance(document, (str, bytes)) else document
+            branches = union_branches(plan)
+            if branches is not None and len(branches) == len(tenants) > 1:
+                for tenant, branch in zip(tenants, branches):
+                    entries.append(dict(base, tenant=tenant, **analyze_plan(branch, self.rows_threshold), plan=branch))
+            else:
+                entries.append(dict(base, tenant=",".join(tenants), **analyze_plan(plan, self.rows_threshold), plan=plan))
+        with self._lock:
+            self.plans.extend(entries)
+            if error is not None:
+                self.errors += 1
+
+    def capture(self, connection, host, db_name, query, args=None):
+        """EXPLAIN a statement on its own plain cursor, before it runs; never raises"""
+        if not self.claim(host, db_name, query):
+            return
+        try:
+            cursor = connection.cursor(pymysql.cursors.Cursor)
+            try:
+                cursor.execute(self.explain_sql(query), args)
+                document = plan_text(cursor.fetchone())
+            finally:
+                cursor.close()
+        except Exception as e:
+            self.record(host, db_name, query, error=e)
+            return
+        try:
+            self.record(host, db_name, query, document)
+        except (ValueError, TypeError) as e:
+            self.record(host, db_name, query, error=e)
+
+    def flagged(self):
+        with self._lock:
+            return sorted((p for p in self.plans if p["flags"]), key=lambda p: -(p["rows_examined"] or 0))
+
+    def write_reports(self, run_id=None, directory=EXPLAIN_DIRECTORY):
+        """All plans as JSON and the flagged ones as CSV, sorted by estimated rows examined"""
+        run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        with self._lock:
+            plans = list(self.plans)
+        flagged = self.flagged()
+        json_path = os.path.join(directory, f"{run_id}.json")
+        csv_path = os.path.join(directory, f"{run_id}.csv")
+        write_atomic(json_path, json.dumps(
+            {"run_id": run_id, "rows_threshold": self.rows_threshold, "explained": len(plans), "flagged": len(flagged),
+             "errors": self.errors, "plans": plans}, indent=2, default=str))
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=REPORT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for plan in flagged:
+            writer.writerow(dict(plan, flags="; ".join(plan["flags"])))
+        write_atomic(csv_path, buffer.getvalue())
+
+        print(f"🔬 Query plans: {len(plans)} explained, {len(flagged)} flagged, {self.errors} could not be explained")
+        print(f"🔬 Slow-plan report: {csv_path} (all plans: {json_path})")
+        for plan in flagged[:10]:
+            print(f"🔬   {plan['tenant']} {plan['query']} ({plan['check'] or '-'}): ~{plan['rows_examined']} rows, {', '.join(plan['flags'])}")
+        return csv_path
+
+
+class ExplainingCursor:
+    """Cursor proxy that hands each statement to the plan collector before running it"""
+
+    def __init__(self, cursor, host, db_name):
+        self._cursor = cursor
+        self._host = host
+        self._db_name = db_name
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, args=None):
+        plans.capture(self._cursor.connection, self._host, self._db_name, query, args)
+        return self._cursor.execute(query, args)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+
+# Process-wide plan collector
+plans = PlanCollector()
+
+
+def print_report(path, limit=50):
+    """Print the flagged plans of a saved report, grouped by tenant"""
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    flagged = sorted((p for p in report["plans"] if p["flags"]), key=lambda p: (p["tenant"], -(p["rows_examined"] or 0)))
+    print(f"Run {report['run_id']}: {report['explained']} plans, {report['flagged']} flagged (rows threshold {report['rows_threshold']:g})")
+    tenant = None
+    for plan in flagged[:limit]:
+        if plan["tenant"] != tenant:
+            tenant = plan["tenant"]
+            print(f"\n{tenant}")
+        tables = ", ".join(f"{t['table']}:{t['access_type']}{'/' + t['key'] if t['key'] else ''}" for t in plan["tables"])
+        print(f"  {plan['query']:40} ~{plan['rows_examined']:>10} rows  {', '.join(plan['flags'])}  [{tables}]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show a saved slow-plan report (run a check with --explain to capture one)")
+    parser.add_argument("report", help="Plan report JSON from EXPLAIN_DIRECTORY")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.report):
+        print(f"❌ No such report: {args.report}")
+        sys.exit(1)
+    print_report(args.report, args.limit)
@@ -0,0 +1,518 @@
+import os
+import csv
+import sys
+import json
+import time
+import queue
+import argparse
+from datetime import datetime
+from threading import Lock
+from collections import defaultdict
+from dotenv import load_dotenv
+
+import local_mirror
+from async_engine import fetch_all_blocking
+from lookup_cache import destination_cache
+from tenant_registry import get_registry, pdis_for_tenant
+from work_scheduler import scheduler
+from kafka_sink import KAFKA_BOOTSTRAP_SERVERS, KAFKA_CONFIG
+from checkpoint import NullCheckpoint, UnitOutput
+from csv_utils import get_csv_writer
+from findings_diff import HASH_COLUMN
+
+try:
+    from confluent_kafka import Consumer
+except ImportError:  # only needed for the Kafka event source
+    Consumer = None
+
+load_dotenv('config.env')
+
+# CDC topics to follow; a leading ^ makes it a regex subscription
+RECHECK_TOPICS = [topic.strip() for topic in os.getenv(
+    "RECHECK_TOPICS", r"^cdc\..*\.(purchase_issue|purchase_issue_item|inward_invoice|inward_invoice_item|debitnote)$"
+).split(",") if topic.strip()]
+RECHECK_GROUP_ID = os.getenv("RECHECK_GROUP_ID", "recon-recheck")
+RECHECK_WINDOW_SECONDS = float(os.getenv("RECHECK_WINDOW_SECONDS", "5"))  # events are coalesced for this long
+RECHECK_MAX_EVENTS = int(os.getenv("RECHECK_MAX_EVENTS", "5000"))         # ... or until this many arrive
+RECHECK_CHECKS = [name.strip() for name in os.getenv(
+    "RECHECK_CHECKS", "dc_created_str_not_created,str_recon,no_cn_for_str_inward"
+).split(",") if name.strip()]
+RECHECK_DIRECTORY = os.getenv("RECHECK_DIRECTORY", os.path.join(os.getcwd(), ".recon_rechecks"))
+RECHECK_UNMATCHED_TTL = float(os.getenv("RECHECK_UNMATCHED_TTL", "3600"))  # seconds an unmatched invoice is not probed again
+
+STR_PURCHASE_TYPES = {"StockTransferReturn", "ICSReturn"}
+QUERY_CHUNK = 500
+
+
+class ChangeEvent:
+    __slots__ = ("table", "tenant", "rows")
+
+    def __init__(self, table, tenant, rows):
+        self.table = table
+        self.tenant = tenant
+        self.rows = rows  # before and/or after images
+
+
+def parse_event(message):
+    """
+    ChangeEvent from a CDC message: a Debezium envelope ({"payload": {"source": {"db", "table"},
+    "before", "after"}}) or a flat {"table", "tenant", "before", "after"}. Tenant tables live in a
+    schema named after the tenant; vault's debitnote carries the tenant in its row.
+    Returns None for messages without a table or rows (tombstones, heartbeats).
+    """
+    if not isinstance(message, dict):
+        return None
+    payload = message.get("payload") or message
+    source = payload.get("source") or {}
+    table = payload.get("table") or source.get("table")
+    rows = [row for row in (payload.get("before"), payload.get("after")) if row]
+    if not table or not rows:
+        return None
+    tenant = payload.get("tenant") or source.get("db")
+    if table == "debitnote":
+        tenant = rows[-1].get("tenant") or tenant
+    return ChangeEvent(table, tenant, rows)
+
+
+class RecheckKeys:
+    """
+    Keys touched by a micro-batch of events, coalesced per key: however many events hit
+    one debit note or invoice in the window, it is rechecked once.
+    """
+
+    def __init__(self):
+        self.debit_notes = defaultdict(set)         # source tenant -> debit note numbers (DC and STR checks)
+        self.purchase_issue_ids = defaultdict(set)  # tenant -> purchase issues whose debit note is unknown yet
+        self.str_invoices = defaultdict(set)        # tenant -> STR inward invoice ids / CN return_order_ids
+        self.dest_invoice_nos = defaultdict(set)    # destination tenant -> STR inward invoice numbers
+        self.dest_invoice_ids = defaultdict(set)    # destination tenant -> inward invoices whose number is unknown yet
+        self.events = 0
+
+    def add(self, event):
+        self.events += 1
+        tenant = event.tenant
+        if not tenant:
+            return
+        for row in event.rows:
+            if event.table == "purchase_issue":
+                if row.get("debit_note_number"):
+                    self.debit_notes[tenant].add(row["debit_note_number"])
+            elif event.table == "purchase_issue_item":
+                if row.get("purchase_issue_id") is not None:
+                    self.purchase_issue_ids[tenant].add(row["purchase_issue_id"])
+            elif event.table == "inward_invoice":
+                # Only STR / ICS returns come from a source tenant's DC; other invoices are never probed
+                if row.get("purchase_type") in STR_PURCHASE_TYPES:
+                    if row.get("id") is not None:
+                        self.str_invoices[tenant].add(row["id"])
+                    if row.get("invoice_no"):
+                        self.dest_invoice_nos[tenant].add(row["invoice_no"])
+            elif event.table == "inward_invoice_item":
+                if row.get("invoice_id") is not None:
+                    self.dest_invoice_ids[tenant].add(row["invoice_id"])
+            elif event.table == "debitnote":
+                if row.get("return_order_id") is not None:
+                    self.str_invoices[tenant].add(row["return_order_id"])
+
+    def merge(self, other):
+        for name in ("debit_notes", "purchase_issue_ids", "str_invoices", "dest_invoice_nos", "dest_invoice_ids"):
+            mine = getattr(self, name)
+            for tenant, keys in getattr(other, name).items():
+                mine[tenant].update(keys)
+        self.events += other.events
+
+    def __bool__(self):
+        return any((self.debit_notes, self.purchase_issue_ids, self.str_invoices, self.dest_invoice_nos, self.dest_invoice_ids))
+
+
+def fetchByIds(tenant, query, ids):
+    """Rows for `... WHERE id IN ({placeholders})` in chunks, always from production"""
+    ids = list(ids)
+    rows = []
+    for i in range(0, len(ids), QUERY_CHUNK):
+        chunk = ids[i:i + QUERY_CHUNK]
+        rows.extend(fetch_all_blocking(tenant, query.format(placeholders=",".join(["%s"] * len(chunk))), chunk))
+    return rows
+
+
+def debitNotesOfPurchaseIssues(tenant, purchaseIssueIds):
+    query = "SELECT DISTINCT debit_note_number FROM purchase_issue WHERE id IN ({placeholders}) AND debit_note_number IS NOT NULL"
+    return {row["debit_note_number"] for row in fetchByIds(tenant, query, purchaseIssueIds)}
+
+
+def inwardInvoices(tenant, invoiceIds):
+    return fetchByIds(tenant, "SELECT id, invoice_no, purchase_type FROM inward_invoice WHERE id IN ({placeholders})", invoiceIds)
+
+
+def probeSourceTenants(dest_tenant, invoice_nos, failed_sources=None):
+    """
+    {invoice_no: source tenant} for STR inward invoices of a destination: the tenant whose
+    purchase issue towards the destination has that debit note number. One IN query per
+    candidate source tenant, as scheduler units on each tenant's host. A source whose query
+    fails is logged, skipped and appended to failed_sources when given.
+    """
+    pdis = pdis_for_tenant(dest_tenant)
+    if not pdis:
+        return {}
+    registry = get_registry()
+    sources = [tenant for tenant in registry.warehouses + registry.arsenals if tenant != dest_tenant]
+    query = (
+        f"SELECT DISTINCT debit_note_number FROM purchase_issue "
+        f"WHERE debit_note_number IN ({','.join(['%s'] * len(invoice_nos))}) "
+        f"AND partner_detail_id IN ({','.join(['%s'] * len(pdis))})"
+    )
+    params = list(invoice_nos) + pdis
+    futures = {scheduler.submit(fetch_all_blocking, source, query, params, db=source, tenant=dest_tenant): source
+               for source in sources}
+    found = {}
+    for future in scheduler.wait(futures):
+        source = futures[future]
+        try:
+            rows = future.result()
+        except Exception as e:
+            print(f"⚠️ Could not probe {source} for STR invoices of {dest_tenant}, skipping it: {e}")
+            if failed_sources is not None:
+                failed_sources.append(source)
+            continue
+        for row in rows:
+            found[row["debit_note_number"]] = source
+    return found
+
+
+def sourceTenantsForInvoices(dest_tenant, invoice_nos, unmatched_ttl=RECHECK_UNMATCHED_TTL, unresolved=None):
+    """
+    probeSourceTenants answered from the lookup cache. A probe costs one query per tenant,
+    so unmatched numbers are cached too, for unmatched_ttl seconds. If a source tenant could
+    not be probed, unmatched numbers are not cached and are added to `unresolved` when given.
+    """
+    failed_sources = []
+    found = destination_cache.get_many(
+        dest_tenant, "str_source_tenant", list(invoice_nos),
+        lambda missing: probeSourceTenants(dest_tenant, missing, failed_sources), default_ttl=unmatched_ttl
+    )
+    if failed_sources:
+        unmatched = [invoice_no for invoice_no, source in found.items() if source is None]
+        destination_cache.invalidate(dest_tenant, "str_source_tenant", unmatched)
+        if unresolved is not None:
+            unresolved.update(unmatched)
+    return {invoice_no: source for invoice_no, source in found.items() if source is not None}
+
+
+class RecheckOutput(UnitOutput):
+    """
+    Unit of one recheck. Rows are kept until the recheck succeeds. A unit marked failed
+    (e.g. a destination lookup the check caught) raises on exit, so the consumer retries
+    its keys instead of counting the recheck as done.
+    """
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.discard()
+            return False
+        if self.error is not None:
+            self.discard()
+            raise self.error
+        self.checkpoint.write_unit(self)
+        return False
+
+
+class RecheckCheckpoint(NullCheckpoint):
+    """
+    Checkpoint the consumer passes to the rechecks: nothing is recorded and failures raise.
+    Findings go to the reports in RECHECK_DIRECTORY rather than the sweeps' own, and a
+    finding (by finding_hash) is written there only once, however often its keys change.
+    """
+
+    def __init__(self, directory=RECHECK_DIRECTORY):
+        self.run_id = datetime.now().strftime("recheck-%Y%m%d-%H%M%S")
+        self.directory = directory
+        self._written = {}  # report filename -> finding hashes already in its output
+        self._lock = Lock()
+
+    def unit(self, check, tenant, batch="", output_dir=None):
+        return RecheckOutput(self, check, tenant, str(batch), output_dir)
+
+    def _written_hashes(self, filename):
+        """Hashes already written, read once from an existing report (e.g. before a restart)"""
+        if filename not in self._written:
+            hashes = set()
+            path = os.path.join(self.directory, filename)
+            if os.path.isfile(path):
+                with open(path, newline='', encoding='utf-8') as f:
+                    hashes.update(row.get(HASH_COLUMN) for row in csv.DictReader(f))
+            self._written[filename] = hashes
+        return self._written[filename]
+
+    def write_unit(self, unit):
+        for (filename, _), buffer in unit.rows.items():
+            new_rows = []
+            with self._lock:
+                written = self._written_hashes(filename)
+                for rows in buffer.batches():
+                    for row in rows:
+                        if row[HASH_COLUMN] not in written:
+                            written.add(row[HASH_COLUMN])
+                            new_rows.append(row)
+            if new_rows:
+                get_csv_writer(filename, self.directory, needLogs=False).write_many(new_rows)
+        unit.discard()
+
+
+def loadRecheckers(checks):
+    """check name -> recheck(tenant, keys) from the check scripts, for the checks that support it"""
+    from recon import load_checks
+    load_checks()
+    modules = {
+        "dc_created_str_not_created": ("dcCreatedStrNotCreated", "recheckDebitNotes", "debit_notes"),
+        "str_recon": ("str_recon_engine", "recheckDebitNotes", "debit_notes"),
+        "no_cn_for_str_inward": ("noCNForStrInward", "recheckInvoices", "str_invoices"),
+    }
+    unknown = [name for name in checks if name not in modules]
+    if unknown:
+        raise ValueError(f"No recheck mode for: {', '.join(unknown)} (supported: {', '.join(modules)})")
+    return {name: (getattr(sys.modules[modules[name][0]], modules[name][1]), modules[name][2]) for name in checks}
+
+
+class RecheckConsumer:
+    """
+    Long-running recheck mode: reads change events, coalesces them per key for up to
+    RECHECK_WINDOW_SECONDS and rechecks only the affected keys with each check's own
+    logic. Offsets are committed after a micro-batch is processed (at-least-once);
+    keys whose recheck failed are carried into the next micro-batch.
+    """
+
+    def __init__(self, source, checks=RECHECK_CHECKS, window=RECHECK_WINDOW_SECONDS, max_events=RECHECK_MAX_EVENTS):
+        self.source = source
+        self.recheckers = loadRecheckers(checks)
+        self.window = window
+        self.max_events = max_events
+        self.checkpoint = RecheckCheckpoint()
+        self._retry = RecheckKeys()
+        self._stopped = False
+        self.stats = {"events": 0, "batches": 0, "rechecks": 0, "failures": 0}
+        if local_mirror.USE_MIRROR:
+            print("⚠️ Rechecks read production, not the local mirror")
+            local_mirror.USE_MIRROR = False
+
+    def stop(self):
+        self._stopped = True
+
+    def collect(self):
+        """Events until the window closes or max_events arrive, coalesced into one RecheckKeys"""
+        keys = RecheckKeys()
+        deadline = time.monotonic() + self.window
+        while keys.events < self.max_events and not self._stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for message in self.source.poll(min(remaining, 1.0), self.max_events - keys.events):
+                event = parse_event(message)
+                if event is not None:
+                    keys.add(event)
+            if self.source.exhausted:
+                break
+        return keys
+
+    def resolve(self, keys):
+        """
+        Turn item-level and destination-side keys into source debit notes and STR invoices.
+        Returns the keys whose lookup failed, to be retried with the next micro-batch.
+        """
+        unresolved = RecheckKeys()
+        for tenant, ids in keys.purchase_issue_ids.items():
+            try:
+                keys.debit_notes[tenant].update(debitNotesOfPurchaseIssues(tenant, ids))
+            except Exception as e:
+                self._resolve_failed("purchase issues", tenant, e)
+                unresolved.purchase_issue_ids[tenant].update(ids)
+        for tenant, ids in keys.dest_invoice_ids.items():
+            try:
+                invoices = inwardInvoices(tenant, ids)
+            except Exception as e:
+                self._resolve_failed("inward invoices", tenant, e)
+                unresolved.dest_invoice_ids[tenant].update(ids)
+                continue
+            for invoice in invoices:
+                if invoice["purchase_type"] not in STR_PURCHASE_TYPES:
+                    continue
+                keys.str_invoices[tenant].add(invoice["id"])
+                if invoice["invoice_no"]:
+                    keys.dest_invoice_nos[tenant].add(invoice["invoice_no"])
+        for dest_tenant, invoice_nos in keys.dest_invoice_nos.items():
+            unmatched = set()
+            try:
+                sources = sourceTenantsForInvoices(dest_tenant, invoice_nos, unresolved=unmatched)
+            except Exception as e:
+                self._resolve_failed("STR invoice sources", dest_tenant, e)
+                unmatched.update(invoice_nos)
+                sources = {}
+            if unmatched:
+                unresolved.dest_invoice_nos[dest_tenant].update(unmatched)
+            for invoice_no, source in sources.items():
+                keys.debit_notes[source].add(invoice_no)
+        keys.purchase_issue_ids.clear()
+        keys.dest_invoice_ids.clear()
+        keys.dest_invoice_nos.clear()
+        return unresolved
+
+    def _resolve_failed(self, what, tenant, error):
+        print(f"❌ Could not resolve {what} of tenant {tenant}, retrying next batch: {error}")
+        self.stats["failures"] += 1
+
+    def process(self, keys):
+        """Recheck every affected key once; returns the keys to retry"""
+        retry = self.resolve(keys)
+        futures = {}
+        for name, (recheck, attribute) in self.recheckers.items():
+            for tenant, tenantKeys in getattr(keys, attribute).items():
+                if tenantKeys:
+                    futures[scheduler.submit(recheck, tenant, sorted(tenantKeys, key=str), checkpoint=self.checkpoint,
+                                             db=tenant)] = (name, tenant, attribute)
+
+        for future in scheduler.wait(futures):
+            name, tenant, attribute = futures[future]
+            self.stats["rechecks"] += 1
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Recheck {name} failed for tenant {tenant}, retrying next batch: {e}")
+                self.stats["failures"] += 1
+                getattr(retry, attribute)[tenant].update(getattr(keys, attribute)[tenant])
+        return retry
+
+    def run(self, stop_when_idle=False):
+        print(f"👂 Rechecking {', '.join(self.recheckers)} from change events")
+        while not self._stopped:
+            keys = self.collect()
+            self.stats["events"] += keys.events
+            keys.merge(self._retry)
+            if not keys:
+                if keys.events:
+                    self.source.commit()  # only irrelevant events
+                if stop_when_idle and self.source.exhausted:
+                    break
+                continue
+            started = time.monotonic()
+            try:
+                self._retry = self.process(keys)
+            except Exception as e:
+                print(f"❌ Recheck batch failed, retrying its keys next batch: {e}")
+                self.stats["failures"] += 1
+                self._retry = keys
+            self.source.commit()
+            self.stats["batches"] += 1
+            print(
+                f"🔁 Rechecked {sum(len(notes) for notes in keys.debit_notes.values())} debit notes and "
+                f"{sum(len(ids) for ids in keys.str_invoices.values())} STR invoices from {keys.events} events "
+                f"in {time.monotonic() - started:.1f}s"
+            )
+        self.print_stats()
+
+    def print_stats(self):
+        stats = self.stats
+        print(
+            f"📊 Recheck: events={stats['events']} batches={stats['batches']} "
+            f"rechecks={stats['rechecks']} failures={stats['failures']}"
+        )
+
+
+class MemoryEventSource:
+    """In-memory event source for tests and replays: put() events, the consumer polls them"""
+
+    def __init__(self, events=(), finished=True):
+        self._queue = queue.Queue()
+        for event in events:
+            self._queue.put(event)
+        self.finished = finished  # no more events will be put
+        self.committed = 0
+
+    def put(self, event):
+        self._queue.put(event)
+
+    @property
+    def exhausted(self):
+        return self.finished and self._queue.empty()
+
+    def poll(self, timeout, max_messages):
+        messages = []
+        try:
+            messages.append(self._queue.get(timeout=timeout))
+            while len(messages) < max_messages:
+                messages.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return messages
+
+    def commit(self):
+        self.committed += 1
+
+    def close(self):
+        pass
+
+
+class KafkaEventSource:
+    """CDC topics through a confluent-kafka consumer group; offsets committed by the consumer"""
+
+    exhausted = False
+
+    def __init__(self, topics=RECHECK_TOPICS, group_id=RECHECK_GROUP_ID):
+        if Consumer is None:
+            raise ImportError("confluent-kafka is not installed: pip install confluent-kafka")
+        config = {
+            "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+            "group.id": group_id,
+            "enable.auto.commit": False,
+            "auto.offset.reset": "earliest",
+        }
+        config.update(KAFKA_CONFIG)
+        self.consumer = Consumer(config)
+        self.consumer.subscribe(topics)
+
+    def poll(self, timeout, max_messages):
+        messages = []
+        for message in self.consumer.consume(num_messages=max_messages, timeout=timeout):
+            if message.error():
+                print(f"⚠️ Kafka consumer error: {message.error()}")
+                continue
+            if message.value() is None:
+                continue  # tombstone
+            try:
+                messages.append(json.loads(message.value()))
+            except ValueError as e:
+                print(f"⚠️ Skipping undecodable event on {message.topic()}: {e}")
+        return messages
+
+    def commit(self):
+        try:
+            self.consumer.commit(asynchronous=False)
+        except Exception as e:  # nothing consumed since the last commit
+            print(f"⚠️ Offset commit failed: {e}")
+
+    def close(self):
+        self.consumer.close()
+
+
+def replaySource(path):
+    """MemoryEventSource over a file of JSON events, one per line"""
+    with open(path, encoding="utf-8") as f:
+        return MemoryEventSource(json.loads(line) for line in f if line.strip())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recheck only the keys touched by purchase issue / inward invoice / CN change events")
+    parser.add_argument("--checks", nargs="+", default=RECHECK_CHECKS, help="Checks to recheck (default: RECHECK_CHECKS)")
+    parser.add_argument("--replay", metavar="FILE", help="Process JSON events from a file (one per line) instead of Kafka, then exit")
+    parser.add_argument("--window", type=float, default=RECHECK_WINDOW_SECONDS, help="Seconds events are coalesced for")
+    args = parser.parse_args()
+
+    source = replaySource(args.replay) if args.replay else KafkaEventSource()
+    consumer = RecheckConsumer(source, checks=args.checks, window=args.window)
+    try:
+        consumer.run(stop_when_idle=bool(args.replay))
+    except KeyboardInterrupt:
+        print("⏹️ Stopping; events of the unfinished batch will be redelivered")
+        consumer.print_stats()
+    finally:
+        source.close()
+        from csv_utils import close_all_writers
+        close_all_writers()
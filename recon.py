@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+import importlib.util
+
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIRECTORY)
+from check_registry import CHECKS, add_context_args, context_from_args, run_checks
+
+# Scripts that register checks; imported by path since the check folders are not packages
+CHECK_MODULES = [
+    "DC_CREATED_STR_NOT_CREATED/dcCreatedStrNotCreated.py",
+    "DUPLICATE_STR_INWARD_INVOICE/duplicateStrInwardInvoice.py",
+    "INVALID_INVOICE_IN_PR/invalidInvoiceInPR.py",
+    "MULTI_CN_FOR_STR_INWARD/multiCNForStrInward.py",
+    "NO_CN_FOR_STR_INWARD/noCNForStrInward.py",
+    "PR_SALES_AND_NON_REGULAR_VENDOR/prSales.py",
+    "PR_SALES_AND_NON_REGULAR_VENDOR/nonRegularVendorType.py",
+    "STR_CREATED_QUANTITY_SAME_AMOUNT_MISMATCH/strCreatedQunatitySameAmountMismatch.py",
+    "STR_CREATED_RETURN_QUANTITY_DIFFERENT/strCreatedReturnQunatityDifferent.py",
+    "UCODE_NEVER_INWARDED_IN_DESTINATION/ucodeNeverInward.py",
+    "str_recon_engine.py",
+    "runAnyQueryAcrossArsenalAndThea.py",
+]
+
+
+def load_checks():
+    """Import every check script so its @register_check runs"""
+    for relative_path in CHECK_MODULES:
+        path = os.path.join(BASE_DIRECTORY, relative_path)
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        if module_name in sys.modules:
+            continue
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return CHECKS
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run recon checks in one process with shared tenants, pools and caches")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List registered checks")
+    run_parser = add_context_args(commands.add_parser("run", help="Run one or more checks"))
+    run_parser.add_argument("checks", nargs="+", help="Check names (see `list`), or `all`")
+    args = parser.parse_args()
+
+    load_checks()
+    if args.command == "list":
+        for name, (_, description, include_in_all, uses_snapshot) in sorted(CHECKS.items()):
+            print(f"{name:45} {description}" + ("" if include_in_all else " (not in `all`)")
+                  + (" [snapshot]" if uses_snapshot else ""))
+        sys.exit(0)
+
+    names = [name for name, check in sorted(CHECKS.items()) if check[2]] if args.checks == ["all"] else args.checks
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        print(f"❌ Unknown checks: {', '.join(unknown)} (see `python3 recon.py list`)")
+        sys.exit(2)
+
+    context = context_from_args(args)
+    try:
+        failed = run_checks(names, context)
+    finally:
+        context.close()
+    if failed:
+        print(f"❌ Failed checks: {', '.join(failed)}")
+        sys.exit(1)
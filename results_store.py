@@ -0,0 +1,258 @@
+import os
+import re
+import csv
+import sys
+import sqlite3
+import argparse
+from decimal import Decimal
+from datetime import date, datetime
+from dotenv import load_dotenv
+
+from csv_utils import CsvWriter, OUTPUT_DIRECTORY
+
+load_dotenv('config.env')
+
+RESULTS_DB = os.getenv("RESULTS_DB", os.path.join(os.getcwd(), "results.sqlite"))
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TABLE_SEPARATOR = "__"  # between the output directory and the report name of a table
+
+# Columns triage queries filter on; indexed in every table that has them
+INDEXED_COLUMNS = ("tenant", "source_tenant", "dest_tenant", "ucode", "debit_note_number")
+
+
+def table_name(filename, output_dir=None):
+    """
+    One table per report and output directory, so same-named reports of different
+    folders never share a table:
+    INVALID_INVOICE_IN_PR/CSV_FILES/invalidInvoiceInPR.csv -> INVALID_INVOICE_IN_PR__invalidInvoiceInPR.
+    The directory is taken relative to the repo (the usual CSV_FILES leaf is left out);
+    a report in the repo's own CSV_FILES keeps its bare name.
+    """
+    stem = re.sub(r"[^A-Za-z0-9_]", "_", os.path.splitext(os.path.basename(filename))[0])
+    directory = os.path.abspath(os.path.dirname(os.path.join(output_dir or OUTPUT_DIRECTORY, filename)))
+    if os.path.commonpath([directory, BASE_DIRECTORY]) == BASE_DIRECTORY:
+        directory = os.path.relpath(directory, BASE_DIRECTORY)
+    parts = [part for part in directory.replace("\\", "/").split("/") if part and part != "."]
+    if parts and parts[-1] == "CSV_FILES":
+        parts.pop()
+    if not parts:
+        return stem
+    return re.sub(r"[^A-Za-z0-9_]", "_", "_".join(parts)) + TABLE_SEPARATOR + stem
+
+
+def report_of_table(table):
+    """Report name of a results table: INVALID_INVOICE_IN_PR__invalidInvoiceInPR -> invalidInvoiceInPR"""
+    return table.rsplit(TABLE_SEPARATOR, 1)[-1]
+
+
+def export_path(table):
+    """
+    Where the CSV backend would have written a table's report:
+    INVALID_INVOICE_IN_PR__invalidInvoiceInPR -> INVALID_INVOICE_IN_PR/CSV_FILES/invalidInvoiceInPR.csv.
+    Tables of directories outside the repo are exported to CSV_FILES/<table>.csv.
+    """
+    report = report_of_table(table)
+    if report == table:
+        return os.path.join(BASE_DIRECTORY, "CSV_FILES", f"{report}.csv")
+    directory = os.path.join(BASE_DIRECTORY, table[:-len(report) - len(TABLE_SEPARATOR)])
+    if os.path.isdir(directory):
+        return os.path.join(directory, "CSV_FILES", f"{report}.csv")
+    return os.path.join(OUTPUT_DIRECTORY, f"{table}.csv")
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def to_store_value(value):
+    """Numbers stay numbers so triage queries can compare them; everything else is stored as text"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, Decimal):
+        as_float = float(value)
+        return as_float if Decimal(repr(as_float)) == value else str(value)
+    if isinstance(value, (datetime, date)):
+        return str(value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def connect(db_path=RESULTS_DB):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    db = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+def table_columns(db, table):
+    return [row[1] for row in db.execute(f"PRAGMA table_info({quote(table)})") if row[1] != "row_id"]
+
+
+def ensure_table(db, table, columns):
+    """Create the report table, add any new columns and the triage indexes"""
+    db.execute(f"CREATE TABLE IF NOT EXISTS {quote(table)} (row_id INTEGER PRIMARY KEY)")
+    existing = set(table_columns(db, table))
+    for column in columns:
+        if column not in existing:
+            db.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)}")
+            existing.add(column)
+    for column in INDEXED_COLUMNS:
+        if column in existing:
+            db.execute(f"CREATE INDEX IF NOT EXISTS {quote(f'idx_{table}_{column}')} ON {quote(table)} ({quote(column)})")
+    db.commit()
+    return table_columns(db, table)
+
+
+class StoreWriter(CsvWriter):
+    """
+    CsvWriter counterpart that inserts rows into one table of the SQLite results store.
+    Same queue and batching as CsvWriter; every batch is one INSERT transaction.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, filename, headers=None, output_dir=None, db_path=RESULTS_DB, **kwargs):
+        self.table = table_name(filename, output_dir)
+        self.db_path = db_path
+        self._db = None
+        super().__init__(filename, headers=headers, output_dir=output_dir, **kwargs)
+        self.output_key = f"sqlite:{db_path}#{self.table}"
+        self.full_path = f"{db_path} [{self.table}]"  # for log messages
+
+    def position(self):
+        """Last row id of the table; only meaningful right after flush()"""
+        db = connect(self.db_path)
+        try:
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table,)).fetchone():
+                return 0
+            return db.execute(f"SELECT COALESCE(MAX(row_id), 0) FROM {quote(self.table)}").fetchone()[0]
+        finally:
+            db.close()
+
+    def prepare(self, first_row):
+        pass  # new columns are added to the table as they appear
+
+    def _open(self, first_row):
+        self._db = connect(self.db_path)
+        if not isinstance(first_row, dict) and self.headers is None:
+            self.headers = [f"col{i+1}" for i in range(len(first_row))]
+        self.headers = ensure_table(self._db, self.table, self.headers or [])
+        self._file = self._db
+
+    def _write_batch(self, rows):
+        if not rows:
+            return
+        try:
+            if self._db is None:
+                self._open(rows[0])
+            if isinstance(rows[0], dict):
+                new_columns = [k for k in dict.fromkeys(k for row in rows for k in row) if k.strip() != '' and k not in self.headers]
+                if new_columns:
+                    self.headers = ensure_table(self._db, self.table, self.headers + new_columns)
+                values = [tuple(to_store_value(row.get(column)) for column in self.headers) for row in rows]
+            else:
+                values = [tuple(to_store_value(value) for value in row) for row in rows]
+
+            columns = ", ".join(quote(column) for column in self.headers[:len(values[0])])
+            placeholders = ", ".join(["?"] * len(values[0]))
+            with self._db:
+                self._db.executemany(f"INSERT INTO {quote(self.table)} ({columns}) VALUES ({placeholders})", values)
+            self.rows_written += len(rows)
+        except Exception as e:
+            if self.error is None:
+                print(f"❌ Error writing results table {self.table} in {self.db_path}: {e}")
+                self.error = e
+
+    def _close_output(self):
+        if self._db is not None:
+            self._db.close()
+
+
+def truncate_table_output(output_key, position):
+    """Delete rows written after position from a results table (output_key from StoreWriter)"""
+    db_path, table = output_key[len("sqlite:"):].rsplit("#", 1)
+    if not os.path.isfile(db_path):
+        return False
+    db = connect(db_path)
+    try:
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            return False
+        with db:
+            deleted = db.execute(f"DELETE FROM {quote(table)} WHERE row_id > ?", (position,)).rowcount
+        return deleted > 0
+    finally:
+        db.close()
+
+
+def list_tables(db_path=RESULTS_DB):
+    db = connect(db_path)
+    try:
+        names = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        return {name: db.execute(f"SELECT COUNT(*) FROM {quote(name)}").fetchone()[0] for name in names}
+    finally:
+        db.close()
+
+
+def export_table(table, output_path=None, db_path=RESULTS_DB):
+    """Stream a results table into a CSV file with the same layout the CSV backend writes"""
+    if output_path is None:
+        output_path = export_path(table)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    db = connect(db_path)
+    try:
+        columns = table_columns(db, table)
+        if not columns:
+            raise ValueError(f"No results table {table} in {db_path}")
+        cursor = db.execute(f"SELECT {', '.join(quote(c) for c in columns)} FROM {quote(table)} ORDER BY row_id")
+        rows = 0
+        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(columns)
+            while True:
+                batch = cursor.fetchmany(5000)
+                if not batch:
+                    break
+                writer.writerows(batch)
+                rows += len(batch)
+        print(f"✅ Exported {rows} rows from {table} to: {output_path}")
+        return output_path
+    finally:
+        db.close()
+
+
+def run_query(sql, params=(), db_path=RESULTS_DB):
+    """Triage query against the store, opened read-only"""
+    db = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in db.execute(sql, params)]
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite results store for recon findings")
+    parser.add_argument("--db", default=RESULTS_DB, help="Results database (default: RESULTS_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("tables", help="List report tables and their row counts")
+    export_parser = commands.add_parser("export", help="Export a report table to CSV")
+    export_parser.add_argument("table")
+    export_parser.add_argument("--output", help="CSV path (default: the report's own CSV_FILES/<report>.csv)")
+    query_parser = commands.add_parser("query", help="Run a read-only SQL query")
+    query_parser.add_argument("sql")
+    args = parser.parse_args()
+
+    if args.command == "tables":
+        for name, count in list_tables(args.db).items():
+            print(f"{name}: {count} rows")
+    elif args.command == "export":
+        export_table(args.table, args.output, args.db)
+    else:
+        rows = run_query(args.sql, db_path=args.db)
+        if rows:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"({len(rows)} rows)", file=sys.stderr)
@@ -1,62 +1,42 @@
 import sys
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import pymysql
-from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from getDBConnection import create_db_connection
-from csv_utils import append_to_csv
-from getAllWarehouse import getAllWarehouse
-from getAllArsenal import getAllArsenal
+from query_batcher import iter_query_across_tenants
+from checkpoint import NO_CHECKPOINT
+from check_registry import register_check, check_main
 
 CURRENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV_FILES")
-CSV_LOCK = Lock()  # Thread-safe CSV writes
+CHECK_NAME = "general_query"
 
+# {tenant} is replaced with the tenant schema, so tenants sharing a DB host
+# can be answered with one UNION ALL round trip per group of schemas.
+# List the columns: a SELECT * query is run once per tenant instead
 SQL_QUERY = """
-    SELECT * 
-    FROM pre_purchase_issue_order
+    SELECT id, vendor_type, partner_detail_id, status, created_on, updated_on
+    FROM {tenant}.pre_purchase_issue_order
     WHERE created_on >= '2025-08-01'
       AND status = 'CREATED'
       AND vendor_type = 'PRIMARY'
 """
 
-def safe_append_to_csv(filename, rows):
-    """Thread-safe CSV append"""
-    with CSV_LOCK:
-        append_to_csv(filename, rows, output_dir=CURRENT_DIRECTORY)
-
-
-def runQuery(tenant):
-    """Run SQL query for a tenant and save results"""
-    try:
-        print(f"🔹 Running query for tenant: {tenant}")
-        conn = create_db_connection(tenant)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-        cursor.execute(SQL_QUERY)
-        result = cursor.fetchall()
-        if result:
-            safe_append_to_csv("generalQueryResult.csv", result)
-        cursor.close()
-        conn.close()
-        print(f"✅ Finished tenant: {tenant} ({len(result)} rows)")
-    except Exception as e:
-        print(f"❌ Error running query for tenant {tenant}: {e}")
-
-
-def processAllTenants(tenants, max_workers=10):
-    """Run query for all tenants concurrently"""
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(runQuery, tenant): tenant for tenant in tenants}
-        for future in as_completed(futures):
-            tenant = futures[future]
-            try:
-                future.result()
-            except Exception as e:
-                print(f"❌ Exception in tenant {tenant}: {e}")
+def runQueryBatched(tenants, group_size=25, checkpoint=NO_CHECKPOINT):
+    """Run SQL query for all tenants, one UNION ALL statement per group of same-host tenants"""
+    tenants = checkpoint.pending(CHECK_NAME, tenants)
+    for groupResults in iter_query_across_tenants(SQL_QUERY, tenants, group_size=group_size):
+        # Tenants whose query failed are missing here and stay pending for --resume
+        for tenant, result in groupResults.items():
+            with checkpoint.unit(CHECK_NAME, tenant, output_dir=CURRENT_DIRECTORY) as unit:
+                if result:
+                    unit.write_many("generalQueryResult.csv", result)
+            print(f"✅ Finished tenant: {tenant} ({len(result)} rows)")
+
+
+@register_check(CHECK_NAME, "Ad hoc SQL_QUERY across all arsenal and thea tenants", include_in_all=False)
+def runCheck(context):
+    runQueryBatched(context.tenants, group_size=25, checkpoint=context.checkpoint)
 
 
 if __name__ == "__main__":
-    tenants = getAllWarehouse() + getAllArsenal()
-    processAllTenants(tenants, max_workers=10)
+    check_main(CHECK_NAME)
@@ -0,0 +1,293 @@
+import sys
+import os
+from collections import defaultdict
+from decimal import Decimal
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from local_mirror import fetch_all
+from tenant_registry import pdiToTenantMap
+from lookup_cache import destination_cache
+from checkpoint import NO_CHECKPOINT
+from work_scheduler import scheduler, for_each_tenant
+from purchase_issue_snapshot import on_or_after, not_equal, has_text, group_key
+from check_registry import register_check, check_main
+
+load_dotenv('config.env')
+
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Differences at or below these tolerances are not reported
+AMOUNT_TOLERANCE = Decimal(os.getenv("STR_AMOUNT_TOLERANCE", "1.0"))
+QUANTITY_TOLERANCE = int(os.getenv("STR_QUANTITY_TOLERANCE", "0"))
+
+AMOUNT_REPORT = "amount"
+QUANTITY_REPORT = "quantity"
+ALL_REPORTS = (AMOUNT_REPORT, QUANTITY_REPORT)
+
+REPORT_OUTPUTS = {
+    AMOUNT_REPORT: (
+        "strCreatedQunatitySameAmountMismatch.csv",
+        os.path.join(BASE_DIRECTORY, "STR_CREATED_QUANTITY_SAME_AMOUNT_MISMATCH", "CSV_FILES"),
+    ),
+    QUANTITY_REPORT: (
+        "strCreatedReturnQunatityDifferent.csv",
+        os.path.join(BASE_DIRECTORY, "STR_CREATED_RETURN_QUANTITY_DIFFERENT", "CSV_FILES"),
+    ),
+}
+
+
+def checkName(reports):
+    """Checkpoint name of a sweep; a tenant is only done for the exact set of reports it produced"""
+    return "str_recon:" + "+".join(sorted(reports))
+
+
+def matchValue(value):
+    """A string column the way MySQL's collation compares it: case-insensitive, trailing spaces ignored"""
+    return str(value).rstrip().upper()
+
+
+def matchKey(ucode, batch, invoice_no):
+    """
+    Normalise a (ucode, batch, invoice_no) key with matchValue. All three are string
+    columns on both sides, so leading zeros are significant and kept. Returns None
+    when a part is NULL, which like in SQL never matches anything; callers skip those keys.
+    """
+    if ucode is None or batch is None or invoice_no is None:
+        return None
+    return matchValue(ucode), matchValue(batch), matchValue(invoice_no)
+
+
+def purchaseIssueTotalsFromSnapshot(snapshot, tenant):
+    """fetchPurchaseIssuesForTenant's GROUP BY computed over the shared purchase issue snapshot"""
+    groups = {}
+    for row in snapshot.iter_rows(tenant):
+        if (row["item_id"] is None or not not_equal(row["pr_type"], 'REGULAR_EASYSOL')
+                or not has_text(row["debit_note_number"]) or not on_or_after(row["created_on"], '2025-08-30')):
+            continue
+        key = group_key(row["ucode"], row["batch"], row["debit_note_number"], row["partner_detail_id"])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "ucode": row["ucode"], "batch": row["batch"], "debit_note_number": row["debit_note_number"],
+                "partner_detail_id": row["partner_detail_id"], "total_quantity": None, "total_amount": None,
+            }
+        # SUM() skips NULLs and is NULL when every value is
+        for total, column in (("total_quantity", "return_quantity"), ("total_amount", "amount")):
+            if row[column] is not None:
+                group[total] = row[column] if group[total] is None else group[total] + row[column]
+    return list(groups.values())
+
+
+def fetchPurchaseIssuesForTenant(tenant, pdis, snapshot=None, debit_note_numbers=None):
+    """
+    Source side: returned quantity and amount per ucode + batch + debit note in one scan.
+    debit_note_numbers narrows it to those notes (event-driven rechecks).
+    """
+    if not pdis:
+        return []
+    if snapshot is not None and debit_note_numbers is None:
+        return purchaseIssueTotalsFromSnapshot(snapshot, tenant)
+
+    placeholders = ",".join(["%s"] * len(pdis))
+    params = tuple(pdis)
+    noteFilter = ""
+    if debit_note_numbers is not None:
+        noteFilter = f"AND pi.debit_note_number IN ({','.join(['%s'] * len(debit_note_numbers))})"
+        params += tuple(debit_note_numbers)
+    query = f"""
+        SELECT pii.ucode, pii.batch, pi.debit_note_number, pi.partner_detail_id,
+               SUM(pii.return_quantity) AS total_quantity,
+               SUM(pii.amount) AS total_amount
+        FROM purchase_issue pi
+        JOIN purchase_issue_item pii ON pii.purchase_issue_id = pi.id
+        WHERE pi.pr_type <> 'REGULAR_EASYSOL'
+          AND pi.debit_note_number IS NOT NULL
+          AND pi.debit_note_number != ''
+          AND pi.status NOT IN ('cancelled', 'DELETED')
+          AND pi.partner_detail_id IN ({placeholders})
+          AND pi.created_on >= '2025-08-30'
+          {noteFilter}
+        GROUP BY pii.ucode, pii.batch, pi.debit_note_number, pi.partner_detail_id
+    """
+    return fetch_all(tenant, query, params)
+
+
+def getInwardInvoiceTotals(tenant, invoice_nos, batch_size=500):
+    """
+    Destination side: SUM(quantity) and SUM(net_amount) per (code, batch, invoice_no)
+    for all given invoice numbers, one grouped query per chunk of invoice numbers.
+    """
+    totals = defaultdict(lambda: {"quantity": Decimal(0), "amount": Decimal(0)})
+    if not invoice_nos:
+        return totals
+
+    for i in range(0, len(invoice_nos), batch_size):
+        batch = invoice_nos[i:i + batch_size]
+        placeholders = ",".join(["%s"] * len(batch))
+        QUERY = f"""
+            SELECT iii.code, iii.batch, ii.invoice_no,
+                   SUM(iii.quantity) AS total_quantity,
+                   SUM(iii.net_amount) AS total_amount
+            FROM inward_invoice_item iii
+            JOIN inward_invoice ii ON iii.invoice_id = ii.id
+            WHERE ii.invoice_no IN ({placeholders})
+              AND ii.status NOT IN ('CANCELLED', 'DELETED')
+            GROUP BY iii.code, iii.batch, ii.invoice_no
+        """
+        for row in fetch_all(tenant, QUERY, tuple(batch)):
+            key = matchKey(row["code"], row["batch"], row["invoice_no"])
+            if key is None:
+                continue
+            entry = totals[key]
+            entry["quantity"] += Decimal(row["total_quantity"] or 0)
+            entry["amount"] += Decimal(row["total_amount"] or 0)
+    return totals
+
+
+def getCachedInwardInvoiceTotals(tenant, invoice_nos):
+    """
+    getInwardInvoiceTotals answered per invoice number from the shared lookup cache,
+    so repeated or concurrent requests for the same invoice share one query.
+    """
+    def loader(missing):
+        totals = getInwardInvoiceTotals(tenant, missing)
+        byInvoice = defaultdict(dict)
+        for key, entry in totals.items():
+            byInvoice[key[2]][key] = entry
+        return {invoice_no: byInvoice.get(matchValue(invoice_no), {}) for invoice_no in missing}
+
+    destTotals = {}
+    for invoiceTotals in destination_cache.get_many(tenant, "str_dest_totals", invoice_nos, loader, default={}).values():
+        destTotals.update(invoiceTotals)
+    return destTotals
+
+
+def writeReport(unit, report, row):
+    filename, output_dir = REPORT_OUTPUTS[report]
+    unit.write(filename, row, output_dir)
+
+
+def processDestTenant(unit, tenant, dest_tenant, sourceTotals, reports, amount_tolerance, quantity_tolerance, refresh=False):
+    """
+    Compare purchase issue totals of a tenant against one destination tenant, for every requested report.
+    refresh drops cached destination totals first, for invoices that may have just changed.
+    """
+    invoice_nos = list({debit_note_number for (_, _, debit_note_number) in sourceTotals})
+    if refresh:
+        destination_cache.invalidate(dest_tenant, "str_dest_totals", invoice_nos)
+    destTotals = getCachedInwardInvoiceTotals(dest_tenant, invoice_nos)
+
+    # Hash join source keys against destination totals
+    for (ucode, batch, debit_note_number), source in sourceTotals.items():
+        key = matchKey(ucode, batch, debit_note_number)
+        dest = destTotals.get(key) if key is not None else None
+        totalQuantityInInwardInvoice = int(dest["quantity"]) if dest else 0
+        totalAmountInInwardInvoice = dest["amount"] if dest else Decimal(0)
+
+        if AMOUNT_REPORT in reports:
+            diff = abs(totalAmountInInwardInvoice - source["amount"])
+            if diff > amount_tolerance:
+                writeReport(unit, AMOUNT_REPORT, {
+                    "tenant": tenant,
+                    "ucode": ucode,
+                    "batch": batch,
+                    "debit_note_number": debit_note_number,
+                    "totalAmountInPurchaseIssue": source["amount"],
+                    "totalAmountInInwardInvoice": totalAmountInInwardInvoice,
+                    "diff": diff,
+                    "dest_tenant": dest_tenant
+                })
+
+        if QUANTITY_REPORT in reports:
+            diff = totalQuantityInInwardInvoice - source["quantity"]
+            if abs(diff) > quantity_tolerance:
+                writeReport(unit, QUANTITY_REPORT, {
+                    "tenant": tenant,
+                    "ucode": ucode,
+                    "batch": batch,
+                    "debit_note_number": debit_note_number,
+                    "totalQuantityInPurchaseIssue": source["quantity"],
+                    "totalQuantityInInwardInvoice": totalQuantityInInwardInvoice,
+                    "diff": diff,
+                    "dest_tenant": dest_tenant
+                })
+
+
+def processTenant(tenant, reports=ALL_REPORTS, amount_tolerance=AMOUNT_TOLERANCE, quantity_tolerance=QUANTITY_TOLERANCE,
+                  checkpoint=NO_CHECKPOINT, snapshot=None):
+    """Scan a source tenant once and compare against each destination tenant once"""
+    try:
+        print(f"Processing tenant: {tenant}")
+        with checkpoint.unit(checkName(reports), tenant) as unit:
+            processSourceTenant(unit, tenant, reports, amount_tolerance, quantity_tolerance, snapshot)
+    except Exception as e:
+        print(f"❌ Error in processTenant for tenant {tenant}: {e}")
+
+
+def processSourceTenant(unit, tenant, reports, amount_tolerance, quantity_tolerance, snapshot=None,
+                        debit_note_numbers=None):
+    """Body of processTenant; findings go to the tenant's checkpoint unit"""
+    pdis = list(pdiToTenantMap.keys())
+    allPurchaseIssues = fetchPurchaseIssuesForTenant(tenant, pdis, snapshot, debit_note_numbers)
+    refresh = debit_note_numbers is not None
+    if not allPurchaseIssues:
+        return
+
+    # Aggregate per ucode + batch + invoice, grouped by destination tenant
+    destTenantTotals = defaultdict(lambda: defaultdict(lambda: {"quantity": 0, "amount": Decimal(0)}))
+    for purchaseIssue in allPurchaseIssues:
+        partner_detail_id = purchaseIssue["partner_detail_id"]
+        dest_tenant = pdiToTenantMap.get(str(partner_detail_id)) or pdiToTenantMap.get(partner_detail_id)
+        if not dest_tenant:
+            print(f"❌ Missing dest_tenant for partner_detail_id {partner_detail_id}")
+            continue
+        key = (purchaseIssue["ucode"], purchaseIssue["batch"], purchaseIssue["debit_note_number"])
+        source = destTenantTotals[dest_tenant][key]
+        source["quantity"] += int(purchaseIssue["total_quantity"] or 0)
+        source["amount"] += Decimal(purchaseIssue["total_amount"] or 0)
+
+    # One grouped destination query per dest tenant, each a scheduler unit on the destination's host
+    futures = {
+        scheduler.submit(
+            processDestTenant, unit, tenant, dest_tenant, sourceTotals, reports, amount_tolerance, quantity_tolerance,
+            refresh, db=dest_tenant, tenant=tenant
+        ): dest_tenant
+        for dest_tenant, sourceTotals in destTenantTotals.items()
+    }
+    for future in scheduler.wait(futures):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"❌ Error comparing tenant {tenant} with {futures[future]}: {e}")
+            unit.mark_failed(e)
+
+
+def recheckDebitNotes(tenant, debit_note_numbers, reports=ALL_REPORTS, amount_tolerance=AMOUNT_TOLERANCE,
+                      quantity_tolerance=QUANTITY_TOLERANCE, checkpoint=NO_CHECKPOINT):
+    """Re-run the comparison for a few debit notes of one tenant, bypassing cached destination totals"""
+    with checkpoint.unit(checkName(reports), tenant) as unit:
+        processSourceTenant(unit, tenant, reports, amount_tolerance, quantity_tolerance,
+                            debit_note_numbers=list(debit_note_numbers))
+    return tenant
+
+
+def processAllTenants(tenants, reports=ALL_REPORTS, amount_tolerance=AMOUNT_TOLERANCE,
+                      quantity_tolerance=QUANTITY_TOLERANCE, checkpoint=NO_CHECKPOINT, snapshot=None):
+    """
+    Process all tenants concurrently. Every tenant scan and destination compare is a
+    unit of the process-wide scheduler, bounded by its global, per-host and root caps.
+    """
+    tenants = checkpoint.pending(checkName(reports), tenants)
+    for_each_tenant(tenants, processTenant, reports, amount_tolerance, quantity_tolerance, checkpoint, snapshot)
+
+
+@register_check("str_recon", "Both STR amount and quantity reports in one pass", uses_snapshot=True)
+def runCheck(context):
+    processAllTenants(
+        context.tenants, checkpoint=context.checkpoint, snapshot=context.snapshot
+    )
+
+
+if __name__ == "__main__":
+    check_main("str_recon")
@@ -0,0 +1,111 @@
+import pymysql
+from concurrent.futures import FIRST_COMPLETED
+
+from getDBConnection import get_connection
+from work_scheduler import scheduler
+
+
+class Keyset:
+    """
+    Keyset pagination of a query that ends with its WHERE clause: each page appends
+    `AND key > <last key> ORDER BY key LIMIT batch_size`.
+    key is the column (or tuple of columns, compared in order) to page on;
+    key_field names it in the result rows when it is selected under an alias.
+    """
+
+    def __init__(self, query, params=None, batch_size=500, key="id", key_field=None):
+        self.query = query
+        self.params = list(params or ())
+        self.batch_size = int(batch_size)
+        self.keys = (key,) if isinstance(key, str) else tuple(key)
+        if key_field is None:
+            key_field = tuple(column.split(".")[-1] for column in self.keys)
+        self.fields = (key_field,) if isinstance(key_field, str) else tuple(key_field)
+        self.last = None
+        self.done = False
+
+    def next_page(self):
+        """(query, params) for the next page, or None once the result set is exhausted"""
+        if self.done:
+            return None
+        page_query, page_params = self.query, list(self.params)
+        if self.last is not None:
+            condition, condition_params = self._after_condition()
+            if not condition:
+                return None
+            page_query += f" AND ({condition})"
+            page_params += condition_params
+        return page_query + f" ORDER BY {', '.join(self.keys)} LIMIT {self.batch_size}", page_params
+
+    def advance(self, rows):
+        """Move past a page's rows; a short page is the last one"""
+        if len(rows) < self.batch_size:
+            self.done = True
+        if rows:
+            self.last = tuple(rows[-1][field] for field in self.fields)
+
+    def _after_condition(self):
+        """SQL condition for rows ordered after the last row (NULL key values never match)"""
+        clauses, params = [], []
+        for i, column in enumerate(self.keys):
+            if self.last[i] is None:
+                # Nothing sorts after NULL in a later column under this prefix
+                continue
+            parts = [f"{self.keys[j]} = %s" for j in range(i)] + [f"{column} > %s"]
+            clauses.append("(" + " AND ".join(parts) + ")")
+            params += list(self.last[:i]) + [self.last[i]]
+        return " OR ".join(clauses), params
+
+
+def stream_query(db_name, query, params=None, batch_size=500, key="id", key_field=None,
+                 cursor_class=pymysql.cursors.DictCursor):
+    """
+    Run a query in keyset pages (see Keyset) and yield each page as a list of at
+    most batch_size rows, so memory is bounded by the batch size rather than the
+    size of the result set.
+    Pages are read on a buffered cursor; a pooled connection is borrowed per page
+    and returned before the page is yielded, so slow consumers never hold one open.
+    """
+    keyset = Keyset(query, params, batch_size, key, key_field)
+    while True:
+        page = keyset.next_page()
+        if page is None:
+            return
+        with get_connection(db_name) as conn:
+            with conn.cursor(cursor_class) as cursor:
+                cursor.execute(*page)
+                rows = list(cursor.fetchall())
+        keyset.advance(rows)
+        if rows:
+            yield rows
+
+
+def process_stream(batches, process_batch, *args, max_in_flight=20, label="", on_error=None, db=None):
+    """
+    Feed batches from a generator to the work scheduler as they arrive, calling
+    process_batch(batch, *args) as a unit on db's host (queued fairly under label).
+    At most max_in_flight batches are queued or running at once, so a fast
+    producer cannot buffer the whole stream.
+    A failed batch is logged and passed to on_error(e) if given.
+    Returns the number of batches processed.
+    """
+    def collect(done):
+        for future in done:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Error in batch for tenant {label}: {e}")
+                if on_error:
+                    on_error(e)
+
+    total = 0
+    in_flight = set()
+    for batch in batches:
+        total += 1
+        in_flight.add(scheduler.submit(process_batch, batch, *args, db=db, tenant=label))
+        if len(in_flight) >= max_in_flight:
+            done = scheduler.wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight -= done
+            collect(done)
+    collect(scheduler.wait(in_flight))
+    return total
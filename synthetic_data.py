@@ -0,0 +1,644 @@
+import os
+import sys
+import json
+import time
+import glob
+import random
+import argparse
+import pymysql
+from collections import defaultdict, Counter
+from datetime import datetime, timedelta
+from decimal import Decimal
+from dotenv import load_dotenv
+
+from local_mirror import MIRROR_TABLES, open_mirror, to_sqlite
+from tenant_registry import TenantRegistry, write_cache
+from findings_diff import REPORT_KEYS
+
+load_dotenv('config.env')
+
+BENCH_DIRECTORY = os.getenv("BENCH_DIRECTORY", os.path.join(os.getcwd(), ".recon_bench"))
+# Local MySQL the synthetic tenants are loaded into; never point this at a shared server
+BENCH_DB_CONFIG = json.loads(os.getenv("BENCH_DB_CONFIG", '{"host": "127.0.0.1", "user": "root", "password": "", "port": 3306}'))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "42"))
+BENCH_INSERT_BATCH = int(os.getenv("BENCH_INSERT_BATCH", "5000"))  # rows per multi-row INSERT
+MYSQL_LOADED_FILE = os.path.join(BENCH_DIRECTORY, "mysql_loaded.json")  # which dataset the local MySQL holds
+
+# Synthetic tenant schemas are named <prefix><number>; only schemas with these prefixes are ever dropped
+WAREHOUSE_PREFIX = "bth"
+ARSENAL_PREFIX = "bar"
+ARSENAL_SHARE = 0.1        # fraction of tenants that are arsenals (the hubs most returns go to)
+HUB_RETURN_SHARE = 0.6     # fraction of returns sent to an arsenal
+PDI_BASE = 100000          # partner_detail_id of tenant n is PDI_BASE + n
+VENDOR_PDI = 1             # partner of regular purchases, not a tenant
+MISSING_INVOICE_BASE = 900000000  # invoice_ids that exist in no tenant
+
+CATALOG_SIZE = 20000       # ucodes 000000..019999; planted never-inwarded ucodes start with 9
+ITEM_COUNT_WEIGHTS = [30, 20, 14, 10, 8, 6, 5, 3, 2, 2]  # items per purchase issue, 1..10
+AVERAGE_ITEMS = sum((i + 1) * w for i, w in enumerate(ITEM_COUNT_WEIGHTS)) / sum(ITEM_COUNT_WEIGHTS)
+REGULAR_INVOICE_ITEMS = 100  # ucodes per generated regular inward invoice
+
+WINDOW_START = datetime(2025, 9, 1)   # inside every check's created_on / invoice_date window
+WINDOW_DAYS = 45
+HISTORICAL_START = datetime(2025, 6, 1)  # before every purchase issue window
+
+# Probabilities of each planted anomaly and of the noise every check must filter out
+PLANT_RATES = {
+    "historical": 0.05,          # purchase issue older than every check's window
+    "cancelled": 0.03,           # cancelled purchase issue
+    "no_debit_note": 0.05,       # purchase issue without a DC (half of them PR_SALES)
+    "missing_dc": 0.02,          # DC without an STR inward invoice in the destination
+    "quantity_mismatch": 0.02,   # one line inwarded with a different quantity
+    "amount_mismatch": 0.02,     # one line inwarded with a different amount
+    "duplicate_str": 0.01,       # STR inward invoice created twice
+    "no_cn": 0.02,               # STR inward invoice without a CN
+    "multi_cn": 0.01,            # STR inward invoice with two CNs
+    "never_inwarded": 0.005,     # returned line whose ucode the destination never purchased
+    "invalid_invoice": 0.01,     # purchase issue pointing at an invoice that does not exist
+    "non_regular_vendor": 0.1,   # pre purchase issue order with a PRIMARY / SECONDARY vendor
+}
+
+TENANT_TABLES = {
+    "purchase_issue": """
+        CREATE TABLE purchase_issue (
+            id BIGINT PRIMARY KEY,
+            partner_detail_id BIGINT,
+            tray_id BIGINT NULL,
+            invoice_id BIGINT NULL,
+            invoice_no VARCHAR(64) NULL,
+            invoice_sequence_type VARCHAR(32),
+            pr_type VARCHAR(32),
+            invoice_date DATETIME,
+            invoice_tenant VARCHAR(32),
+            status VARCHAR(16),
+            debit_note_number VARCHAR(64) NULL,
+            created_on DATETIME,
+            updated_on DATETIME,
+            KEY idx_pdi_created (partner_detail_id, created_on),
+            KEY idx_debit_note_number (debit_note_number)
+        )
+    """,
+    "purchase_issue_item": """
+        CREATE TABLE purchase_issue_item (
+            id BIGINT PRIMARY KEY,
+            purchase_issue_id BIGINT,
+            ucode VARCHAR(16),
+            batch VARCHAR(32),
+            return_quantity INT,
+            amount DECIMAL(14, 2),
+            created_on DATETIME,
+            updated_on DATETIME,
+            KEY idx_purchase_issue (purchase_issue_id)
+        )
+    """,
+    "inward_invoice": """
+        CREATE TABLE inward_invoice (
+            id BIGINT PRIMARY KEY,
+            invoice_no VARCHAR(64),
+            purchase_type VARCHAR(32),
+            status VARCHAR(16),
+            total DECIMAL(14, 2),
+            partner_detail_id BIGINT,
+            created_by VARCHAR(64),
+            created_on DATETIME,
+            updated_on DATETIME,
+            KEY idx_invoice_no (invoice_no),
+            KEY idx_type_created (purchase_type, created_on)
+        )
+    """,
+    "inward_invoice_item": """
+        CREATE TABLE inward_invoice_item (
+            id BIGINT PRIMARY KEY,
+            invoice_id BIGINT,
+            code VARCHAR(16),
+            batch VARCHAR(32),
+            quantity INT,
+            net_amount DECIMAL(14, 2),
+            created_on DATETIME,
+            updated_on DATETIME,
+            KEY idx_invoice (invoice_id),
+            KEY idx_code (code)
+        )
+    """,
+    "pre_purchase_issue_order": """
+        CREATE TABLE pre_purchase_issue_order (
+            id BIGINT PRIMARY KEY,
+            vendor_type VARCHAR(32),
+            partner_detail_id BIGINT,
+            status VARCHAR(16),
+            created_on DATETIME,
+            updated_on DATETIME
+        )
+    """,
+}
+
+SHARED_TABLES = {
+    ("vault", "debitnote"): """
+        CREATE TABLE IF NOT EXISTS debitnote (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            tenant VARCHAR(32),
+            return_order_id BIGINT,
+            note_type VARCHAR(32),
+            partner_detail_id BIGINT,
+            debit_note_number VARCHAR(64),
+            credit_note_number VARCHAR(64),
+            created_on DATETIME,
+            KEY idx_tenant_return_order (tenant, return_order_id)
+        )
+    """,
+    ("mercury", "warehouse"): """
+        CREATE TABLE IF NOT EXISTS warehouse (
+            id BIGINT PRIMARY KEY,
+            tenant VARCHAR(32),
+            is_setup TINYINT,
+            partner_detail_id BIGINT
+        )
+    """,
+    ("mercury", "arsenal"): """
+        CREATE TABLE IF NOT EXISTS arsenal (
+            id BIGINT PRIMARY KEY,
+            tenant VARCHAR(32),
+            is_setup TINYINT,
+            partner_detail_id BIGINT
+        )
+    """,
+}
+
+
+def tenant_names(count):
+    """(warehouses, arsenals) for a synthetic dataset of `count` tenants"""
+    arsenals = max(1, round(count * ARSENAL_SHARE)) if count >= 2 else 0
+    warehouses = [f"{WAREHOUSE_PREFIX}{n:04d}" for n in range(1, count - arsenals + 1)]
+    return warehouses, [f"{ARSENAL_PREFIX}{n:04d}" for n in range(1, arsenals + 1)]
+
+
+def is_bench_tenant(name):
+    return any(name.startswith(prefix) and name[len(prefix):].isdigit() for prefix in (WAREHOUSE_PREFIX, ARSENAL_PREFIX))
+
+
+def is_local_host(config):
+    return config.get("unix_socket") or config.get("host") in ("localhost", "127.0.0.1", "::1")
+
+
+def dataset_name(target, tenants, rows, seed):
+    return f"{target}-t{tenants}-r{rows}-s{seed}"
+
+
+def fmt(value):
+    return "" if value is None else str(value)
+
+
+class MySQLSink:
+    """
+    Loads generated rows into a local MySQL: one schema per tenant plus vault.debitnote and
+    mercury.warehouse / arsenal, with multi-row INSERTs of BENCH_INSERT_BATCH rows.
+    Earlier synthetic tenants are dropped first; rows of real tenants are never touched.
+    """
+
+    def __init__(self, config=None, batch_size=BENCH_INSERT_BATCH):
+        self.config = dict(config or BENCH_DB_CONFIG)
+        self.batch_size = batch_size
+        self.buffers = defaultdict(list)
+        self.columns = {}
+        self.conn = pymysql.connect(
+            host=self.config.get("host"), user=self.config.get("user"), password=self.config.get("password", ""),
+            port=int(self.config.get("port", 3306)), unix_socket=self.config.get("unix_socket"),
+            autocommit=False, charset="utf8mb4"
+        )
+
+    def prepare(self, tenants):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SET unique_checks = 0, foreign_key_checks = 0")
+            cursor.execute("SHOW DATABASES")
+            stale = [name for (name,) in cursor.fetchall() if is_bench_tenant(name)]
+            for name in stale:
+                cursor.execute(f"DROP DATABASE `{name}`")
+            if stale:
+                print(f"🧹 Dropped {len(stale)} synthetic tenant schemas from an earlier dataset")
+            for tenant in tenants:
+                cursor.execute(f"CREATE DATABASE `{tenant}`")
+                cursor.execute(f"USE `{tenant}`")
+                for ddl in TENANT_TABLES.values():
+                    cursor.execute(ddl)
+            for (db, table), ddl in SHARED_TABLES.items():
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{db}`")
+                cursor.execute(f"USE `{db}`")
+                cursor.execute(ddl)
+                cursor.execute(f"DELETE FROM `{table}` WHERE tenant LIKE %s OR tenant LIKE %s",
+                               (WAREHOUSE_PREFIX + "%", ARSENAL_PREFIX + "%"))
+        self.conn.commit()
+
+    def add(self, db, table, row):
+        key = (db, table)
+        if key not in self.columns:
+            self.columns[key] = list(row)
+        buffer = self.buffers[key]
+        buffer.append(tuple(row[column] for column in self.columns[key]))
+        if len(buffer) >= self.batch_size:
+            self.flush(key)
+
+    def flush(self, key):
+        rows = self.buffers.pop(key, None)
+        if not rows:
+            return
+        db, table = key
+        columns = self.columns[key]
+        with self.conn.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO `{db}`.`{table}` ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})", rows
+            )
+        self.conn.commit()
+
+    def finish(self, counts):
+        for key in list(self.buffers):
+            self.flush(key)
+        self.conn.close()
+
+
+class MirrorSink:
+    """
+    Local stand-in without MySQL: writes the tables the checks mirror straight into
+    local_mirror's per-tenant SQLite files, as if `local_mirror.py sync` had copied them.
+    Checks that read vault or mercury directly cannot run against it.
+    """
+
+    def __init__(self, directory, batch_size=BENCH_INSERT_BATCH):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.buffers = defaultdict(list)
+
+    def prepare(self, tenants):
+        for path in glob.glob(os.path.join(self.directory, "*.sqlite*")):
+            os.remove(path)
+        for tenant in tenants:
+            open_mirror(tenant, create=True, directory=self.directory).close()
+
+    def add(self, db, table, row):
+        if table not in MIRROR_TABLES:
+            return
+        buffer = self.buffers[(db, table)]
+        buffer.append(tuple(to_sqlite(row.get(column)) for column in MIRROR_TABLES[table]))
+        if len(buffer) >= self.batch_size:
+            self.flush((db, table))
+
+    def flush(self, key):
+        rows = self.buffers.pop(key, None)
+        if not rows:
+            return
+        tenant, table = key
+        columns = MIRROR_TABLES[table]
+        # Opened per batch: hundreds of tenants would otherwise hold three file handles each
+        db = open_mirror(tenant, directory=self.directory)
+        try:
+            with db:
+                db.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})", rows)
+        finally:
+            db.close()
+
+    def finish(self, counts):
+        for key in list(self.buffers):
+            self.flush(key)
+        synced_on = datetime.now().isoformat()
+        for path in glob.glob(os.path.join(self.directory, "*.sqlite")):
+            tenant = os.path.splitext(os.path.basename(path))[0]
+            db = open_mirror(tenant, directory=self.directory)
+            try:
+                with db:
+                    for table in MIRROR_TABLES:
+                        db.execute(
+                            "INSERT OR REPLACE INTO sync_state (table_name, watermark, last_id, rows_synced, synced_on) VALUES (?, ?, ?, ?, ?)",
+                            (table, synced_on[:19].replace("T", " "), 0, counts[(tenant, table)], synced_on)
+                        )
+            finally:
+                db.close()
+
+
+class DatasetGenerator:
+    """
+    Deterministic (seeded) multi-tenant dataset: purchase issues with items, the STR inward
+    invoices they produce in their destination tenants, vault CNs for those, regular
+    purchases of the returned ucodes and pre purchase issue orders, with PLANT_RATES
+    anomalies planted. Every planted anomaly is recorded as the REPORT_KEYS of the finding
+    the check is expected to report, so a run can be scored for missed and extra findings.
+    """
+
+    def __init__(self, tenants, rows, seed=BENCH_SEED, rates=None):
+        if tenants < 2:
+            raise ValueError("A dataset needs at least 2 tenants (returns go to another tenant)")
+        self.rng = random.Random(seed)
+        self.warehouses, self.arsenals = tenant_names(tenants)
+        self.tenants = self.warehouses + self.arsenals
+        self.pdis = {tenant: str(PDI_BASE + n) for n, tenant in enumerate(self.tenants, start=1)}
+        self.rows = rows
+        self.rates = dict(PLANT_RATES, **(rates or {}))
+        self.expected = defaultdict(set)   # report -> set of key tuples
+        self.counts = Counter()            # (tenant, table) -> rows
+        self.inwarded = defaultdict(set)   # destination -> ucodes it has purchased
+        self._ids = Counter()
+        self._fresh_ucodes = 0
+        self._missing_invoices = 0
+
+    def next_id(self, tenant, table):
+        self._ids[(tenant, table)] += 1
+        return self._ids[(tenant, table)]
+
+    def add(self, sink, tenant, table, row):
+        self.counts[(tenant, table)] += 1
+        sink.add(tenant, table, row)
+
+    def expect(self, report, *values):
+        self.expected[report].add(tuple(fmt(value) for value in values))
+
+    def timestamp(self, start=WINDOW_START, days=WINDOW_DAYS):
+        return start + timedelta(seconds=self.rng.randrange(days * 86400))
+
+    def notes_per_tenant(self):
+        """Purchase issues per source tenant, log-normally skewed like real tenant sizes"""
+        weights = [self.rng.lognormvariate(0, 0.8) for _ in self.tenants]
+        total = max(1, round(self.rows / AVERAGE_ITEMS))
+        return {tenant: max(1, round(total * weight / sum(weights))) for tenant, weight in zip(self.tenants, weights)}
+
+    def pick_destination(self, tenant):
+        hubs = [arsenal for arsenal in self.arsenals if arsenal != tenant]
+        if hubs and self.rng.random() < HUB_RETURN_SHARE:
+            return self.rng.choice(hubs)
+        while True:
+            dest = self.rng.choice(self.tenants)
+            if dest != tenant:
+                return dest
+
+    def pick_lines(self):
+        rng = self.rng
+        count = rng.choices(range(1, len(ITEM_COUNT_WEIGHTS) + 1), ITEM_COUNT_WEIGHTS)[0]
+        lines, seen = [], set()
+        for _ in range(count):
+            never = rng.random() < self.rates["never_inwarded"]
+            if never:
+                self._fresh_ucodes += 1
+                ucode = f"9{self._fresh_ucodes:05d}"
+            else:
+                ucode = f"{int(CATALOG_SIZE * rng.random() ** 2):06d}"  # popular ucodes are returned more often
+            batch = f"B{rng.randint(1, 40):03d}"
+            if (ucode, batch) in seen:
+                continue
+            seen.add((ucode, batch))
+            quantity = min(int(rng.paretovariate(1.5)), 60)
+            amount = (quantity * Decimal(rng.randint(1000, 50000)) / 100).quantize(Decimal("0.01"))
+            lines.append({"ucode": ucode, "batch": batch, "quantity": quantity, "amount": amount, "never": never})
+        return lines
+
+    def purchase_issue(self, sink, tenant, number):
+        rng, rates = self.rng, self.rates
+        dest = self.pick_destination(tenant)
+        historical = rng.random() < rates["historical"]
+        status = "cancelled" if rng.random() < rates["cancelled"] else "live"
+        has_dc = rng.random() >= rates["no_debit_note"]
+        debit_note_number = f"DN-{tenant.upper()}-{number:06d}" if has_dc else None
+        pr_type = "REGULAR" if has_dc or rng.random() < 0.5 else "PR_SALES"
+        created = self.timestamp(HISTORICAL_START, 30) if historical else self.timestamp()
+        in_window = status == "live" and not historical
+
+        invoice_id = None
+        if in_window and rng.random() < rates["invalid_invoice"]:
+            self._missing_invoices += 1
+            invoice_id = MISSING_INVOICE_BASE + self._missing_invoices
+
+        purchase_issue_id = self.next_id(tenant, "purchase_issue")
+        lines = self.pick_lines()
+        self.add(sink, tenant, "purchase_issue", {
+            "id": purchase_issue_id, "partner_detail_id": int(self.pdis[dest]), "tray_id": None,
+            "invoice_id": invoice_id, "invoice_no": None, "invoice_sequence_type": "DEBIT_NOTE", "pr_type": pr_type,
+            "invoice_date": created, "invoice_tenant": tenant, "status": status, "debit_note_number": debit_note_number,
+            "created_on": created, "updated_on": created,
+        })
+        for line in lines:
+            self.add(sink, tenant, "purchase_issue_item", {
+                "id": self.next_id(tenant, "purchase_issue_item"), "purchase_issue_id": purchase_issue_id,
+                "ucode": line["ucode"], "batch": line["batch"], "return_quantity": line["quantity"],
+                "amount": line["amount"], "created_on": created, "updated_on": created,
+            })
+
+        if not in_window:
+            return
+        if invoice_id is not None:
+            self.expect("invalidInvoiceInPR", tenant, purchase_issue_id, invoice_id)
+        for line in lines:
+            if line["never"]:
+                report = "ucodeNeverInwardForDCGenerated" if has_dc else "ucodeNeverInwardForDCNotGenerated"
+                self.expect(report, tenant, self.pdis[dest], line["ucode"], dest)
+            else:
+                self.inwarded[dest].add(line["ucode"])
+        if has_dc:
+            self.str_inward(sink, tenant, dest, debit_note_number, lines, created)
+
+    def str_inward(self, sink, tenant, dest, debit_note_number, lines, created):
+        """The destination's side of a DC: STR inward invoice(s) and their CNs, or a planted gap"""
+        rng, rates = self.rng, self.rates
+        outcome = rng.random()
+        inwarded_on = created + timedelta(hours=rng.randint(2, 72))
+
+        def expect_str_mismatch(line, quantity=True, amount=True):
+            key = (tenant, dest, line["ucode"], line["batch"], debit_note_number)
+            if quantity:
+                self.expect("strCreatedReturnQunatityDifferent", *key)
+            if amount:
+                self.expect("strCreatedQunatitySameAmountMismatch", *key)
+
+        if outcome < rates["missing_dc"]:
+            self.expect("dcCreatedStrNotCreated", tenant, dest, debit_note_number)
+            for line in lines:
+                expect_str_mismatch(line)
+            if rng.random() < 0.5:  # a cancelled STR must not count as received
+                self.inward_invoice(sink, dest, debit_note_number, "StockTransferReturn", "CANCELLED", lines, inwarded_on, tenant)
+            return
+        outcome -= rates["missing_dc"]
+
+        dest_lines = [dict(line) for line in lines]
+        copies = 1
+        if outcome < rates["quantity_mismatch"]:
+            line = rng.choice(dest_lines)
+            line["quantity"] = line["quantity"] - 1 if line["quantity"] > 1 else 2
+            expect_str_mismatch(line, amount=False)
+        elif outcome < rates["quantity_mismatch"] + rates["amount_mismatch"]:
+            line = rng.choice(dest_lines)
+            line["amount"] += 5
+            expect_str_mismatch(line, quantity=False)
+        elif outcome < rates["quantity_mismatch"] + rates["amount_mismatch"] + rates["duplicate_str"]:
+            copies = 2  # both copies are summed, so every line is doubled in the destination
+            self.expect("duplicateStrInwardInvoice", dest, debit_note_number)
+            for line in lines:
+                expect_str_mismatch(line)
+
+        for _ in range(copies):
+            invoice_id = self.inward_invoice(sink, dest, debit_note_number, "StockTransferReturn", "live", dest_lines, inwarded_on, tenant)
+            self.credit_notes(sink, dest, invoice_id, tenant, inwarded_on)
+
+    def inward_invoice(self, sink, tenant, invoice_no, purchase_type, status, lines, created, partner=None):
+        invoice_id = self.next_id(tenant, "inward_invoice")
+        self.add(sink, tenant, "inward_invoice", {
+            "id": invoice_id, "invoice_no": invoice_no, "purchase_type": purchase_type, "status": status,
+            "total": sum(line["amount"] for line in lines),
+            "partner_detail_id": int(self.pdis[partner]) if partner else VENDOR_PDI,
+            "created_by": "synthetic", "created_on": created, "updated_on": created,
+        })
+        for line in lines:
+            self.add(sink, tenant, "inward_invoice_item", {
+                "id": self.next_id(tenant, "inward_invoice_item"), "invoice_id": invoice_id, "code": line["ucode"],
+                "batch": line["batch"], "quantity": line["quantity"], "net_amount": line["amount"],
+                "created_on": created, "updated_on": created,
+            })
+        return invoice_id
+
+    def credit_notes(self, sink, tenant, invoice_id, source, created):
+        rng, rates = self.rng, self.rates
+        if rng.random() < rates["no_cn"]:
+            self.expect("noCNForStrInward", tenant, invoice_id)
+            return
+        count = 1
+        if rng.random() < rates["multi_cn"]:
+            count = 2
+            self.expect("multiCNForStrInward", tenant, invoice_id, "ST_RETURN")
+        for n in range(1, count + 1):
+            self.counts[("vault", "debitnote")] += 1
+            sink.add("vault", "debitnote", {
+                "tenant": tenant, "return_order_id": invoice_id, "note_type": "ST_RETURN",
+                "partner_detail_id": int(self.pdis[source]), "debit_note_number": f"VDN-{tenant.upper()}-{invoice_id}-{n}",
+                "credit_note_number": f"CN-{tenant.upper()}-{invoice_id}-{n}", "created_on": created,
+            })
+
+    def regular_purchases(self, sink, tenant):
+        """Regular inward invoices covering every ucode returned to a tenant, except planted ones"""
+        ucodes = sorted(self.inwarded.get(tenant, ()))
+        for n, start in enumerate(range(0, len(ucodes), REGULAR_INVOICE_ITEMS), start=1):
+            lines = [{"ucode": ucode, "batch": "B001", "quantity": 10, "amount": Decimal("100.00")}
+                     for ucode in ucodes[start:start + REGULAR_INVOICE_ITEMS]]
+            self.inward_invoice(sink, tenant, f"INV-{tenant.upper()}-{n:05d}", "Regular", "live", lines, self.timestamp(HISTORICAL_START, 60))
+
+    def pre_purchase_orders(self, sink, tenant, count):
+        for _ in range(count):
+            planted = self.rng.random() < self.rates["non_regular_vendor"]
+            order_id = self.next_id(tenant, "pre_purchase_issue_order")
+            created = self.timestamp()
+            self.add(sink, tenant, "pre_purchase_issue_order", {
+                "id": order_id, "vendor_type": self.rng.choice(["PRIMARY", "SECONDARY"]) if planted else "REGULAR",
+                "partner_detail_id": VENDOR_PDI, "status": "CREATED", "created_on": created, "updated_on": created,
+            })
+            if planted:
+                self.expect("nonRegularVendorType", tenant, order_id)
+
+    def registry_rows(self):
+        return [
+            {"tenant_type": "arsenal" if tenant in self.arsenals else "warehouse", "warehouse_id": n,
+             "tenant": tenant, "partner_detail_id": self.pdis[tenant]}
+            for n, tenant in enumerate(self.tenants, start=1)
+        ]
+
+    def generate(self, sink):
+        """Write the dataset through a sink; returns {report: sorted expected finding keys}"""
+        sink.prepare(self.tenants)
+        notes = self.notes_per_tenant()
+        for tenant in self.tenants:
+            for number in range(1, notes[tenant] + 1):
+                self.purchase_issue(sink, tenant, number)
+        for tenant in self.tenants:
+            self.regular_purchases(sink, tenant)
+            self.pre_purchase_orders(sink, tenant, max(1, notes[tenant] // 10))
+        for row in self.registry_rows():
+            self.counts[("mercury", row["tenant_type"])] += 1
+            sink.add("mercury", row["tenant_type"], {
+                "id": row["warehouse_id"], "tenant": row["tenant"], "is_setup": 1, "partner_detail_id": int(row["partner_detail_id"]),
+            })
+        sink.finish(self.counts)
+        return {report: sorted(self.expected.get(report, ())) for report in REPORT_KEYS}
+
+    def table_totals(self):
+        totals = Counter()
+        for (_, table), count in self.counts.items():
+            totals[table] += count
+        return dict(totals)
+
+
+def write_dataset(target, tenants, rows, seed=BENCH_SEED, directory=None, db_config=None, allow_remote=False):
+    """
+    Generate a dataset into MySQL ("mysql") or local mirror files ("mirror") and write its
+    manifest, expected findings and tenant registry cache under directory. Returns the manifest.
+    """
+    directory = directory or os.path.join(BENCH_DIRECTORY, "data", dataset_name(target, tenants, rows, seed))
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)  # only a complete dataset has a manifest
+
+    if target == "mysql":
+        db_config = dict(db_config or BENCH_DB_CONFIG)
+        if not is_local_host(db_config) and not allow_remote:
+            raise ValueError(f"Refusing to load synthetic tenants into {db_config.get('host')}: BENCH_DB_CONFIG must be a local MySQL")
+        sink = MySQLSink(db_config)
+    elif target == "mirror":
+        sink = MirrorSink(os.path.join(directory, "mirror"))
+    else:
+        raise ValueError(f"Unknown target {target} (mysql or mirror)")
+
+    started = time.monotonic()
+    generator = DatasetGenerator(tenants, rows, seed)
+    print(f"🧪 Generating {tenants} tenants with ~{rows} purchase issue items into {target} (seed {seed})")
+    expected = generator.generate(sink)
+
+    registry_path = os.path.join(directory, "tenant_registry.json")
+    write_cache(TenantRegistry(generator.registry_rows(), time.time(), "synthetic"), registry_path)
+    with open(os.path.join(directory, "expected.json"), "w", encoding="utf-8") as f:
+        json.dump(expected, f, indent=1)
+
+    manifest = {
+        "target": target, "tenants": tenants, "rows": rows, "seed": seed,
+        "generated_on": datetime.now().isoformat(), "generate_seconds": round(time.monotonic() - started, 1),
+        "tenant_names": generator.tenants, "table_rows": generator.table_totals(),
+        "expected_findings": {report: len(keys) for report, keys in expected.items()},
+        "registry_cache": registry_path, "expected": os.path.join(directory, "expected.json"),
+        "mirror_directory": os.path.join(directory, "mirror") if target == "mirror" else None,
+        "db_config": db_config if target == "mysql" else None,
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, default=str)
+    if target == "mysql":
+        os.makedirs(os.path.dirname(MYSQL_LOADED_FILE), exist_ok=True)
+        with open(MYSQL_LOADED_FILE, "w", encoding="utf-8") as f:
+            json.dump({"directory": os.path.abspath(directory), "generated_on": manifest["generated_on"]}, f)
+    print(f"✅ Dataset ready in {manifest['generate_seconds']}s: {directory}")
+    for table, count in sorted(manifest["table_rows"].items()):
+        print(f"   {table:28} {count:>10} rows")
+    return manifest
+
+
+def read_manifest(directory):
+    """Manifest of a complete dataset, None when it was never (fully) generated or is no longer loaded"""
+    try:
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["target"] == "mysql":
+            # MySQL holds one dataset at a time: the manifest is only current for the last one loaded
+            with open(MYSQL_LOADED_FILE, encoding="utf-8") as f:
+                loaded = json.load(f)
+            if loaded["directory"] != os.path.abspath(directory) or loaded["generated_on"] != manifest["generated_on"]:
+                return None
+        return manifest
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic multi-tenant recon dataset with planted mismatches")
+    parser.add_argument("--target", choices=["mysql", "mirror"], default="mirror",
+                        help="Local MySQL (BENCH_DB_CONFIG) or local mirror SQLite files (default)")
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=10000, help="Purchase issue items across all tenants")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED)
+    parser.add_argument("--directory", help="Dataset directory (default: BENCH_DIRECTORY/data/<name>)")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow a non-local BENCH_DB_CONFIG host")
+    args = parser.parse_args()
+
+    try:
+        write_dataset(args.target, args.tenants, args.rows, args.seed, args.directory, allow_remote=args.allow_remote)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from threading import Lock
+from collections import defaultdict
+from collections.abc import Mapping
+from dotenv import load_dotenv
+
+from getDBConnection import get_connection
+
+load_dotenv('config.env')
+
+REGISTRY_CACHE_FILE = os.getenv("TENANT_REGISTRY_CACHE", os.path.join(os.getcwd(), ".recon_cache", "tenant_registry.json"))
+REGISTRY_TTL = float(os.getenv("TENANT_REGISTRY_TTL", "21600"))  # seconds a cached registry is trusted without a full reload
+REGISTRY_VERIFY = os.getenv("TENANT_REGISTRY_VERIFY", "1") == "1"  # compare a cached registry's counts with mercury at startup
+
+# One round trip for every set-up tenant, its warehouse ID and its partner_detail_id(s).
+# Override with TENANT_REGISTRY_QUERY if the partner detail mapping lives elsewhere;
+# it must return tenant_type, warehouse_id, tenant and partner_detail_id.
+REGISTRY_QUERY = os.getenv("TENANT_REGISTRY_QUERY", """
+    SELECT 'warehouse' AS tenant_type, w.id AS warehouse_id, w.tenant, w.partner_detail_id
+    FROM warehouse w WHERE w.is_setup = 1
+    UNION ALL
+    SELECT 'arsenal' AS tenant_type, a.id AS warehouse_id, a.tenant, a.partner_detail_id
+    FROM arsenal a WHERE a.is_setup = 1
+""")
+
+# Used when REGISTRY_QUERY fails: the tenant lists getAllWarehouse / getAllArsenal always read,
+# with partner detail IDs taken from the static pdi.py map
+FALLBACK_QUERY = """
+    SELECT 'warehouse' AS tenant_type, id AS warehouse_id, tenant, NULL AS partner_detail_id
+    FROM warehouse WHERE is_setup = 1
+    UNION ALL
+    SELECT 'arsenal' AS tenant_type, id AS warehouse_id, tenant, NULL AS partner_detail_id
+    FROM arsenal WHERE is_setup = 1
+"""
+
+# Cheap startup check of a cached registry: a tenant set up or removed since it was
+# cached changes the count or the highest id of its table
+FRESHNESS_QUERY = """
+    SELECT 'warehouse' AS tenant_type, COUNT(*) AS tenants, MAX(id) AS max_id FROM warehouse WHERE is_setup = 1
+    UNION ALL
+    SELECT 'arsenal' AS tenant_type, COUNT(*) AS tenants, MAX(id) AS max_id FROM arsenal WHERE is_setup = 1
+"""
+
+
+class TenantRegistry:
+    """
+    Tenants, warehouse IDs and partner_detail_id mappings with O(1) indexes:
+    pdi -> tenant, tenant -> pdis, tenant -> warehouse_id.
+    """
+
+    def __init__(self, rows, loaded_on, pdi_source="mercury"):
+        self.rows = rows
+        self.loaded_on = loaded_on
+        self.pdi_source = pdi_source
+        self.tenants_by_type = defaultdict(list)
+        self.warehouse_ids = {}
+        self.pdi_to_tenant = {}
+        self.tenant_to_pdis = defaultdict(list)
+        for row in rows:
+            tenant = row["tenant"]
+            if tenant not in self.warehouse_ids:
+                self.warehouse_ids[tenant] = row["warehouse_id"]
+                self.tenants_by_type[row["tenant_type"]].append(tenant)
+            pdi = row.get("partner_detail_id")
+            if pdi is not None and str(pdi) != "":
+                self.pdi_to_tenant[str(pdi)] = tenant
+                self.tenant_to_pdis[tenant].append(str(pdi))
+        for tenants in self.tenants_by_type.values():
+            tenants.sort()
+
+    @property
+    def age(self):
+        return time.time() - self.loaded_on
+
+    @property
+    def warehouses(self):
+        return list(self.tenants_by_type["warehouse"])
+
+    @property
+    def arsenals(self):
+        return list(self.tenants_by_type["arsenal"])
+
+    def freshness(self):
+        """{tenant_type: (tenants, highest warehouse_id)}, comparable with query_freshness()"""
+        result = {}
+        for tenant_type in ("warehouse", "arsenal"):
+            ids = [self.warehouse_ids[tenant] for tenant in self.tenants_by_type[tenant_type]
+                   if self.warehouse_ids[tenant] is not None]
+            result[tenant_type] = (len(self.tenants_by_type[tenant_type]), max(ids) if ids else None)
+        return result
+
+    def to_json(self):
+        return {"loaded_on": self.loaded_on, "pdi_source": self.pdi_source, "rows": self.rows}
+
+
+def query_registry_rows():
+    """(rows, pdi_source) from mercury in one round trip"""
+    with get_connection("mercury") as conn:
+        cursor = conn.cursor()
+        try:
+            try:
+                cursor.execute(REGISTRY_QUERY)
+                pdi_source = "mercury"
+            except Exception as e:
+                print(f"⚠️ Tenant registry query failed, using pdi.py for partner detail IDs: {e}")
+                cursor.execute(FALLBACK_QUERY)
+                pdi_source = "pdi.py"
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    if pdi_source == "pdi.py":
+        from pdi import pdiToTenantMap as staticMap
+        pdisByTenant = defaultdict(list)
+        for pdi, tenant in staticMap.items():
+            pdisByTenant[tenant].append(pdi)
+        expanded = []
+        for row in rows:
+            for pdi in pdisByTenant.get(row["tenant"]) or [None]:
+                expanded.append(dict(row, partner_detail_id=pdi))
+        rows = expanded
+    for row in rows:
+        row["warehouse_id"] = int(row["warehouse_id"]) if row["warehouse_id"] is not None else None
+        row["partner_detail_id"] = str(row["partner_detail_id"]) if row["partner_detail_id"] is not None else None
+    return rows, pdi_source
+
+
+def query_freshness():
+    """{tenant_type: (tenants, highest id)} as mercury has them now"""
+    with get_connection("mercury") as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(FRESHNESS_QUERY)
+            return {
+                tenant_type: (int(tenants), int(max_id) if max_id is not None else None)
+                for tenant_type, tenants, max_id in cursor.fetchall()
+            }
+        finally:
+            cursor.close()
+
+
+def cache_is_current(cached):
+    """
+    False when mercury's tenant count or highest id differs from the cached registry.
+    If mercury cannot be asked the cache is trusted, as it is within its TTL.
+    """
+    try:
+        current = query_freshness()
+    except Exception as e:
+        print(f"⚠️ Could not verify the cached tenant registry ({e}); using it as is")
+        return True
+    for tenant_type, cached_state in cached.freshness().items():
+        state = current.get(tenant_type, (0, None))
+        if state != cached_state:
+            print(
+                f"🔄 Cached tenant registry is out of date: {tenant_type} has {state[0]} tenants (max id {state[1]}) "
+                f"in mercury, {cached_state[0]} (max id {cached_state[1]}) in the cache"
+            )
+            return False
+    return True
+
+
+def read_cache(path=REGISTRY_CACHE_FILE):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return TenantRegistry(data["rows"], data["loaded_on"], data.get("pdi_source", "mercury"))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cache(registry, path=REGISTRY_CACHE_FILE):
+    """Atomic replace, so concurrent script starts never read a half-written file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=directory, suffix=".partial")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(registry.to_json(), f)
+    os.replace(partial, path)
+
+
+def load_registry(max_age=REGISTRY_TTL, refresh=False, path=REGISTRY_CACHE_FILE, verify=REGISTRY_VERIFY):
+    """
+    Registry from the cache file when younger than max_age (and, with verify, still
+    matching mercury's tenant counts), else from mercury (and re-cached). If mercury
+    cannot be reached a stale cache is used, with a warning that says how old it is;
+    without any cache the error is raised.
+    """
+    cached = None if refresh else read_cache(path)
+    if cached is not None and cached.age <= max_age and (not verify or cache_is_current(cached)):
+        print(f"📇 Tenant registry from cache, loaded {cached.age / 60:.0f} minutes ago ({cached.pdi_source})")
+        return cached
+    try:
+        rows, pdi_source = query_registry_rows()
+    except Exception as e:
+        stale = cached or read_cache(path)
+        if stale is None:
+            raise
+        print(f"⚠️ Could not refresh tenant registry ({e}); using cache from {stale.age / 3600:.1f}h ago")
+        return stale
+    registry = TenantRegistry(rows, time.time(), pdi_source)
+    write_cache(registry, path)
+    print(f"🔄 Tenant registry refreshed: {len(registry.warehouse_ids)} tenants, {len(registry.pdi_to_tenant)} partner detail IDs ({pdi_source})")
+    return registry
+
+
+_registry = None
+_registry_lock = Lock()
+_refreshed_on_miss = False
+
+
+def get_registry():
+    global _registry
+    registry = _registry
+    if registry is not None:
+        return registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = load_registry()
+        return _registry
+
+
+def refresh_on_miss(what):
+    """
+    A tenant or pdi missing from a cached registry may be new: reload from mercury,
+    at most once per process, instead of silently treating it as unknown.
+    Returns True if the registry was reloaded.
+    """
+    global _registry, _refreshed_on_miss
+    with _registry_lock:
+        if _refreshed_on_miss or (_registry is not None and _registry.age < 60):
+            return False
+        _refreshed_on_miss = True
+        print(f"🔄 {what} not in the cached tenant registry, reloading from mercury")
+        _registry = load_registry(refresh=True)
+        return True
+
+
+def tenant_for_pdi(pdi):
+    tenant = get_registry().pdi_to_tenant.get(str(pdi))
+    if tenant is None and refresh_on_miss(f"partner_detail_id {pdi}"):
+        tenant = get_registry().pdi_to_tenant.get(str(pdi))
+    return tenant
+
+
+def pdis_for_tenant(tenant):
+    pdis = get_registry().tenant_to_pdis.get(tenant)
+    if pdis is None and refresh_on_miss(f"tenant {tenant}"):
+        pdis = get_registry().tenant_to_pdis.get(tenant)
+    return list(pdis or [])
+
+
+def warehouse_id_for_tenant(tenant):
+    warehouse_id = get_registry().warehouse_ids.get(tenant)
+    if warehouse_id is None and refresh_on_miss(f"tenant {tenant}"):
+        warehouse_id = get_registry().warehouse_ids.get(tenant)
+    return warehouse_id
+
+
+class PdiToTenantMap(Mapping):
+    """
+    Drop-in for pdi.pdiToTenantMap: a read-only {partner_detail_id: tenant} view of the
+    registry, loaded on first use. Unknown keys trigger one reload before failing.
+    """
+
+    def __getitem__(self, pdi):
+        tenant = tenant_for_pdi(pdi)
+        if tenant is None:
+            raise KeyError(pdi)
+        return tenant
+
+    def get(self, pdi, default=None):
+        tenant = tenant_for_pdi(pdi)
+        return default if tenant is None else tenant
+
+    def __contains__(self, pdi):
+        return tenant_for_pdi(pdi) is not None
+
+    def __iter__(self):
+        return iter(get_registry().pdi_to_tenant)
+
+    def __len__(self):
+        return len(get_registry().pdi_to_tenant)
+
+
+pdiToTenantMap = PdiToTenantMap()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cached registry of tenants, warehouse IDs and partner detail IDs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("refresh", help="Reload the registry from mercury")
+    commands.add_parser("show", help="Print the registry summary")
+    lookup_parser = commands.add_parser("lookup", help="Resolve tenants or partner detail IDs")
+    lookup_parser.add_argument("keys", nargs="+")
+    commands.add_parser("compare", help="Differences between the registry and the static pdi.py map")
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        load_registry(refresh=True)
+        sys.exit(0)
+    registry = get_registry()
+    if args.command == "show":
+        print(f"Loaded {registry.age / 60:.0f} minutes ago from {registry.pdi_source}")
+        print(f"Warehouses: {len(registry.warehouses)}, arsenals: {len(registry.arsenals)}, partner detail IDs: {len(registry.pdi_to_tenant)}")
+    elif args.command == "lookup":
+        for key in args.keys:
+            if key in registry.warehouse_ids:
+                print(f"{key}: warehouse_id={registry.warehouse_ids[key]} pdis={registry.tenant_to_pdis.get(key, [])}")
+            else:
+                print(f"{key}: tenant={registry.pdi_to_tenant.get(key)}")
+    else:
+        from pdi import pdiToTenantMap as staticMap
+        for pdi in sorted(set(staticMap) | set(registry.pdi_to_tenant), key=lambda k: int(k) if k.isdigit() else 0):
+            static_tenant, tenant = staticMap.get(pdi), registry.pdi_to_tenant.get(pdi)
+            if static_tenant != tenant:
+                print(f"{pdi}: pdi.py={static_tenant} registry={tenant}")
@@ -0,0 +1,133 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import work_scheduler
+import recheck_consumer
+from lookup_cache import LookupCache
+from recheck_consumer import RecheckConsumer, RecheckKeys, MemoryEventSource, ChangeEvent, sourceTenantsForInvoices
+
+
+class CollectingWriter:
+    def __init__(self):
+        self.rows = []
+
+    def write_many(self, rows):
+        self.rows.extend(rows)
+
+
+def dcConsumer(monkeypatch, tmp_path, down):
+    """Consumer rechecking dc_created_str_not_created against two destinations, `down` failing"""
+    monkeypatch.setattr(work_scheduler, "host_label", lambda db_name: "test-host")
+    consumer = RecheckConsumer(MemoryEventSource(), checks=["dc_created_str_not_created"])
+    consumer.checkpoint.directory = str(tmp_path)
+    dc = sys.modules["dcCreatedStrNotCreated"]
+    monkeypatch.setattr(dc, "pdiToTenantMap", {"1": "dest_ok", "2": "dest_down"})
+    monkeypatch.setattr(dc, "fetchDistinctDebitNoteNumbersWithPdi", lambda tenant, pdis, snapshot=None, debit_note_numbers=None: [
+        {"debit_note_number": "DN1", "partner_detail_id": 1},
+        {"debit_note_number": "DN2", "partner_detail_id": 2},
+    ])
+
+    def getExistingDCNumbers(dest_tenant, dcs):
+        if dest_tenant in down:
+            raise ConnectionError(f"{dest_tenant} unreachable")
+        return set()
+
+    monkeypatch.setattr(dc, "getExistingDCNumbers", getExistingDCNumbers)
+    writer = CollectingWriter()
+    monkeypatch.setattr(recheck_consumer, "get_csv_writer", lambda filename, output_dir=None, needLogs=True: writer)
+    return consumer, writer
+
+
+def recheckKeys():
+    keys = RecheckKeys()
+    keys.debit_notes["th1"].update({"DN1", "DN2"})
+    return keys
+
+
+def test_failed_destination_lookup_is_retried(monkeypatch, tmp_path):
+    consumer, writer = dcConsumer(monkeypatch, tmp_path, down={"dest_down"})
+
+    retry = consumer.process(recheckKeys())
+
+    assert retry.debit_notes["th1"] == {"DN1", "DN2"}
+    assert consumer.stats["failures"] == 1
+    assert writer.rows == []  # nothing of a failed recheck is written
+
+
+def test_successful_recheck_is_not_retried(monkeypatch, tmp_path):
+    consumer, writer = dcConsumer(monkeypatch, tmp_path, down=set())
+
+    retry = consumer.process(recheckKeys())
+
+    assert not retry
+    assert sorted(row["source_debit_note_number"] for row in writer.rows) == ["DN1", "DN2"]
+
+
+def test_rechecked_finding_is_written_once(monkeypatch, tmp_path):
+    consumer, writer = dcConsumer(monkeypatch, tmp_path, down=set())
+
+    consumer.process(recheckKeys())
+    consumer.process(recheckKeys())
+
+    assert len(writer.rows) == 2
+
+
+def test_only_str_inward_invoices_are_probed():
+    keys = RecheckKeys()
+    keys.add(ChangeEvent("inward_invoice", "dest1", [{"id": 1, "invoice_no": "INV1", "purchase_type": "Regular"}]))
+    keys.add(ChangeEvent("inward_invoice", "dest1", [{"id": 2, "invoice_no": "DN9", "purchase_type": "StockTransferReturn"}]))
+
+    assert dict(keys.dest_invoice_nos) == {"dest1": {"DN9"}}
+    assert dict(keys.str_invoices) == {"dest1": {2}}
+
+
+def test_unmatched_invoice_is_not_probed_again(monkeypatch):
+    monkeypatch.setattr(recheck_consumer, "destination_cache", LookupCache())
+    probes = []
+
+    def probeSourceTenants(dest_tenant, invoice_nos, failed_sources=None):
+        probes.append(list(invoice_nos))
+        return {}
+
+    monkeypatch.setattr(recheck_consumer, "probeSourceTenants", probeSourceTenants)
+
+    assert sourceTenantsForInvoices("dest1", ["DN9"], unmatched_ttl=60) == {}
+    assert sourceTenantsForInvoices("dest1", ["DN9"], unmatched_ttl=60) == {}
+    assert probes == [["DN9"]]
+
+
+def test_failed_resolve_is_retried(monkeypatch, tmp_path):
+    consumer, writer = dcConsumer(monkeypatch, tmp_path, down=set())
+
+    def debitNotesOfPurchaseIssues(tenant, ids):
+        raise ConnectionError(f"{tenant} unreachable")
+
+    monkeypatch.setattr(recheck_consumer, "debitNotesOfPurchaseIssues", debitNotesOfPurchaseIssues)
+    keys = recheckKeys()
+    keys.purchase_issue_ids["th2"].update({7, 8})
+
+    retry = consumer.process(keys)
+
+    assert dict(retry.purchase_issue_ids) == {"th2": {7, 8}}
+    assert not retry.debit_notes  # the keys that did resolve were rechecked
+    assert sorted(row["source_debit_note_number"] for row in writer.rows) == ["DN1", "DN2"]
+
+
+def test_failed_source_is_skipped_and_unmatched_numbers_retried(monkeypatch):
+    monkeypatch.setattr(work_scheduler, "host_label", lambda db_name: "test-host")
+    monkeypatch.setattr(recheck_consumer, "destination_cache", LookupCache())
+    monkeypatch.setattr(recheck_consumer, "pdis_for_tenant", lambda tenant: [1])
+    monkeypatch.setattr(recheck_consumer, "get_registry", lambda: type("Registry", (), {"warehouses": ["src_ok", "src_down"], "arsenals": []}))
+
+    def fetch_all_blocking(source, query, params):
+        if source == "src_down":
+            raise ConnectionError("src_down unreachable")
+        return [{"debit_note_number": "DN1"}]
+
+    monkeypatch.setattr(recheck_consumer, "fetch_all_blocking", fetch_all_blocking)
+    unresolved = set()
+
+    assert sourceTenantsForInvoices("dest1", ["DN1", "DN2"], unmatched_ttl=60, unresolved=unresolved) == {"DN1": "src_ok"}
+    assert unresolved == {"DN2"}
+    assert recheck_consumer.destination_cache.get_stats()["size"] == 1  # DN2 is not cached as unmatched
@@ -0,0 +1,100 @@
+import sys
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import token_switcher
+from token_switcher import TokenManager
+
+
+class StubWms:
+    """WMS auth switch endpoint on localhost: records every POST and answers with `status`"""
+
+    def __init__(self, status=200, delay=None):
+        self.status = status
+        self.delay = delay  # threading.Event the handler waits on before answering
+        self.posts = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stub.posts.append((self.path, self.headers.get("Authorization")))
+                if stub.delay is not None:
+                    stub.delay.wait(5)
+                body = json.dumps({"token": f"token-for{self.path}"}).encode() if stub.status == 200 else b"nope"
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def wms(monkeypatch):
+    monkeypatch.setattr(token_switcher, "warehouse_id_for_tenant", lambda tenant: {"th1": 11, "ar1": 21}.get(tenant))
+    stub = StubWms()
+    yield stub
+    stub.close()
+
+
+def manager(wms, **kwargs):
+    return TokenManager(base_url=wms.url, auth_token="prod-token", **kwargs)
+
+
+def test_concurrent_gets_share_one_switch(wms):
+    wms.delay = threading.Event()
+    tokens = manager(wms)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(tokens.get, "th1") for _ in range(8)]
+        wms.delay.set()
+        results = [future.result() for future in futures]
+
+    assert results == ["token-for/api/user/auth/switch/warehouse/11"] * 8
+    assert wms.posts == [("/api/user/auth/switch/warehouse/11", "prod-token")]
+    assert tokens.get("th1") == results[0]  # cached
+    assert len(wms.posts) == 1
+
+
+def test_failed_switch_is_not_retried_within_failure_ttl(wms):
+    wms.status = 500
+    tokens = manager(wms, failure_ttl=60)
+
+    assert tokens.get("ar1") is None
+    assert tokens.get("ar1") is None
+    assert wms.posts == [("/api/user/auth/switch/arsenal/21", "prod-token")]
+    assert tokens.stats["failed_hits"] == 1
+
+
+def test_tenant_without_warehouse_is_not_switched(wms):
+    tokens = manager(wms)
+
+    assert tokens.get("th404") is None
+    assert wms.posts == []
+
+
+def test_switch_and_cache_replaces_the_cached_token(wms):
+    tokens = manager(wms)
+
+    token = tokens.switch_and_cache(99, "th1")
+
+    assert token == "token-for/api/user/auth/switch/warehouse/99"
+    assert tokens.get("th1") == token
+    assert tokens.cached() == [{"tenant": "th1", "token": token, "warehouse_id": 99}]
+    assert len(wms.posts) == 1
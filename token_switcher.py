@@ -1,74 +1,198 @@
 import os
+import json
+import time
+import base64
 import requests
+from threading import Lock
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from getDBConnection import create_db_connection
+from tenant_registry import warehouse_id_for_tenant
 
 # Load environment variables
 load_dotenv('config.env')
 
-# Global list to store tokens
-token_cache = []
+WMS_BASE_URL = os.getenv("WMS_BASE_URL", "https://wms.mercuryonline.co")
+TOKEN_TTL = float(os.getenv("TOKEN_TTL", "3600"))                # used when a token carries no `exp`
+TOKEN_EXPIRY_MARGIN = float(os.getenv("TOKEN_EXPIRY_MARGIN", "60"))  # refresh this many seconds before expiry
+TOKEN_HTTP_POOL_SIZE = int(os.getenv("TOKEN_HTTP_POOL_SIZE", "16"))
+TOKEN_FAILURE_TTL = float(os.getenv("TOKEN_FAILURE_TTL", "60"))  # seconds a failed switch is not retried
+TOKEN_HTTP_TIMEOUT = 10
 
-def fetch_warehouse_id(connection, tenant):
-    
-    query = "SELECT id FROM warehouse WHERE is_setup = 1 AND tenant = %s LIMIT 1" if not tenant.startswith('ar') else "SELECT id FROM arsenal WHERE is_setup = 1 AND tenant = %s LIMIT 1"
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute(query, (tenant))
-            result = cursor.fetchone()
-            return result[0]
-    except Exception as e:
-        print(f"Failed to fetch warehouse ID for tenant {tenant}: {e}")
-        return None
 
-def switch_token(warehouse_id, tenant , warehouse_type = 'warehouse'):
-    url = f'https://wms.mercuryonline.co/api/user/auth/switch/{warehouse_type}/{warehouse_id}'    
-    headers = {
-        'Authorization': f'{os.getenv("PROD_TOKEN")}',
-        'Content-Type': 'application/json'
-    }
+def token_expiry(token, now=None, ttl=TOKEN_TTL):
+    """Expiry of a token: the JWT `exp` claim when it has one, else now + ttl"""
+    now = time.time() if now is None else now
     try:
-        print(f"Switching to tenant {tenant}")
-        response = requests.post(url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            token = response.json()['token']
-            print(f"Token obtained for tenant: {tenant}")
-            # Store token in list
-            token_cache.append({
-                'tenant': tenant,
-                'token': token,
-                'warehouse_id': warehouse_id
-            })
-            return token
-        else:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return now + ttl
+
+
+def warehouse_type_for(tenant):
+    return 'arsenal' if tenant.startswith('ar') else 'warehouse'
+
+
+class TokenManager:
+    """
+    Per-tenant WMS tokens in a locked dict, kept until shortly before they expire.
+    Concurrent callers for the same tenant share one switch request (single-flight),
+    and every request goes through one keep-alive session, so TLS is set up once per
+    pooled connection instead of once per switch. A failed switch is remembered for
+    failure_ttl seconds, so callers get None at once instead of POSTing it again.
+    """
+
+    def __init__(self, base_url=WMS_BASE_URL, ttl=TOKEN_TTL, expiry_margin=TOKEN_EXPIRY_MARGIN,
+                 pool_size=TOKEN_HTTP_POOL_SIZE, auth_token=None, failure_ttl=TOKEN_FAILURE_TTL):
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self.expiry_margin = expiry_margin
+        self.failure_ttl = failure_ttl
+        self.auth_token = auth_token
+        self._tokens = {}     # tenant -> {"token", "warehouse_id", "expires_at"}
+        self._failed = {}     # tenant -> time until which a failed switch is not retried
+        self._in_flight = {}  # tenant -> Future
+        self._lock = Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats = {"hits": 0, "switches": 0, "coalesced": 0, "expired": 0, "failures": 0, "failed_hits": 0}
+
+    def switch(self, warehouse_id, tenant, warehouse_type='warehouse'):
+        """POST the auth switch for one warehouse and return the new token (None on failure)"""
+        url = f'{self.base_url}/api/user/auth/switch/{warehouse_type}/{warehouse_id}'
+        headers = {
+            'Authorization': f'{self.auth_token or os.getenv("PROD_TOKEN")}',
+            'Content-Type': 'application/json'
+        }
+        try:
+            print(f"Switching to tenant {tenant}")
+            response = self.session.post(url, headers=headers, timeout=TOKEN_HTTP_TIMEOUT)
+            if response.status_code == 200:
+                print(f"Token obtained for tenant: {tenant}")
+                return response.json()['token']
             print(f"Error switching to tenant {tenant}: {response.status_code} - {response.text}")
-            return None
-    except requests.RequestException as e:
-        print(f"Exception while switching tenant {tenant}: {e}")
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Exception while switching tenant {tenant}: {e}")
         return None
 
+    def switch_and_cache(self, warehouse_id, tenant, warehouse_type='warehouse'):
+        """switch() for an explicit warehouse; a token obtained replaces the tenant's cached one"""
+        token = self.switch(warehouse_id, tenant, warehouse_type)
+        if token is not None:
+            with self._lock:
+                self._tokens[tenant] = {"token": token, "warehouse_id": warehouse_id,
+                                        "expires_at": token_expiry(token, ttl=self.ttl)}
+                self._failed.pop(tenant, None)
+        return token
+
+    def _fetch(self, tenant):
+        warehouse_id = warehouse_id_for_tenant(tenant)
+        if not warehouse_id:
+            print(f"No warehouse found for tenant: {tenant}")
+            return None
+        token = self.switch(warehouse_id, tenant, warehouse_type_for(tenant))
+        if token is None:
+            return None
+        return {"token": token, "warehouse_id": warehouse_id, "expires_at": token_expiry(token, ttl=self.ttl)}
+
+    def get(self, tenant):
+        """Token for a tenant: cached until expiry_margin before it expires, else switched once"""
+        with self._lock:
+            entry = self._tokens.get(tenant)
+            if entry is not None:
+                if entry["expires_at"] - self.expiry_margin > time.time():
+                    self.stats["hits"] += 1
+                    return entry["token"]
+                del self._tokens[tenant]
+                self.stats["expired"] += 1
+            failed_until = self._failed.get(tenant)
+            if failed_until is not None:
+                if failed_until > time.time():
+                    self.stats["failed_hits"] += 1
+                    return None
+                del self._failed[tenant]
+            future = self._in_flight.get(tenant)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                owner = False
+            else:
+                future = self._in_flight[tenant] = Future()
+                self.stats["switches"] += 1
+                owner = True
+
+        if not owner:
+            entry = future.result()
+            return entry["token"] if entry else None
+
+        entry = None
+        try:
+            entry = self._fetch(tenant)
+        finally:
+            with self._lock:
+                del self._in_flight[tenant]
+                if entry is not None:
+                    self._tokens[tenant] = entry
+                else:
+                    self.stats["failures"] += 1
+                    if self.failure_ttl > 0:
+                        self._failed[tenant] = time.time() + self.failure_ttl
+            future.set_result(entry)
+        return entry["token"] if entry else None
+
+    def prewarm(self, tenants, max_workers=8):
+        """Fetch tokens for many tenants in parallel; returns {tenant: token or None}"""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(tenants, executor.map(self.get, tenants)))
+
+    def cached(self):
+        with self._lock:
+            return [
+                {'tenant': tenant, 'token': entry['token'], 'warehouse_id': entry['warehouse_id']}
+                for tenant, entry in self._tokens.items()
+            ]
+
+    def invalidate(self, tenant):
+        """Drop a tenant's token (e.g. after a 401) so the next get() switches again"""
+        with self._lock:
+            self._tokens.pop(tenant, None)
+            self._failed.pop(tenant, None)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._failed.clear()
+
+    def close(self):
+        self.session.close()
+
+    def print_stats(self):
+        stats = self.stats
+        print(
+            f"📊 Tokens: hits={stats['hits']} switches={stats['switches']} coalesced={stats['coalesced']} "
+            f"expired={stats['expired']} failures={stats['failures']} failed_hits={stats['failed_hits']}"
+        )
+
+
+# Process-wide token manager
+token_manager = TokenManager()
+
+
+def switch_token(warehouse_id, tenant , warehouse_type = 'warehouse'):
+    return token_manager.switch_and_cache(warehouse_id, tenant, warehouse_type)
+
 def get_token_for_tenant(tenant):
-    # Check if token already exists in cache
-    for cached_token in token_cache:
-        if cached_token['tenant'] == tenant:
-            print(f"Using cached token for tenant: {tenant}")
-            return cached_token['token']
-    
-    # If not in cache, fetch new token
-    print(f"Fetching new token for tenant: {tenant}")
-    connection = create_db_connection('mercury')
-    warehouse_id = fetch_warehouse_id(connection, tenant)
-    connection.close()
-    warehouse_type = 'arsenal' if tenant.startswith('ar') else 'warehouse'
-    if warehouse_id:
-        return switch_token(warehouse_id, tenant , warehouse_type)
-    else:
-        print(f"No warehouse found for tenant: {tenant}")
-        return None
+    return token_manager.get(tenant)
+
+def prewarm_tokens(tenants, max_workers=8):
+    return token_manager.prewarm(tenants, max_workers=max_workers)
 
 def get_cached_tokens():
-    return token_cache
+    return token_manager.cached()
 
 def clear_token_cache():
-    token_cache.clear()
-    print("Token cache cleared") 
\ No newline at end of file
+    token_manager.clear()
+    print("Token cache cleared")
@@ -0,0 +1,224 @@
+import os
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import requests
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from token_switcher import token_manager, WMS_BASE_URL
+from csv_utils import get_csv_writer, close_all_writers
+
+load_dotenv('config.env')
+
+WMS_MAX_WORKERS = int(os.getenv("WMS_MAX_WORKERS", "16"))            # concurrent API requests
+WMS_DEFAULT_RATE = float(os.getenv("WMS_DEFAULT_RATE", "10"))        # requests per second per endpoint
+WMS_MAX_RETRIES = int(os.getenv("WMS_MAX_RETRIES", "4"))             # retries on 429 / 5xx / connection errors
+WMS_BACKOFF_BASE = float(os.getenv("WMS_BACKOFF_BASE", "0.5"))       # seconds, doubled per attempt
+WMS_BACKOFF_MAX = 30.0
+WMS_REQUEST_TIMEOUT = float(os.getenv("WMS_REQUEST_TIMEOUT", "15"))
+
+# Endpoints used to cross-verify findings, as JSON:
+# {"name": {"path": "/api/.../{id}", "method": "GET", "rate": 10}}
+# `path` is formatted with the finding's id; `rate` is requests per second across all tenants (0 = no limit).
+WMS_ENDPOINTS = json.loads(os.getenv("WMS_ENDPOINTS", "{}"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Token bucket shared by every thread calling one endpoint; a rate of 0 means no limit"""
+
+    def __init__(self, rate, burst=None):
+        if rate < 0:
+            raise ValueError(f"Rate must be >= 0 requests per second, got {rate}")
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """Block until a request may be sent; returns the seconds waited"""
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class WmsClient:
+    """
+    WMS API calls made as a tenant, with the tenant's switched token from token_switcher.
+    Requests share one pooled keep-alive session, every endpoint has its own rate limit,
+    429 / 5xx / connection errors are retried with exponential backoff (honouring
+    Retry-After) and a 401 re-switches the tenant's token once.
+    """
+
+    def __init__(self, base_url=WMS_BASE_URL, tokens=token_manager, endpoints=None,
+                 max_workers=WMS_MAX_WORKERS, max_retries=WMS_MAX_RETRIES, timeout=WMS_REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.tokens = tokens
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.endpoints = {}
+        self._limiters = {}
+        self._lock = Lock()
+        for name, spec in (WMS_ENDPOINTS if endpoints is None else endpoints).items():
+            self.register_endpoint(name, spec["path"], spec.get("method", "GET"), spec.get("rate", WMS_DEFAULT_RATE))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "reauth": 0, "failures": 0, "rate_wait": 0.0}
+
+    def register_endpoint(self, name, path, method="GET", rate=WMS_DEFAULT_RATE):
+        self.endpoints[name] = {"path": path, "method": method.upper(), "rate": float(rate)}
+        self._limiters[name] = RateLimiter(float(rate))
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), WMS_BACKOFF_MAX)
+            except ValueError:
+                pass
+        return min(WMS_BACKOFF_BASE * (2 ** attempt), WMS_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+    def request(self, endpoint, tenant, id=None, params=None, json_body=None):
+        """
+        Call an endpoint as a tenant. Returns (status_code, body): body is the decoded JSON
+        (or text) of the final response. Raises requests.RequestException when the request
+        never got a response after all retries, and RuntimeError without a token.
+        """
+        spec = self.endpoints[endpoint]
+        url = self.base_url + spec["path"].format(id=id, tenant=tenant)
+        reauthed = False
+        attempt = 0
+        while True:
+            token = self.tokens.get(tenant)
+            if token is None:
+                raise RuntimeError(f"No WMS token for tenant {tenant}")
+            self._count("rate_wait", self._limiters[endpoint].acquire())
+            self._count("requests")
+            try:
+                response = self.session.request(
+                    spec["method"], url, params=params, json=json_body, timeout=self.timeout,
+                    headers={"Authorization": token, "Content-Type": "application/json"}
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code == 401 and not reauthed:
+                # Token revoked or expired early: switch again, once
+                self._count("reauth")
+                self.tokens.invalidate(tenant)
+                reauthed = True
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                self._count("throttled" if response.status_code == 429 else "retries")
+                time.sleep(self._backoff(attempt, response))
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                self._count("failures")
+            try:
+                return response.status_code, response.json()
+            except ValueError:
+                return response.status_code, response.text
+
+    def fetch_many(self, endpoint, pairs, max_workers=None):
+        """
+        Call an endpoint for many (tenant, id) pairs concurrently. Tokens for all the
+        tenants are switched up front in parallel; pairs of tenants without a token are
+        reported once and not requested. Yields (tenant, id, status, body, error) as each
+        call completes; status and body are None when error is set.
+        """
+        pairs = list(dict.fromkeys(pairs))
+        tenants = list(dict.fromkeys(tenant for tenant, _ in pairs))
+        tokens = self.tokens.prewarm(tenants, max_workers=min(len(tenants), self.max_workers) or 1)
+        failed = {tenant for tenant, token in tokens.items() if token is None}
+        if failed:
+            skipped = [(tenant, id) for tenant, id in pairs if tenant in failed]
+            print(f"❌ No WMS token for {len(failed)} tenants, skipping their {len(skipped)} lookups: {sorted(failed)}")
+            for tenant, id in skipped:
+                yield tenant, id, None, None, f"No WMS token for tenant {tenant}"
+            pairs = [(tenant, id) for tenant, id in pairs if tenant not in failed]
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers, thread_name_prefix="wms-client") as executor:
+            futures = {executor.submit(self.request, endpoint, tenant, id): (tenant, id) for tenant, id in pairs}
+            for future in as_completed(futures):
+                tenant, id = futures[future]
+                try:
+                    status, body = future.result()
+                    yield tenant, id, status, body, None
+                except Exception as e:
+                    yield tenant, id, None, None, str(e)
+
+    def close(self):
+        self.session.close()
+
+    def print_stats(self):
+        stats = self.stats
+        print(
+            f"📊 WMS API: requests={stats['requests']} retries={stats['retries']} throttled={stats['throttled']} "
+            f"reauth={stats['reauth']} failures={stats['failures']} rate_wait={stats['rate_wait']:.1f}s"
+        )
+
+
+def verifyFindings(endpoint, input_file, tenant_column, id_column, output_file, max_workers=None):
+    """Look up every (tenant, id) of a findings CSV through the API and write the responses"""
+    with open(input_file, newline="", encoding="utf-8") as f:
+        pairs = [(row[tenant_column], row[id_column]) for row in csv.DictReader(f) if row.get(id_column)]
+    print(f"🔎 Verifying {len(pairs)} findings from {input_file} against {endpoint}")
+
+    client = WmsClient()
+    writer = get_csv_writer(output_file, headers=["tenant", "id", "status", "response", "error"])
+    try:
+        for tenant, id, status, body, error in client.fetch_many(endpoint, pairs, max_workers):
+            writer.write([tenant, id, status, json.dumps(body) if body is not None else "", error or ""])
+    finally:
+        close_all_writers()
+        client.print_stats()
+        client.close()
+        token_manager.print_stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-verify recon findings against the WMS API")
+    parser.add_argument("endpoint", help="Endpoint name from WMS_ENDPOINTS")
+    parser.add_argument("input_file", help="Findings CSV")
+    parser.add_argument("--tenant-column", default="tenant")
+    parser.add_argument("--id-column", required=True, help="Column whose value is formatted into the endpoint path")
+    parser.add_argument("--output", default="wms_verification.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.endpoint not in WMS_ENDPOINTS:
+        print(f"❌ Unknown endpoint {args.endpoint}; configure it in WMS_ENDPOINTS (known: {', '.join(WMS_ENDPOINTS) or 'none'})")
+        sys.exit(1)
+    verifyFindings(args.endpoint, args.input_file, args.tenant_column, args.id_column, args.output, args.workers)
@@ -0,0 +1,246 @@
+import os
+import time
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ALL_COMPLETED, as_completed, wait as wait_futures
+from dotenv import load_dotenv
+
+from getDBConnection import get_host_key, POOL_MAX_SIZE
+from metrics import metrics
+
+load_dotenv('config.env')
+
+SCHEDULER_MAX_RUNNING = int(os.getenv("SCHEDULER_MAX_RUNNING", "48"))                  # units running at once
+SCHEDULER_MAX_ROOTS = int(os.getenv("SCHEDULER_MAX_ROOTS", "16"))                       # top-level units started and not finished
+# Pooled connections per host left to borrowers outside the scheduler (stream producers,
+# snapshot loads, query_batcher), so units never take the whole pool
+SCHEDULER_POOL_RESERVE = int(os.getenv("SCHEDULER_POOL_RESERVE", "4"))
+SCHEDULER_PER_HOST = int(os.getenv("SCHEDULER_PER_HOST", str(max(1, POOL_MAX_SIZE - SCHEDULER_POOL_RESERVE))))  # units running per DB host
+SCHEDULER_IDLE_SECONDS = 30  # idle worker threads exit after this long
+
+
+def host_label(db_name):
+    host, port, user, _ = get_host_key(db_name)
+    return f"{user}@{host}:{port}"
+
+
+class WorkUnit:
+    __slots__ = ("fn", "args", "kwargs", "tenant", "hosts", "future", "root")
+
+    def __init__(self, fn, args, kwargs, tenant, hosts, root=True):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.tenant = tenant
+        self.hosts = hosts
+        self.future = Future()
+        self.root = root  # submitted from outside any unit (e.g. a tenant scan), not a child unit
+
+
+class WorkScheduler:
+    """
+    One queue for every unit of DB work in the process (tenant fetch, batch compare,
+    destination probe). A unit names the databases it queries; it only starts when
+    the global cap and the cap of each of those DB hosts have room. Queued units are
+    kept per tenant and taken round-robin, so one large tenant cannot hold every slot.
+
+    A unit may submit child units and wait() for them: while it waits, its slots are
+    handed to the children, so nesting never deadlocks on the caps. Child units always
+    go before new root units, and at most max_roots root units are started and not
+    finished (running or waiting on children), which bounds what waiting parents hold.
+    """
+
+    def __init__(self, max_running=SCHEDULER_MAX_RUNNING, per_host=SCHEDULER_PER_HOST, max_roots=SCHEDULER_MAX_ROOTS):
+        limit = max(1, POOL_MAX_SIZE - SCHEDULER_POOL_RESERVE)
+        if per_host > limit:
+            print(f"⚠️ SCHEDULER_PER_HOST={per_host} leaves no pool headroom (DB_POOL_MAX_SIZE={POOL_MAX_SIZE}, "
+                  f"SCHEDULER_POOL_RESERVE={SCHEDULER_POOL_RESERVE}), using {limit}")
+            per_host = limit
+        self.max_running = max_running
+        self.per_host = per_host
+        self.max_roots = max_roots
+        self._cond = threading.Condition()
+        # tenant -> deque of units, in round-robin order; children of running or waiting units first
+        self._queues = {True: OrderedDict(), False: OrderedDict()}
+        self._queued = {True: 0, False: 0}
+        self._roots = 0  # root units started and not finished
+        self._running = 0
+        self._host_running = defaultdict(int)
+        self._threads = 0
+        self._idle = 0
+        self._local = threading.local()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "peak_running": 0, "peak_roots": 0}
+        self.host_peaks = defaultdict(int)
+
+    def submit(self, fn, *args, db=None, tenant=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs); db is the database (or list of databases) it queries
+        and tenant the fairness key (defaults to the first database). Returns a Future.
+        """
+        dbs = [] if db is None else [db] if isinstance(db, str) else list(db)
+        hosts = tuple(sorted({host_label(name) for name in dbs}))
+        root = getattr(self._local, "unit", None) is None
+        unit = WorkUnit(fn, args, kwargs, tenant or (dbs[0] if dbs else ""), hosts, root)
+        with self._cond:
+            self._queues[root].setdefault(unit.tenant, deque()).append(unit)
+            self._queued[root] += 1
+            self.stats["submitted"] += 1
+            self._dispatch_locked()
+        return unit.future
+
+    def wait(self, futures, return_when=ALL_COMPLETED):
+        """
+        concurrent.futures.wait() that, called from inside a unit, releases the unit's
+        slots while it waits so its children can run. Returns the done futures.
+        A unit must not hold a pooled connection (e.g. an open stream) while it waits.
+        """
+        futures = list(futures)
+        unit = getattr(self._local, "unit", None)
+        if unit is None:
+            return wait_futures(futures, return_when=return_when).done
+        with self._cond:
+            self._release_locked(unit)
+        try:
+            return wait_futures(futures, return_when=return_when).done
+        finally:
+            with self._cond:
+                while not self._has_room_locked(unit.hosts):
+                    self._cond.wait()
+                self._acquire_locked(unit)
+
+    def _has_room_locked(self, hosts):
+        return self._running < self.max_running and all(self._host_running[host] < self.per_host for host in hosts)
+
+    def _acquire_locked(self, unit):
+        self._running += 1
+        self.stats["peak_running"] = max(self.stats["peak_running"], self._running)
+        for host in unit.hosts:
+            self._host_running[host] += 1
+            self.host_peaks[host] = max(self.host_peaks[host], self._host_running[host])
+
+    def _release_locked(self, unit):
+        self._running -= 1
+        for host in unit.hosts:
+            self._host_running[host] -= 1
+        self._dispatch_locked()
+        self._cond.notify_all()
+
+    def _take_locked(self):
+        """
+        Head unit of the first tenant (in round-robin order) whose hosts have room:
+        child units first, then root units while fewer than max_roots are started
+        """
+        if self._running >= self.max_running:
+            return None
+        for root in (False, True):
+            if root and self._roots >= self.max_roots:
+                return None
+            queues = self._queues[root]
+            for tenant, queue in queues.items():
+                unit = queue[0]
+                if not self._has_room_locked(unit.hosts):
+                    continue
+                queue.popleft()
+                del queues[tenant]
+                if queue:
+                    queues[tenant] = queue  # back of the line
+                self._queued[root] -= 1
+                if root:
+                    self._roots += 1
+                    self.stats["peak_roots"] = max(self.stats["peak_roots"], self._roots)
+                self._acquire_locked(unit)
+                return unit
+        return None
+
+    def _dispatch_locked(self):
+        """Wake idle workers, or start new ones, for queued units that could run now"""
+        startable = self._queued[False] + min(self._queued[True], max(0, self.max_roots - self._roots))
+        wanted = min(startable, self.max_running - self._running)
+        if wanted <= 0:
+            return
+        if self._idle:
+            self._cond.notify_all()
+        for _ in range(wanted - self._idle):
+            self._threads += 1
+            threading.Thread(target=self._worker, name=f"recon-scheduler-{self._threads}", daemon=True).start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                unit = self._take_locked()
+                while unit is None:
+                    self._idle += 1
+                    woken = self._cond.wait(SCHEDULER_IDLE_SECONDS)
+                    self._idle -= 1
+                    unit = self._take_locked()
+                    if unit is None and not woken:
+                        self._threads -= 1
+                        return
+            self._run(unit)
+
+    def _run(self, unit):
+        if not unit.future.set_running_or_notify_cancel():
+            with self._cond:
+                if unit.root:
+                    self._roots -= 1
+                self._release_locked(unit)
+            return
+        self._local.unit = unit
+        started = time.monotonic()
+        try:
+            unit.future.set_result(unit.fn(*unit.args, **unit.kwargs))
+            failed = False
+        except BaseException as e:
+            unit.future.set_exception(e)
+            failed = True
+        finally:
+            self._local.unit = None
+            metrics.record_unit(unit.tenant, time.monotonic() - started)
+            with self._cond:
+                self.stats["completed"] += 1
+                self.stats["failed"] += failed
+                if unit.root:
+                    self._roots -= 1
+                self._release_locked(unit)
+
+    def set_max_roots(self, max_roots):
+        """Change how many root units (usually tenants) may be started and not finished"""
+        with self._cond:
+            self.max_roots = max(1, int(max_roots))
+            self._dispatch_locked()
+
+    def print_stats(self):
+        stats = self.stats
+        print(
+            f"📊 Scheduler: units={stats['completed']}/{stats['submitted']} failed={stats['failed']} "
+            f"peak_running={stats['peak_running']}/{self.max_running} peak_roots={stats['peak_roots']}/{self.max_roots}"
+        )
+        for host, peak in sorted(self.host_peaks.items()):
+            print(f"📊   {host}: peak {peak}/{self.per_host} units running")
+
+
+# Process-wide scheduler shared by every check
+scheduler = WorkScheduler()
+
+
+def for_each_tenant(tenants, process_tenant, *args, label="", **kwargs):
+    """
+    Run process_tenant(tenant, *args, **kwargs) for every tenant as a unit of the
+    scheduler on that tenant's host, logging each as it finishes. Returns the failed tenants.
+    """
+    futures = {scheduler.submit(process_tenant, tenant, *args, db=tenant, **kwargs): tenant for tenant in tenants}
+    failed = []
+    for future in as_completed(futures):
+        tenant = futures[future]
+        try:
+            future.result()
+            print(f"✅ Finished tenant: {tenant}")
+        except Exception as e:
+            print(f"❌ Error processing tenant {tenant}{' for ' + label if label else ''}: {e}")
+            failed.append(tenant)
+    return failed
+
+
+def print_scheduler_stats():
+    if scheduler.stats["submitted"]:
+        scheduler.print_stats()